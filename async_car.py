@@ -0,0 +1,199 @@
+import asyncio
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import httpx
+from dotenv import load_dotenv
+from battery import RESERVE_BATTERY
+from find_route import Route
+from instrumentation import count, stage
+from profiles import DEFAULT_CONSUMPTION
+
+#----------------------------------------------------------------
+# ASYNC SIMULATOR                                               |
+#----------------------------------------------------------------
+# One event loop drives every car as a coroutine. All HTTP calls share
+# a single keep-alive connection pool, bounded by a semaphore, and route
+# searches run in a process pool so they never block the loop.
+
+#-----------------------------+
+#       ROUTE WORKERS         |
+#-----------------------------+
+worker_route = None
+
+def init_route_worker(route: Route):
+    """
+    Keep the Route inherited from the parent process (fork) for the searches of this worker.
+    """
+    global worker_route
+    worker_route = route
+
+def compute_route(latitude, longitude, dest_lat, dest_long, battery=None):
+    worker_route.reload_delta()
+    worker_route.refresh_traffic()
+    with stage('find_route'):
+        return worker_route.find_route(latitude, longitude, dest_lat, dest_long,
+                                       consumption=float(os.getenv('CAR_CONSUMPTION', DEFAULT_CONSUMPTION)),
+                                       capacity=float(os.getenv('CAR_CAPACITY', 50)), battery=battery)
+
+#-----------------------------+
+#       SIMULATOR             |
+#-----------------------------+
+class AsyncSimulator():
+    def __init__(self, api_host: str, token: str, route: Route, executor: ProcessPoolExecutor,
+                 max_connections=100, point_interval=0.5, retry_interval=2, route_backoff=0.1, max_route_backoff=30):
+        self.api_host = api_host
+        self.route    = route
+        self.executor = executor
+        self.point_interval = point_interval
+        self.retry_interval = retry_interval
+        self.route_backoff  = route_backoff
+        self.max_route_backoff = max_route_backoff
+        self.delta_lock = asyncio.Lock()
+        self.headers = {
+            'accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {token}'
+        }
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.client = httpx.AsyncClient(
+            base_url=api_host,
+            headers=self.headers,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(10.0, pool=None),
+        )
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def patch(self, url: str, body: dict, call: str):
+        """
+        PATCH through the shared client, retrying until the API accepts it (same policy as virtual_car).
+        """
+        while True:
+            try:
+                async with self.semaphore:
+                    with stage('api', call=call):
+                        response = await self.client.patch(url, json=body)
+                response.raise_for_status()
+                if response.status_code == 200:
+                    return response
+            except httpx.HTTPError as error:
+                count('api_errors', call=call)
+                print(f"Error: {error}")
+            await asyncio.sleep(self.retry_interval)
+
+    async def update_location(self, car: dict, point: dict):
+        edge = car['edgedevice']['name']
+        location = {
+            "latitude": point['latitude'],
+            "longitude": point['longitude']
+        }
+        await self.patch(f'/api/v1/edge/location/{edge}', location, 'location')
+        car['edgedevice']['latitude']  = point['latitude']
+        car['edgedevice']['longitude'] = point['longitude']
+
+    async def update_battery(self, car: dict, battery: int):
+        licenseplate = car['car']['licenseplate']
+        await self.patch(f'/api/v1/car/{licenseplate}', {'battery': battery}, 'battery')
+        car['car']['battery'] = battery
+
+    async def execute_route(self, car: dict, route: dict):
+        battery = car['car']['battery']
+        desc_battery = 0
+        # Battery level at each point of the route (with the charging stops), when it was planned with the battery.
+        levels = route.get('battery')
+
+        for i, point in enumerate(route['route']):
+            await asyncio.sleep(self.point_interval)
+            desc_battery += 1
+            await self.update_location(car, point)
+            if levels is not None:
+                if round(levels[i]) != battery:
+                    battery = round(levels[i])
+                    await self.update_battery(car, battery)
+            elif (desc_battery == 20):
+                battery -= 1
+                desc_battery = 0
+                await self.update_battery(car, battery)
+
+    async def next_route(self, car: dict):
+        """
+        Pick random destinations until the route workers find a route from the current position,
+        waiting longer after each failed search (up to max_route_backoff seconds).
+        """
+        loop = asyncio.get_running_loop()
+        latitude  = float(car['edgedevice']['latitude'])
+        longitude = float(car['edgedevice']['longitude'])
+        if car['car']['battery'] <= RESERVE_BATTERY:
+            # Nowhere to go on the reserve: the car is recharged where it stands.
+            await self.update_battery(car, 100)
+        backoff = self.route_backoff
+        while True:
+            # Applying a delta rebuilds the graph: off the event loop, and one car at a time.
+            async with self.delta_lock:
+                await loop.run_in_executor(None, self.route.reload_delta)
+                dest_long, dest_lat = self.route.get_random_node()
+            if dest_lat == latitude and dest_long == longitude:
+                continue
+            try:
+                return await loop.run_in_executor(self.executor, compute_route, latitude, longitude, dest_lat, dest_long,
+                                                  car['car']['battery'])
+            except Exception as e:
+                count('route_errors')
+                print(f"Error: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(2 * backoff, self.max_route_backoff)
+
+    async def run_car(self, car: dict, routes=None):
+        """
+        Run the car autonomously around the city (forever, or for the given number of routes).
+        """
+        done = 0
+        while routes is None or done < routes:
+            car_route = await self.next_route(car)
+            await self.execute_route(car, car_route)
+            done += 1
+            print(f"""Finished route for car {car['car']['licenseplate']}""")
+
+    async def run(self, cars: list, routes=None):
+        await asyncio.gather(*(self.run_car(car, routes) for car in cars))
+
+#-----------------------------+
+#       ENTRY POINT           |
+#-----------------------------+
+async def main(api_host, username, password, route: Route, workers: int, max_connections: int, routes=None):
+    async with httpx.AsyncClient(base_url=api_host) as client:
+        response = await client.post('/api/v1/login/access-token', data={
+            'grant_type': 'password',
+            'username': username,
+            'password': password,
+            'scope': '',
+            'client_id': '',
+            'client_secret': '',
+        })
+        response.raise_for_status()
+        token = response.json().get('access_token')
+        result = await client.get('/api/v1/car')
+        cars = result.json()
+
+    ctx = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=init_route_worker, initargs=(route,)) as executor:
+        simulator = AsyncSimulator(api_host, token, route, executor, max_connections=max_connections)
+        try:
+            await simulator.run(cars['data'], routes)
+        finally:
+            await simulator.close()
+
+if __name__ == '__main__':
+    load_dotenv()
+    api_host = os.getenv('API_HOST')
+    username = os.getenv('USERNAME')
+    password = os.getenv('PASSWORD')
+    workers = int(os.getenv('ROUTE_WORKERS', os.cpu_count() or 1))
+    max_connections = int(os.getenv('MAX_CONNECTIONS', 100))
+    routes = int(sys.argv[1]) if len(sys.argv) > 1 else None
+
+    route = Route(route_cache_path=os.getenv('ROUTE_CACHE_PATH'))
+    asyncio.run(main(api_host, username, password, route, workers, max_connections, routes))
@@ -0,0 +1,35 @@
+import json
+
+CHARGING_STATIONS_FILE = "inputs/charging_stations.json"
+DEFAULT_CHARGING_POWER = 50.0            # kW
+CHARGE_TARGETS         = (0.5, 0.8, 1.0) # fraccions de la capacitat fins on es pot carregar en una parada
+CHARGE_TAPER           = 0.8             # a partir d'aquesta fracció la càrrega va a la meitat de potència
+CHARGE_OVERHEAD        = 300             # s per parada (desviar-se, connectar, pagar)
+MAX_CHARGING_STOPS     = 3
+RESERVE_BATTERY        = 5.0             # % de bateria que no es gasta mai
+
+def charge_seconds(soc, target, capacity, power):
+    """
+    Calcula el temps de càrrega (sense la parada) entre dos estats de càrrega, amb la potència reduïda a la meitat
+    per sobre de CHARGE_TAPER.
+
+    PRE: soc <= target són kWh; capacity en kWh; power en kW.
+    POST: retorna els segons de càrrega.
+    """
+    llindar = CHARGE_TAPER * capacity
+    rapida = max(0.0, min(target, llindar) - soc)
+    lenta = max(0.0, target - max(soc, llindar))
+    return (rapida / power + lenta / (power / 2)) * 3600
+
+def load_charging_stations(path=CHARGING_STATIONS_FILE):
+    """
+    Llegeix els punts de càrrega d'un fitxer JSON (pre/ingesta_osm.py els extreu d'OSM).
+
+    PRE: path és una llista JSON d'objectes amb "longitude" i "latitude" (o "node_id") i, opcionalment, "power_kw".
+    POST: retorna la llista (buida si el fitxer no existeix).
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except OSError:
+        return []
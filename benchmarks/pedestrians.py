@@ -0,0 +1,85 @@
+import argparse
+import os
+import random
+import sys
+import time
+import mongomock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pedestrian_state import PedestrianState
+
+#----------------------------------------------------------------
+# PEDESTRIAN LOOKUP BENCHMARK                                   |
+#----------------------------------------------------------------
+# Compares the per-call rebuild that prevent_accident.main used to do
+# (query every street with pedestrians and build a dict) against the
+# long-lived PedestrianState, on a mongomock collection:
+#
+#   python benchmarks/pedestrians.py --streets 20000 --calls 2000
+
+def make_collection(streets: int, fraction: float, seed=0):
+    rng = random.Random(seed)
+    collection = mongomock.MongoClient()['cloud']['carrer']
+    collection.insert_many([{
+        'coordenades': {'longitud': round(1.70 + rng.random() * 0.05, 7), 'latitud': round(41.20 + rng.random() * 0.05, 7)},
+        'vianants': rng.random() < fraction,
+    } for _ in range(streets)])
+    return collection
+
+def make_route(collection, length: int, seed=0):
+    rng = random.Random(seed)
+    documents = list(collection.find({}, {'coordenades': 1}))
+    return [{'longitud': d['coordenades']['longitud'], 'latitud': d['coordenades']['latitud']}
+            for d in rng.sample(documents, length)]
+
+def rebuild_lookup(collection, ruta, posicio_actual):
+    nodes_vianants_dict = { (node["coordenades"]["longitud"], node["coordenades"]["latitud"]): node['vianants'] for node in collection.find({"vianants": True}) }
+    index_actual = ruta.index(posicio_actual)
+    if index_actual + 1 >= len(ruta):
+        return False
+    seguent_node = ruta[index_actual + 1]
+    return nodes_vianants_dict.get((seguent_node['longitud'], seguent_node['latitud']), False)
+
+def state_lookup(state, ruta, posicio_actual):
+    seguent = state.lookahead(ruta, posicio_actual, 1)
+    return seguent[0] if seguent else False
+
+def timed(function, calls):
+    start = time.perf_counter()
+    results = [function(ruta, posicio) for ruta, posicio in calls]
+    return time.perf_counter() - start, results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-call rebuild vs. incremental pedestrian state.')
+    parser.add_argument('--streets', type=int, default=20000)
+    parser.add_argument('--fraction', type=float, default=0.2, help='fraction of streets with pedestrians')
+    parser.add_argument('--route-length', type=int, default=500)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--lookahead', type=int, default=10)
+    args = parser.parse_args()
+
+    collection = make_collection(args.streets, args.fraction)
+    ruta = make_route(collection, args.route_length)
+    rng = random.Random(1)
+    calls = [(ruta, rng.choice(ruta)) for _ in range(args.calls)]
+
+    rebuild_time, expected = timed(lambda r, p: rebuild_lookup(collection, r, p), calls)
+
+    start = time.perf_counter()
+    state = PedestrianState(collection)
+    load_time = time.perf_counter() - start
+    state_time, results = timed(lambda r, p: state_lookup(state, r, p), calls)
+    lookahead_time, _ = timed(lambda r, p: state.lookahead(r, p, args.lookahead), calls)
+
+    collection.update_many({'vianants': True}, {'$set': {'vianants': False}})
+    start = time.perf_counter()
+    refresh = state.refresh()
+    refresh_time = time.perf_counter() - start
+
+    assert results == expected, 'PedestrianState disagrees with the per-call rebuild'
+    print(f'streets={args.streets} calls={args.calls} route={args.route_length}')
+    print(f'per-call rebuild : {rebuild_time / args.calls * 1e3:9.3f} ms/call')
+    print(f'state (load once): {load_time * 1e3:9.3f} ms')
+    print(f'state next node  : {state_time / args.calls * 1e6:9.3f} us/call ({rebuild_time / state_time:.0f}x)')
+    print(f'state lookahead  : {lookahead_time / args.calls * 1e6:9.3f} us/call (k={args.lookahead})')
+    print(f'polling refresh  : {refresh_time * 1e3:9.3f} ms (added, removed) = {refresh}')
@@ -0,0 +1,133 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#----------------------------------------------------------------
+# ROUTE SERVER LOAD GENERATOR                                   |
+#----------------------------------------------------------------
+# Sends random /route (and optionally /matrix) requests to route_server.py
+# from concurrent keep-alive connections and reports throughput and the
+# client-side p50/p99 latency next to the server's own /stats. With --local
+# the server is started in-process on a free port, so the whole run is
+# offline (run it from the directory that has inputs/):
+#
+#   python benchmarks/route_load.py --local --workers 2 --requests 2000 --concurrency 32
+
+CENTER_LAT, CENTER_LONG = 41.2237, 1.7253
+SPREAD = 0.015
+PROFILES = (None, 'shortest', 'fastest', 'energy')
+
+def random_point(rng):
+    return {'latitude': CENTER_LAT + rng.uniform(-SPREAD, SPREAD), 'longitude': CENTER_LONG + rng.uniform(-SPREAD, SPREAD)}
+
+def make_requests(count: int, matrix_every: int, matrix_size: int, repeat: float, seed=0):
+    """
+    Random requests; a fraction `repeat` reuses an earlier /route body (popular origin/destination pairs).
+    """
+    rng = random.Random(seed)
+    requests = []
+    for i in range(count):
+        if matrix_every and i % matrix_every == matrix_every - 1:
+            requests.append(('/matrix', {'origins': [random_point(rng) for _ in range(matrix_size)],
+                                         'destinations': [random_point(rng) for _ in range(matrix_size)]}))
+        elif requests and rng.random() < repeat:
+            requests.append(rng.choice([request for request in requests if request[0] == '/route'] or requests))
+        else:
+            body = {'origin': random_point(rng), 'destination': random_point(rng)}
+            profile = rng.choice(PROFILES)
+            if profile:
+                body['profile'] = profile
+            requests.append(('/route', body))
+    return requests
+
+class Client():
+    """
+    One keep-alive HTTP connection per thread.
+    """
+    def __init__(self, url: str):
+        self.url = urlsplit(url)
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=120)
+        return self.local.connection
+
+    def request(self, method: str, path: str, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        for attempt in range(2):
+            connection = self.connection()
+            try:
+                connection.request(method, path, body=data, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                return response.status, json.loads(response.read())
+            except (ConnectionError, http.client.HTTPException):
+                connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise
+
+def run(url: str, requests, concurrency: int):
+    client = Client(url)
+
+    def send(request):
+        path, body = request
+        start = time.perf_counter()
+        status, _ = client.request('POST', path, body)
+        return path, status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(send, requests))
+    return time.perf_counter() - start, results, client.request('GET', '/stats')[1]
+
+def report(elapsed, results, stats):
+    print(f"{len(results)} requests in {elapsed:.2f} s: {len(results) / elapsed:.1f} req/s")
+    for path in sorted({path for path, _, _ in results}):
+        latencies = np.array([seconds for p, _, seconds in results if p == path])
+        statuses = {}
+        for p, status, _ in results:
+            if p == path:
+                statuses[status] = statuses.get(status, 0) + 1
+        print(f"  {path}: {len(latencies)} requests, status {statuses}, "
+              f"client p50 {np.percentile(latencies, 50) * 1e3:.1f} ms, p99 {np.percentile(latencies, 99) * 1e3:.1f} ms")
+    print('Server stats:', json.dumps(stats, indent=2))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load generator for route_server.py.')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--local', action='store_true', help='start the route server in-process on a free port')
+    parser.add_argument('--workers', type=int, default=None, help='route workers of the --local server')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--matrix-every', type=int, default=0, help='send a /matrix request every N requests (0: never)')
+    parser.add_argument('--matrix-size', type=int, default=10)
+    parser.add_argument('--repeat', type=float, default=0.2, help='fraction of /route requests that repeat an earlier one')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    url, server = args.url, None
+    if args.local:
+        from find_route import Route
+        from route_server import make_server
+        server = make_server(Route(), port=0, workers=args.workers)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    requests = make_requests(args.requests, args.matrix_every, args.matrix_size, args.repeat, args.seed)
+    try:
+        report(*run(url, requests, args.concurrency))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,301 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+#----------------------------------------------------------------
+# ROUTING BENCHMARK                                             |
+#----------------------------------------------------------------
+# Seeded origin/destination sets over the Vilanova graph (inputs/ of the
+# current directory) and over synthetic n x n street grids. For every graph
+# it measures the load time (JSON and compiled cache), the snap time, the
+# preprocessing time, the latency percentiles of each search engine, the
+# settled nodes per query and the peak RSS. Each graph runs in a fresh
+# process inside a temporary directory, so the RSS is its own and the
+# caches under inputs/ are never touched.
+#
+#   python benchmarks/routing.py --grids 50 100 --output bench.json
+#   python benchmarks/routing.py --grids 50 100 --baseline bench.json --threshold 0.2
+#
+# With --baseline the run is compared metric by metric and the script exits
+# with status 1 if anything got slower (or bigger) than the threshold allows,
+# or if the engines disagree on a route cost.
+
+ENGINES = {
+    # name: (engine of Route.search, simplify)
+    'ucs-plain':     ('ucs', False),
+    'astar-plain':   ('astar', False),
+    'ucs':           ('ucs', True),
+    'astar':         ('astar', True),
+    'bidirectional': ('bidirectional', True),
+    'ch':            ('ch', True),
+}
+GRID_SPACING    = 0.0006     # degrees between streets (~65 m)
+GRID_ORIGIN     = (1.70, 41.20)
+GRID_REMOVED    = 0.10       # fraction of streets removed
+GRID_ONE_WAY    = 0.10       # fraction of one-way streets
+COST_TOLERANCE  = 1e-9
+# Metrics checked against the baseline (lower is better; the tail percentiles are too noisy) and the
+# absolute difference, per unit, below which a change is noise.
+COMPARED        = ('_s', 'p50_ms', 'mean_ms', 'p50_us', 'per_point_us', 'peak_rss_mb', 'settled_mean')
+NOISE           = {'s': 0.01, 'ms': 0.1, 'us': 5.0, 'mb': 2.0}
+
+#-----------------------------+
+#       GRAPHS                |
+#-----------------------------+
+def write_grid(directory: str, n: int, seed=0):
+    """
+    Write an n x n street grid as inputs/connection_nodes.json and inputs/info_nodes.json, with a fraction
+    of the streets removed or one-way and a random speed per street.
+    """
+    from spatial_index import haversine_array
+    rng = random.Random(seed)
+    ids = [10_000_000 + i for i in range(n * n)]
+    coordinates = [(GRID_ORIGIN[0] + (i % n) * GRID_SPACING * 1.33, GRID_ORIGIN[1] + (i // n) * GRID_SPACING) for i in range(n * n)]
+    connections = []
+    for i in range(n * n):
+        for j in ((i + 1) if i % n < n - 1 else None, (i + n) if i + n < n * n else None):
+            if j is None or rng.random() < GRID_REMOVED:
+                continue
+            distance = float(haversine_array(*coordinates[i], np.array([coordinates[j][0]]), np.array([coordinates[j][1]]))[0])
+            time_ = distance / (rng.uniform(30, 50) / 3.6)
+            pairs = [(i, j), (j, i)]
+            if rng.random() < GRID_ONE_WAY:
+                pairs = [rng.choice(pairs)]
+            connections += [{'node1': ids[u], 'node2': ids[v], 'distance': distance, 'time': time_} for u, v in pairs]
+    os.makedirs(os.path.join(directory, 'inputs'), exist_ok=True)
+    with open(os.path.join(directory, 'inputs', 'connection_nodes.json'), 'w') as f:
+        json.dump(connections, f)
+    with open(os.path.join(directory, 'inputs', 'info_nodes.json'), 'w') as f:
+        json.dump([{'node_id': _id, 'coordinates': {'longitude': lon, 'latitude': lat}, 'address': None, 'status': 'disponible'}
+                   for _id, (lon, lat) in zip(ids, coordinates)], f)
+
+def copy_inputs(source: str, directory: str):
+    os.makedirs(os.path.join(directory, 'inputs'), exist_ok=True)
+    for name in ('connection_nodes.json', 'info_nodes.json'):
+        shutil.copy(os.path.join(source, 'inputs', name), os.path.join(directory, 'inputs', name))
+
+def query_points(route, count: int, seed: int):
+    """
+    Seeded random (origin, destination) points inside the bounding box of the graph.
+    """
+    rng = random.Random(seed)
+    coordinates = np.array(list(route.coordinates_nodes.values()), dtype=np.float64)
+    (min_lon, min_lat), (max_lon, max_lat) = np.nanmin(coordinates, axis=0), np.nanmax(coordinates, axis=0)
+    point = lambda: (rng.uniform(min_lon, max_lon), rng.uniform(min_lat, max_lat))
+    return [(point(), point()) for _ in range(count)]
+
+#-----------------------------+
+#       MEASUREMENT           |
+#-----------------------------+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def percentiles(seconds, scale: float, unit: str):
+    values = np.asarray(seconds, dtype=np.float64) * scale
+    return {f'p50_{unit}': round(float(np.percentile(values, 50)), 4),
+            f'p90_{unit}': round(float(np.percentile(values, 90)), 4),
+            f'p99_{unit}': round(float(np.percentile(values, 99)), 4),
+            f'mean_{unit}': round(float(values.mean()), 4)}
+
+def run_engine(route, name: str, pairs):
+    engine, simplify = ENGINES[name]
+    route.simplify = simplify
+    latencies, costs = [], []
+    for origin, dest in pairs:
+        (_, cost, _, _), seconds = timed(route.search, origin, dest, engine)
+        latencies.append(seconds)
+        costs.append(cost)
+    return latencies, costs
+
+def count_settled(route, name: str, pairs):
+    """
+    Mean settled nodes per query, from the search statistics of the instrumentation (enabled only for this
+    pass, so the latencies are measured without it).
+    """
+    import instrumentation
+    key = ('search_settled', (('engine', ENGINES[name][0]),))
+    before = instrumentation.REGISTRY.counters[key]
+    previous = instrumentation.enable()
+    try:
+        run_engine(route, name, pairs)
+    finally:
+        instrumentation.enable(previous)
+    return (instrumentation.REGISTRY.counters[key] - before) / max(1, len(pairs))
+
+def bench_graph(directory: str, engines, queries: int, seed: int):
+    """
+    Benchmark the graph under directory/inputs (runs in its own process; changes the working directory).
+    """
+    from find_route import Route
+    from graph_cache import compile_graph
+    os.chdir(directory)
+    result = {}
+
+    # No route cache: every query runs the full search.
+    route, load_json = timed(Route, graph_cache=None, route_cache_size=0)
+    compile_graph(route)
+    route, load_cache = timed(Route, route_cache_size=0)
+    result['load_json_s'], result['load_cache_s'] = round(load_json, 4), round(load_cache, 4)
+    result['nodes'], result['edges'] = len(route.adjacent_list), route.adjacent_list.num_edges
+
+    points = query_points(route, queries, seed)
+    flat = [p for pair in points for p in pair]
+    snapped, seconds = [], []
+    for p in flat:
+        node, elapsed = timed(route.find_closest_node, p, route.coordinates_nodes)
+        snapped.append(node)
+        seconds.append(elapsed)
+    result['snap'] = percentiles(seconds, 1e6, 'us')
+    many, elapsed = timed(route.snap_many, flat)
+    result['snap']['many_per_point_us'] = round(elapsed / len(flat) * 1e6, 4)
+    if many != snapped:
+        result['snap']['mismatches'] = sum(a != b for a, b in zip(many, snapped))
+    pairs = list(zip(snapped[0::2], snapped[1::2]))
+
+    _, simplify_build = timed(route.simplified_graph)
+    _, ch_build = timed(route.contraction_hierarchy)
+    result['simplify_build_s'], result['ch_build_s'] = round(simplify_build, 4), round(ch_build, 4)
+
+    result['engines'], reference = {}, None
+    for name in engines:
+        latencies, costs = run_engine(route, name, pairs)
+        stats = percentiles(latencies, 1e3, 'ms')
+        stats['found'] = sum(math.isfinite(cost) for cost in costs)
+        stats['settled_mean'] = round(count_settled(route, name, pairs), 2)
+        if reference is None:
+            reference = costs
+        else:
+            stats['mismatches'] = sum(not (a == b or abs(a - b) <= COST_TOLERANCE * max(1.0, abs(a)))
+                                      for a, b in zip(reference, costs))
+        result['engines'][name] = stats
+
+    # ru_maxrss is in kB on Linux and in bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_rss_mb'] = round(maxrss / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+    return result
+
+def run_graph(prepare, engines, queries: int, seed: int):
+    """
+    Prepare a temporary directory with prepare(directory) and benchmark it in a fresh spawned process.
+    """
+    with tempfile.TemporaryDirectory(prefix='routing-bench-') as directory:
+        prepare(directory)
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            return executor.submit(bench_graph, directory, engines, queries, seed).result()
+
+#-----------------------------+
+#       BASELINE              |
+#-----------------------------+
+def flatten(results, prefix=''):
+    metrics = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)):
+            metrics[f'{prefix}{key}'] = value
+    return metrics
+
+def compare(results, baseline, threshold: float):
+    """
+    Metrics of results['graphs'] that regressed against the baseline: metrics in COMPARED more than
+    `threshold` (relative) above it, and any engine cost mismatches.
+    """
+    current, previous = flatten(results['graphs']), flatten(baseline.get('graphs', {}))
+    regressions = []
+    for metric, value in sorted(current.items()):
+        if metric.endswith('mismatches') and value:
+            regressions.append((metric, previous.get(metric, 0), value))
+            continue
+        if metric not in previous or not metric.endswith(COMPARED):
+            continue
+        old = previous[metric]
+        if value - old < NOISE.get(metric.rsplit('_', 1)[-1], 0.0):
+            continue
+        if value > old * (1 + threshold):
+            regressions.append((metric, old, value))
+    return regressions
+
+def metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit or None,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': args.seed,
+        'queries': args.queries,
+        'engines': args.engines,
+    }
+
+def report(results):
+    for name, graph in results['graphs'].items():
+        print(f"{name}: {graph['nodes']} nodes, {graph['edges']} edges, peak RSS {graph['peak_rss_mb']} MB")
+        print(f"  load {graph['load_json_s']:.3f} s (JSON), {graph['load_cache_s']:.3f} s (cache); "
+              f"snap p50 {graph['snap']['p50_us']:.1f} us, batched {graph['snap']['many_per_point_us']:.1f} us/point; "
+              f"build simplify {graph['simplify_build_s']:.3f} s, CH {graph['ch_build_s']:.3f} s")
+        for engine, stats in graph['engines'].items():
+            print(f"  {engine:14s} p50 {stats['p50_ms']:9.3f} ms  p90 {stats['p90_ms']:9.3f} ms  p99 {stats['p99_ms']:9.3f} ms  "
+                  f"settled {stats['settled_mean']:10.1f}  found {stats['found']}  mismatches {stats.get('mismatches', '-')}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Routing benchmark with seeded query sets and baseline comparison.')
+    parser.add_argument('--grids', type=int, nargs='*', default=[50, 100], help='side of the synthetic n x n grid graphs')
+    parser.add_argument('--no-vilanova', action='store_true', help='skip the graph in inputs/ of the current directory')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown that counts as a regression')
+    args = parser.parse_args()
+
+    graphs = []
+    if not args.no_vilanova:
+        if os.path.exists(os.path.join('inputs', 'connection_nodes.json')):
+            graphs.append(('vilanova', lambda directory, source=os.getcwd(): copy_inputs(source, directory)))
+        else:
+            print('No inputs/connection_nodes.json here: skipping the Vilanova graph.', file=sys.stderr)
+    graphs += [(f'grid-{n}', lambda directory, n=n: write_grid(directory, n, args.seed)) for n in args.grids]
+
+    results = {'meta': metadata(args), 'graphs': {}}
+    for name, prepare in graphs:
+        results['graphs'][name] = run_graph(prepare, args.engines, args.queries, args.seed)
+    report(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        changed = [key for key in ('seed', 'queries', 'engines') if baseline.get('meta', {}).get(key) != results['meta'][key]]
+        if changed:
+            print(f"Warning: the baseline was run with different {', '.join(changed)}.", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        for metric, old, new in regressions:
+            print(f'REGRESSION {metric}: {old} -> {new}')
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (threshold {args.threshold:.0%}).")
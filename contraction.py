@@ -0,0 +1,233 @@
+import hashlib
+import heapq
+import itertools
+import os
+import sys
+import numpy as np
+from graph import CSRGraph
+
+CH_FORMAT_VERSION = 1
+
+def graph_signature(graph: CSRGraph):
+    """
+    Calcula una signatura del graf (topologia i pesos) per lligar-hi la jerarquia desada.
+
+    PRE: graf és un CSRGraph.
+    POST: retorna el hash SHA-256 en hexadecimal.
+    """
+    return hashlib.sha256(f"{CH_FORMAT_VERSION}:{graph.signature()}".encode()).hexdigest()
+
+def to_csr(n, edges):
+    """
+    Agrupa una llista d'arestes (node, veí, pes, aresta) per node en arrays CSR.
+
+    PRE: n és el nombre de nodes; arestes és una llista de tuples (node, veí, pes, id d'aresta).
+    POST: retorna (offsets, veïns, pesos, ids d'aresta).
+    """
+    edges.sort(key=lambda aresta: aresta[0])
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(np.array([a[0] for a in edges], dtype=np.int64), minlength=n), out=offsets[1:])
+    return (offsets,
+            np.array([a[1] for a in edges], dtype=np.int32),
+            np.array([a[2] for a in edges], dtype=np.float64),
+            np.array([a[3] for a in edges], dtype=np.int64))
+
+class ContractionHierarchy():
+    """
+    Jerarquia de contracció (Contraction Hierarchies) sobre un CSRGraph.
+
+    Els IDs d'aresta menors que el nombre d'arestes del graf són arestes originals; la resta són dreceres
+    (shortcuts), que es desempaqueten recursivament a partir de shortcuts[id - num_edges] = (primera, segona).
+    up conté, per a cada node, les arestes cap a nodes de rang superior; down conté, per a cada node v,
+    les arestes originals u -> v amb u de rang superior (la cerca enrere les recorre al revés).
+    """
+    def __init__(self, graph: CSRGraph, rank, up, down, shortcuts, signature):
+        self.graph     = graph
+        self.rank      = rank
+        self.up        = up
+        self.down      = down
+        self.shortcuts = shortcuts
+        self.signature = signature
+        self.views     = tuple(tuple(memoryview(np.ascontiguousarray(a)) for a in costat) for costat in (up, down))
+
+    @classmethod
+    def build(cls, graph: CSRGraph, settle_limit=64):
+        """
+        Contrau tots els nodes del graf en ordre de prioritat (diferència d'arestes + veïns contrets),
+        afegint una drecera u -> w per cada camí u -> v -> w que no té cap testimoni més curt que eviti v.
+
+        PRE: graf és un CSRGraph; settle_limit limita els nodes fixats a cada cerca de testimonis
+            (un límit baix només pot afegir dreceres innecessàries, mai treure'n de necessàries).
+        POST: retorna la ContractionHierarchy del graf.
+        """
+        n, num_edges = len(graph), graph.num_edges
+        sortints = [dict() for _ in range(n)]
+        entrants = [dict() for _ in range(n)]
+        for aresta, (u, v, pes) in enumerate(zip(graph.sources().tolist(), graph.targets.tolist(), graph.weight.tolist())):
+            if u != v and (v not in sortints[u] or pes < sortints[u][v][0]):
+                sortints[u][v] = entrants[v][u] = (pes, aresta)
+
+        def testimonis(origen, exclos, limit):
+            distancies = {origen: 0.0}
+            queue = [(0.0, origen)]
+            fixats = 0
+            while queue and fixats < settle_limit:
+                cost, node = heapq.heappop(queue)
+                if cost > distancies[node]:
+                    continue
+                if cost > limit:
+                    break
+                fixats += 1
+                for vei, (pes, _) in sortints[node].items():
+                    nou_cost = cost + pes
+                    if vei != exclos and nou_cost < distancies.get(vei, float('inf')):
+                        distancies[vei] = nou_cost
+                        heapq.heappush(queue, (nou_cost, vei))
+            return distancies
+
+        def dreceres(v):
+            necessaries = []
+            if not sortints[v]:
+                return necessaries
+            maxim_sortint = max(pes for pes, _ in sortints[v].values())
+            for u, (pes_u, primera) in entrants[v].items():
+                distancies = testimonis(u, v, pes_u + maxim_sortint)
+                for w, (pes_w, segona) in sortints[v].items():
+                    if w != u and distancies.get(w, float('inf')) > pes_u + pes_w:
+                        necessaries.append((u, w, pes_u + pes_w, primera, segona))
+            return necessaries
+
+        veins_contrets = [0] * n
+
+        def prioritat(v):
+            return len(dreceres(v)) - len(entrants[v]) - len(sortints[v]) + veins_contrets[v]
+
+        queue = [(prioritat(v), v) for v in range(n)]
+        heapq.heapify(queue)
+        rank = np.empty(n, dtype=np.int32)
+        shortcuts, arestes_up, arestes_down = [], [], []
+        nivell = 0
+        while queue:
+            _, v = heapq.heappop(queue)
+            nova = prioritat(v)
+            if queue and nova > queue[0][0]:
+                heapq.heappush(queue, (nova, v))
+                continue
+            for u, w, pes, primera, segona in dreceres(v):
+                if w not in sortints[u] or pes < sortints[u][w][0]:
+                    sortints[u][w] = entrants[w][u] = (pes, num_edges + len(shortcuts))
+                    shortcuts.append((primera, segona))
+            rank[v] = nivell
+            nivell += 1
+            for w, (pes, aresta) in sortints[v].items():
+                arestes_up.append((v, w, pes, aresta))
+                del entrants[w][v]
+                veins_contrets[w] += 1
+            for u, (pes, aresta) in entrants[v].items():
+                arestes_down.append((v, u, pes, aresta))
+                del sortints[u][v]
+                veins_contrets[u] += 1
+            sortints[v], entrants[v] = {}, {}
+        return cls(graph, rank, to_csr(n, arestes_up), to_csr(n, arestes_down),
+                   np.array(shortcuts, dtype=np.int64).reshape(-1, 2), graph_signature(graph))
+
+    def save(self, path):
+        """
+        Desa la jerarquia (rangs, grafs ascendents i dreceres) en un fitxer .npz de manera atòmica.
+        """
+        directori = os.path.dirname(path)
+        if directori:
+            os.makedirs(directori, exist_ok=True)
+        temporal = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(temporal, rank=self.rank, shortcuts=self.shortcuts, signature=np.array(self.signature),
+                 **{f"up_{i}": a for i, a in enumerate(self.up)}, **{f"down_{i}": a for i, a in enumerate(self.down)})
+        os.replace(temporal, path)
+
+    @classmethod
+    def load(cls, path, graph: CSRGraph):
+        """
+        Carrega una jerarquia desada si correspon al graf indicat.
+
+        PRE: path és el fitxer .npz desat per save; graf és el CSRGraph actual.
+        POST: retorna la ContractionHierarchy o None si el fitxer no existeix o és d'un altre graf.
+        """
+        try:
+            dades = np.load(path)
+        except (OSError, ValueError):
+            return None
+        with dades:
+            signatura = str(dades['signature'])
+            if signatura != graph_signature(graph):
+                return None
+            return cls(graph, dades['rank'], tuple(dades[f"up_{i}"] for i in range(4)),
+                       tuple(dades[f"down_{i}"] for i in range(4)), dades['shortcuts'], signatura)
+
+    def unpack(self, edge):
+        """
+        Desempaqueta una aresta (original o drecera) en la seqüència d'arestes originals que representa.
+
+        PRE: aresta és un ID d'aresta de la jerarquia.
+        POST: retorna la llista d'IDs d'arestes originals en ordre.
+        """
+        num_edges = self.graph.num_edges
+        originals, pila = [], [edge]
+        while pila:
+            aresta = pila.pop()
+            if aresta < num_edges:
+                originals.append(aresta)
+            else:
+                primera, segona = self.shortcuts[aresta - num_edges].tolist()
+                pila.append(segona)
+                pila.append(primera)
+        return originals
+
+    def query(self, origin: int, dest: int):
+        """
+        Cerca bidireccional ascendent: endavant des de l'origen pel graf up i enrere des del destí pel graf down.
+
+        PRE: origen i desti són índexs de nodes del graf.
+        POST: retorna la llista d'arestes originals del camí òptim, o None si no n'hi ha.
+        """
+        if origin == dest:
+            return []
+        millors = ({origin: 0.0}, {dest: 0.0})
+        predecessors = ({origin: None}, {dest: None})
+        queues = ([(0.0, origin)], [(0.0, dest)])
+        mu, trobada = float('inf'), None
+        while True:
+            candidats = [sentit for sentit in (0, 1) if queues[sentit] and queues[sentit][0][0] < mu]
+            if not candidats:
+                break
+            sentit = min(candidats, key=lambda s: queues[s][0][0])
+            cost, node = heapq.heappop(queues[sentit])
+            if cost > millors[sentit][node]:
+                continue
+            altres = millors[1 - sentit]
+            if node in altres and cost + altres[node] < mu:
+                mu, trobada = cost + altres[node], node
+            offsets, targets, weights, edges = self.views[sentit]
+            for posicio in range(offsets[node], offsets[node + 1]):
+                vei, nou_cost = targets[posicio], cost + weights[posicio]
+                if nou_cost < millors[sentit].get(vei, float('inf')):
+                    millors[sentit][vei] = nou_cost
+                    predecessors[sentit][vei] = (node, edges[posicio])
+                    heapq.heappush(queues[sentit], (nou_cost, vei))
+        if trobada is None:
+            return None
+        endavant, node = [], trobada
+        while predecessors[0][node] is not None:
+            node, aresta = predecessors[0][node]
+            endavant.append(aresta)
+        enrere, node = [], trobada
+        while predecessors[1][node] is not None:
+            node, aresta = predecessors[1][node]
+            enrere.append(aresta)
+        return list(itertools.chain.from_iterable(self.unpack(aresta) for aresta in endavant[::-1] + enrere))
+
+if __name__ == '__main__':
+    from find_route import Route, CONTRACTION_FILE
+    path = sys.argv[1] if len(sys.argv) > 1 else CONTRACTION_FILE
+    route = Route()
+    ch = ContractionHierarchy.build(route.adjacent_list)
+    ch.save(path)
+    print(f"Contraction hierarchy saved to {path}: {len(ch.shortcuts)} shortcuts.")
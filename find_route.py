@@ -1,17 +1,354 @@
-from collections import defaultdict
+import argparse
+from collections import OrderedDict, defaultdict
 import heapq
+import itertools
 import json
 import math
+import multiprocessing
+import os
 import sys
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from battery import (CHARGE_OVERHEAD, CHARGE_TARGETS, CHARGING_STATIONS_FILE, DEFAULT_CHARGING_POWER, MAX_CHARGING_STOPS,
+                     RESERVE_BATTERY, charge_seconds, load_charging_stations)
+from contraction import ContractionHierarchy
+from graph import CSRGraph
+from graph_cache import GRAPH_CACHE_DIR, load_graph_cache
+from instrumentation import search_stats, stage
+from profiles import DEFAULT_CONSUMPTION, NAMED_PROFILES, CostProfile, energy, resolve_profile
+from route_cache import RouteCache
+from simplify import SimplifiedGraph
+from spatial_index import SpatialIndex, haversine_array
+from traffic import TRAFFIC_DIR, TrafficModel
+
+MAX_DISTANCIA, MAX_TEMPS = 250000, 10800
+RADI_TERRA = 6371008.8
+CONTRACTION_FILE = "inputs/graph_cache/contraction.npz"
+SIMPLIFIED_FILE = "inputs/graph_cache/simplified.npz"
+DELTA_DIR = "inputs/graph_deltas"
+MAX_CUSTOM_PROFILES = 8
+# Mòduls on les cerques fan servir heapq (instrumentation.search_stats hi compta les operacions de la cua).
+SEARCH_MODULES = (sys.modules[__name__], sys.modules[ContractionHierarchy.__module__])
 
 class Route():
-    def __init__(self):
+    def __init__(self, engine='ucs', graph_cache=GRAPH_CACHE_DIR, route_cache_size=4096, route_cache_path=None, simplify=True):
         self.connection_nodes, self.info_nodes = "inputs/connection_nodes.json", "inputs/info_nodes.json"
+        self.w_distancia, self.w_temps = 0.5, 0.5
+        self.engine = engine
+        self.simplify = simplify
     
         self.nodes = []
-        self.adjacent_list     = self.read_file(self.connection_nodes)
-        self.coordinates_nodes = self.load_coordinates(self.info_nodes)
+        self.converted         = None
+        self.contraction       = None
+        self.simplified        = None
+        self.base_graph        = None
+        self.traffic           = None
+        self.traffic_slot      = None
+        self.td_weights        = None
+        self.profile_graphs    = None
+        self.energy_graphs     = None
+        self.charging_points   = None
+        self.stations          = None
+        self.route_cache       = RouteCache(route_cache_size, route_cache_path)
+        self.applied_deltas    = set()
+        self.load_graph(graph_cache)
+        self.heuristic_factor  = self.adjacent_list.heuristic_factor
+        self.spatial_index     = SpatialIndex(self.coordinates_nodes)
+
+    def load_graph(self, graph_cache):
+        """
+        Carrega el graf i les coordenades dels nodes, des de la memòria cau binària si és vàlida o des dels JSON.
+
+        PRE: graph_cache és el directori de la memòria cau compilada (python graph_cache.py) o None per no fer-la servir.
+        POST: self.adjacent_list i self.coordinates_nodes queden carregats. Amb la memòria cau, els arrays del graf
+            són numpy.memmap de només lectura i els processos que els carreguen comparteixen les pàgines.
+            Les rutes desades del graf anterior es descarten.
+        """
+        self.route_cache.clear()
+        carregat = None
+        if graph_cache:
+            with stage('load_graph', source='cache'):
+                carregat = load_graph_cache(graph_cache, [self.connection_nodes, self.info_nodes], (self.w_distancia, self.w_temps))
+        if carregat is None:
+            with stage('load_graph', source='json'):
+                self.coordinates_nodes = self.load_coordinates(self.info_nodes)
+                self.adjacent_list     = self.prepare_graph(self.read_graph(self.connection_nodes))
+        else:
+            self.adjacent_list, self.coordinates_nodes = carregat
+            self.nodes = list(self.coordinates_nodes.keys())
+        # Els fitxers JSON ja inclouen els deltes existents (actualizar_grafo els aplica abans d'escriure'ls).
+        self.applied_deltas = set(self.pending_deltas())
+
+    def pending_deltas(self, delta_dir=DELTA_DIR):
+        """
+        Retorna els fitxers de delta del directori que encara no s'han aplicat, en ordre.
+
+        PRE: delta_dir és el directori on pre/actualizar_grafo.py escriu els deltes.
+        POST: retorna una llista de noms de fitxer (buida si el directori no existeix).
+        """
+        try:
+            fitxers = sorted(nom for nom in os.listdir(delta_dir) if nom.endswith('.json'))
+        except OSError:
+            return []
+        return [nom for nom in fitxers if nom not in self.applied_deltas]
+
+    def reload_delta(self, delta_dir=DELTA_DIR):
+        """
+        Aplica en calent els deltes nous del graf (actualitzacions d'OSM) sense tornar a llegir els JSON.
+
+        PRE: delta_dir com a pending_deltas.
+        POST: retorna el nombre de deltes aplicats. Si no n'hi ha cap de nou només s'ha llistat el directori.
+        """
+        aplicats = 0
+        for nom in self.pending_deltas(delta_dir):
+            with open(os.path.join(delta_dir, nom), 'r') as f:
+                self.apply_delta(json.load(f))
+            self.applied_deltas.add(nom)
+            aplicats += 1
+        return aplicats
+
+    def apply_delta(self, delta):
+        """
+        Aplica un delta del graf: treu les arestes i nodes afectats i hi afegeix els nous.
+
+        Aplicar el mateix delta dues vegades no canvia el resultat: totes les arestes afegides tenen el parell
+        (origen, destí) entre els eliminats.
+
+        PRE: delta és el diccionari que escriu pre/actualizar_grafo.py, amb les claus edges_removed, edges_added,
+            nodes_removed i nodes_upserted.
+        POST: el graf, les coordenades, l'índex espacial i el factor heurístic queden actualitzats; la jerarquia
+            de contracció, el trànsit (alineat amb les arestes anteriors) i les rutes desades del graf anterior es descarten.
+        """
+        coordenades = dict(self.coordinates_nodes)
+        eliminats = {str(_id) for _id in delta['nodes_removed']}
+        for _id in eliminats:
+            coordenades.pop(_id, None)
+        for node in delta['nodes_upserted']:
+            coordenades[str(node['node_id'])] = (node['coordinates']['longitude'], node['coordinates']['latitude'])
+        parells = {(str(u), str(v)) for u, v in delta['edges_removed']}
+        afegides = [(str(aresta['node1']), str(aresta['node2']),
+                     self.heuristc_graph(float(aresta['distance']), float(aresta['time']), self.w_distancia, self.w_temps),
+                     float(aresta['distance']), float(aresta['time'])) for aresta in delta['edges_added']]
+        graph = self.base().patched(eliminats, parells, afegides)
+
+        self.coordinates_nodes = coordenades
+        self.nodes             = list(coordenades.keys())
+        self.adjacent_list     = self.prepare_graph(graph)
+        self.heuristic_factor  = graph.heuristic_factor
+        self.spatial_index     = SpatialIndex(coordenades)
+        self.converted         = None
+        self.contraction       = None
+        self.simplified        = None
+        self.base_graph        = None
+        self.traffic           = None
+        self.traffic_slot      = None
+        self.td_weights        = None
+        self.stations          = None
+        self.route_cache.clear()
+
+    def base(self):
+        """
+        Retorna el graf base (pesos estàtics dels fitxers), sense el trànsit aplicat per reweight.
+        """
+        return self.base_graph if self.base_graph is not None else self.as_graph(self.adjacent_list)
+
+    def traffic_model(self, directory=TRAFFIC_DIR):
+        """
+        Retorna (i desa) el model de trànsit del graf base: perfils per franja horària i trànsit en directe.
+        """
+        if self.traffic is None:
+            self.traffic = TrafficModel.load(self.base(), directory)
+        return self.traffic
+
+    def traffic_weights(self, base, factors):
+        """
+        Calcula, en una sola passada vectorial, el temps i el pes de totes les arestes amb uns multiplicadors del temps.
+
+        Com que heuristc_graph és lineal, el pes nou és el pes base més la part del temps afegit: amb multiplicadors 1
+        el resultat és exactament el pes base.
+
+        PRE: base és el CSRGraph base; factors és un array de multiplicadors alineat amb les seves arestes.
+        POST: retorna (pesos, temps) com a arrays float64.
+        """
+        temps_base = np.asarray(base.time, dtype=np.float64)
+        temps = temps_base * factors
+        return np.asarray(base.weight) + self.heuristc_graph(0.0, temps - temps_base, self.w_distancia, self.w_temps), temps
+
+    def reweight(self, factors):
+        """
+        Aplica uns multiplicadors del temps a totes les arestes sense tornar a llegir el graf.
+
+        PRE: factors és un array de multiplicadors alineat amb les arestes del graf base (1: sense trànsit).
+        POST: self.adjacent_list passa a ser el graf base amb els pesos nous (o el graf base si tots valen 1),
+            amb el factor heurístic recalculat. El graf simplificat es repondera en lloc de reconstruir-se;
+            la jerarquia de contracció es descarta. Les rutes desades no es perden: la clau inclou la signatura del graf.
+        """
+        base = self.base()
+        factors = np.asarray(factors, dtype=np.float64)
+        if (factors == 1).all():
+            graph = base
+        else:
+            pesos, temps = self.traffic_weights(base, factors)
+            graph = base.with_weights(pesos, temps)
+            graph.heuristic_factor = self.compute_heuristic_factor(graph, None)
+        simplified = self.simplified if self.simplified is not None and self.simplified.graph is self.adjacent_list else None
+        self.adjacent_list    = graph
+        self.base_graph       = None if graph is base else base
+        self.heuristic_factor = graph.heuristic_factor
+        self.contraction      = None
+        self.simplified       = simplified.reweighted(graph) if simplified is not None else None
+
+    def refresh_traffic(self, directory=TRAFFIC_DIR, when=None):
+        """
+        Actualitza els pesos del graf amb el trànsit de la franja horària actual i el trànsit en directe.
+
+        PRE: directory és el directori dels fitxers de trànsit (python traffic.py); when és l'instant en segons
+            des de l'època (per defecte, ara).
+        POST: retorna True si els pesos han canviat. Si ni el fitxer de trànsit en directe ni la franja han
+            canviat des de l'última crida, només s'ha consultat la data del fitxer.
+        """
+        model = self.traffic_model(directory)
+        canviat = model.refresh(self.base(), directory)
+        slot = model.slot(when)
+        if not canviat and slot == self.traffic_slot:
+            return False
+        self.traffic_slot = slot
+        if model.neutral and self.base_graph is None:
+            return False
+        self.reweight(model.factors(slot))
+        return True
+
+    def default_profile(self):
+        """
+        Retorna el perfil de cost amb què s'han calculat els pesos del graf (w_distancia, w_temps).
+        """
+        return CostProfile('balanced', self.w_distancia, self.w_temps)
+
+    def profile_weights(self, profile: CostProfile, distance, time):
+        """
+        Calcula el pes de les arestes per a un perfil de cost a partir de la distància i el temps.
+
+        PRE: perfil és un CostProfile; distancia (m) i temps (s) són arrays alineats amb les arestes.
+        POST: retorna l'array de pesos (cost normalitzat com a heuristc_graph o, per a 'energy', kWh).
+        """
+        if profile.energy:
+            return energy(distance, time, profile.consumption)
+        return self.heuristc_graph(distance, time, profile.w_distancia, profile.w_temps)
+
+    def profile_heuristic_factor(self, graph):
+        """
+        Calcula el factor heurístic d'un graf amb pesos qualssevol: la ràtio mínima pes/haversine de les arestes.
+
+        Per la desigualtat triangular, factor * haversine fins al destí és una cota inferior consistent.
+
+        PRE: graf és un CSRGraph amb coordenades (p. ex. creat amb with_weights).
+        POST: retorna el factor (cost per metre), o 0 si no es pot calcular.
+        """
+        coordenades = graph.coordinates
+        if graph.num_edges == 0 or np.isnan(coordenades).any():
+            return 0.0
+        origen, desti = coordenades[graph.sources()], coordenades[graph.targets]
+        recta = haversine_array(origen[:, 0], origen[:, 1], desti[:, 0], desti[:, 1])
+        valides = recta > 0
+        if not valides.any():
+            return 0.0
+        return max(float((np.asarray(graph.weight)[valides] / recta[valides]).min()), 0.0) * (1 - 1e-6)
+
+    def profile_graph(self, profile=None, consumption=None):
+        """
+        Retorna el graf amb els pesos d'un perfil de cost, calculats a partir de la distància i el temps de les arestes
+        la primera vegada que es demana i desats mentre el graf no canvia (delta o trànsit).
+
+        Els perfils amb nom es conserven sempre; dels personalitzats es conserven els MAX_CUSTOM_PROFILES
+        usats més recentment. El graf simplificat i la jerarquia de contracció de cada perfil també s'hi desen.
+
+        PRE: perfil i consum com a resolve_profile (per defecte, el perfil del graf).
+        POST: retorna un CSRGraph que comparteix la topologia amb self.adjacent_list (o el mateix graf per al perfil
+            per defecte), amb el factor heurístic del perfil.
+        """
+        perfil = resolve_profile(profile, consumption, self.default_profile())
+        graph = self.as_graph(self.adjacent_list)
+        if perfil.key == self.default_profile().key:
+            return graph
+        if self.profile_graphs is None or self.profile_graphs[0] is not graph:
+            self.profile_graphs = (graph, OrderedDict())
+        perfils = self.profile_graphs[1]
+        if perfil.key in perfils:
+            perfils.move_to_end(perfil.key)
+            return perfils[perfil.key][0]
+        pesos = self.profile_weights(perfil, np.asarray(graph.distance, dtype=np.float64), np.asarray(graph.time, dtype=np.float64))
+        graf_perfil = graph.with_weights(pesos)
+        graf_perfil.heuristic_factor = self.profile_heuristic_factor(graf_perfil)
+        perfils[perfil.key] = [graf_perfil, None, None, perfil.name == 'custom']
+        personalitzats = [clau for clau, entrada in perfils.items() if entrada[3]]
+        for clau in personalitzats[:-MAX_CUSTOM_PROFILES]:
+            del perfils[clau]
+        return graf_perfil
+
+    def energy_graph(self, graph, consumption):
+        """
+        Retorna (i desa) el graf amb l'energia (kWh) de cada aresta com a pes, amb el seu factor heurístic
+        (cota inferior de l'energia per metre en línia recta).
+
+        PRE: graf és un CSRGraph preparat; consum en kWh/km.
+        POST: retorna un CSRGraph que comparteix la topologia amb graf.
+        """
+        if self.energy_graphs is None or self.energy_graphs[0] is not graph:
+            self.energy_graphs = (graph, {})
+        grafs = self.energy_graphs[1]
+        if consumption not in grafs:
+            graf_energia = graph.with_weights(energy(graph.distance, graph.time, consumption))
+            graf_energia.heuristic_factor = self.profile_heuristic_factor(graf_energia)
+            grafs[consumption] = graf_energia
+        return grafs[consumption]
+
+    def set_charging_stations(self, stations):
+        """
+        Defineix els punts de càrrega de la ruta.
+
+        PRE: estacions és una llista d'objectes amb "longitude" i "latitude" (o "node_id") i, opcionalment, "power_kw".
+        POST: els punts s'enganxaran al node més proper del graf la pròxima vegada que es facin servir.
+        """
+        self.charging_points = list(stations)
+        self.stations = None
+
+    def charging_stations(self, graph=None, path=CHARGING_STATIONS_FILE):
+        """
+        Retorna (i desa) els punts de càrrega enganxats als nodes del graf.
+
+        PRE: graf és un CSRGraph (per defecte el graf de la ruta); path és el fitxer de punts de càrrega,
+            que es llegeix només si no s'han definit amb set_charging_stations.
+        POST: retorna un diccionari índex de node -> potència (kW), amb la potència màxima si n'hi ha diversos al node.
+        """
+        graph = self.as_graph(self.adjacent_list) if graph is None else graph
+        if self.stations is not None and self.stations[0] is graph.index:
+            return self.stations[1]
+        if self.charging_points is None:
+            self.charging_points = load_charging_stations(path)
+        amb_node = [punt for punt in self.charging_points if 'node_id' in punt]
+        amb_coordenades = [punt for punt in self.charging_points if 'node_id' not in punt]
+        nodes = [str(punt['node_id']) for punt in amb_node]
+        if amb_coordenades:
+            nodes += self.snap_many([(punt['longitude'], punt['latitude']) for punt in amb_coordenades])
+        estacions = {}
+        for punt, node in zip(amb_node + amb_coordenades, nodes):
+            if node in graph.index:
+                potencia = float(punt.get('power_kw') or DEFAULT_CHARGING_POWER)
+                estacions[graph.index[node]] = max(potencia, estacions.get(graph.index[node], 0.0))
+        self.stations = (graph.index, estacions)
+        return estacions
+
+    def profile_entry(self, graph):
+        """
+        Retorna l'entrada [graf, graf simplificat, jerarquia de contracció, personalitzat] d'un graf de perfil, o None.
+        """
+        if self.profile_graphs is not None:
+            for entrada in self.profile_graphs[1].values():
+                if entrada[0] is graph:
+                    return entrada
+        return None
 
     def read_file(self, connexions_nodes) -> dict:
         """
@@ -26,10 +363,27 @@ class Route():
             for entrada in dades:
                 node1, node2 = str(entrada['node1']), str(entrada['node2'])
                 distancia, temps = float(entrada['distance']), float(entrada['time'])
-                pes_heuristic = self.heuristc_graph(distancia, temps, 0.5, 0.5)
+                pes_heuristic = self.heuristc_graph(distancia, temps, self.w_distancia, self.w_temps)
                 adjacent_list[node1].append((node2, pes_heuristic, distancia, temps))
         return adjacent_list
 
+    def read_graph(self, connexions_nodes) -> CSRGraph:
+        """
+        Llegeix el fitxer JSON de connexions entre nodes directament en un graf CSR (sense passar per diccionaris).
+
+        PRE: connexions_nodes és el nom del fitxer que conté les connexions entre nodes.
+        POST: retorna un CSRGraph amb índexs enters, pesos en float64 i distàncies i temps en float32.
+        """
+        with open(connexions_nodes, 'r') as f:
+            dades = json.load(f)
+        index = {}
+        sources = np.fromiter((index.setdefault(str(entrada['node1']), len(index)) for entrada in dades), dtype=np.int64, count=len(dades))
+        targets = np.fromiter((index.setdefault(str(entrada['node2']), len(index)) for entrada in dades), dtype=np.int64, count=len(dades))
+        distancia = np.fromiter((float(entrada['distance']) for entrada in dades), dtype=np.float64, count=len(dades))
+        temps = np.fromiter((float(entrada['time']) for entrada in dades), dtype=np.float64, count=len(dades))
+        pes_heuristic = self.heuristc_graph(distancia, temps, self.w_distancia, self.w_temps)
+        return CSRGraph.from_edges(list(index), sources, targets, pes_heuristic, distancia, temps)
+
     def heuristc_graph(self, distancia, temps, w_distancia, w_temps):
         """
         Calcula el valor heurístic donat una distància i temps amb els seus pesos respectius.
@@ -38,7 +392,6 @@ class Route():
             w_distancia i w_temps són els pesos per la distància i el temps respectivament.
         POST: retorna el valor heurístic calculat.
         """
-        MAX_DISTANCIA, MAX_TEMPS = 250000, 10800
         return (w_distancia * (distancia / MAX_DISTANCIA) + w_temps * (temps / MAX_TEMPS))
 
     def obtain_coordinates(self, _id, coordinates_nodes):
@@ -62,6 +415,97 @@ class Route():
         lon2, lat2 = coord2
         return math.sqrt((lon2 - lon1)**2 + (lat2 - lat1)**2)
 
+    def haversine_distance(self, coord1, coord2):
+        """
+        Calcula la distància de gran cercle (en metres) entre dues coordenades.
+
+        PRE: coord1 i coord2 són tuples que contenen longitud i latitud en graus.
+        POST: retorna la distància en metres sobre l'esfera terrestre.
+        """
+        lon1, lat1 = coord1
+        lon2, lat2 = coord2
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        dphi, dlambda = phi2 - phi1, math.radians(lon2 - lon1)
+        h = math.sin(dphi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2)**2
+        return 2 * RADI_TERRA * math.asin(min(1.0, math.sqrt(h)))
+
+    def compute_heuristic_factor(self, adjacent_list, coordinates_nodes):
+        """
+        Calcula el factor que converteix metres en línia recta en una cota inferior del cost heurístic del graf.
+
+        La distància de cada aresta es fita per la distància haversine multiplicada per la ràtio mínima
+        distància/haversine del graf, i el temps per la distància haversine dividida per la velocitat màxima
+        observada. Amb la mateixa normalització MAX_DISTANCIA/MAX_TEMPS que heuristc_graph, el factor
+        compleix pes >= factor * haversine per a totes les arestes, de manera que l'heurística és consistent.
+
+        PRE: llista_adjacencia és un CSRGraph o un diccionari que representa la llista d'adjacència dels nodes.
+            coordenades_nodes és un diccionari amb les coordenades dels nodes, o None per fer servir les que
+            el CSRGraph ja té (p. ex. un graf reponderat amb with_weights).
+        POST: retorna el factor (cost per metre). Si algun node del graf no té coordenades retorna 0,
+            i l'A* es comporta com la cerca de cost uniforme.
+        """
+        graph = adjacent_list if isinstance(adjacent_list, CSRGraph) else CSRGraph.from_adjacency(adjacent_list)
+        coordenades = graph.coordinates if coordinates_nodes is None else graph.set_coordinates(coordinates_nodes)
+        if graph.num_edges == 0 or np.isnan(coordenades).any():
+            return 0.0
+        origen, desti = coordenades[graph.sources()], coordenades[graph.targets]
+        recta = haversine_array(origen[:, 0], origen[:, 1], desti[:, 0], desti[:, 1])
+        valides = recta > 0
+        if not valides.any():
+            return 0.0
+        recta, dist, temps = recta[valides], graph.distance[valides], graph.time[valides]
+        # Marge per l'arrodoniment a float32 de les distàncies i temps desats.
+        ratio_distancia = max(float((dist / recta).min()), 0.0) * (1 - 1e-6)
+        if (temps <= 0).any():
+            factor_temps = 0.0
+        else:
+            factor_temps = 1 / (float((recta / temps).max()) * (1 + 1e-6))
+        return self.heuristc_graph(ratio_distancia, factor_temps, self.w_distancia, self.w_temps)
+
+    def prepare_graph(self, graph):
+        """
+        Associa al graf les coordenades dels nodes i el factor de l'heurística.
+
+        PRE: graf és un CSRGraph.
+        POST: retorna el mateix graf, llest per a les cerques.
+        """
+        graph.heuristic_factor = self.compute_heuristic_factor(graph, self.coordinates_nodes)
+        return graph
+
+    def as_graph(self, adjacent_list):
+        """
+        Retorna el CSRGraph corresponent a una llista d'adjacència (convertint-la i desant-la si és un diccionari).
+
+        PRE: llista_adjacencia és un CSRGraph o un diccionari node -> [(vei, pes, distancia, temps)].
+        POST: retorna un CSRGraph preparat per a les cerques.
+        """
+        if isinstance(adjacent_list, CSRGraph):
+            return adjacent_list
+        if self.converted is None or self.converted[0] is not adjacent_list:
+            self.converted = (adjacent_list, self.prepare_graph(CSRGraph.from_adjacency(adjacent_list)))
+        return self.converted[1]
+
+    def cost_estimator(self, graph, goal, goal_graph=None):
+        """
+        Construeix la funció que estima el cost mínim des d'un node fins al node objectiu.
+
+        PRE: graf és un CSRGraph preparat; objectiu és l'índex del node objectiu a graf_objectiu (per defecte graf),
+            que ha de compartir el factor heurístic.
+        POST: retorna una funció índex de node -> cota inferior del cost restant.
+        """
+        factor = graph.heuristic_factor * 2 * RADI_TERRA
+        if factor == 0:
+            return lambda node: 0.0
+        goal_graph = graph if goal_graph is None else goal_graph
+        lon_rad, lat_rad, cos_lat = graph.lon_rad, graph.lat_rad, graph.cos_lat
+        lon_goal, lat_goal, cos_goal = float(goal_graph.lon_rad[goal]), float(goal_graph.lat_rad[goal]), float(goal_graph.cos_lat[goal])
+        sin, asin, sqrt = math.sin, math.asin, math.sqrt
+
+        def estimate(node):
+            h = sin((lat_goal - lat_rad[node]) / 2)**2 + cos_lat[node] * cos_goal * sin((lon_goal - lon_rad[node]) / 2)**2
+            return factor * asin(min(1.0, sqrt(h)))
+        return estimate
+
     def find_closest_node(self, dest_coordinates, coordinates_nodes):
         """
         Troba el node més proper a unes coordenades donades.
@@ -70,28 +514,485 @@ class Route():
             coordenades_nodes és un diccionari amb les coordenades dels nodes.
         POST: retorna l'ID del node més proper a les coordenades objectiu.
         """
-        return min(coordinates_nodes, key=lambda _id: self.distance(dest_coordinates, coordinates_nodes[_id]))
+        with stage('snap'):
+            if coordinates_nodes is self.coordinates_nodes:
+                return self.spatial_index.nearest(dest_coordinates)
+            return min(coordinates_nodes, key=lambda _id: self.haversine_distance(dest_coordinates, coordinates_nodes[_id]))
+
+    def snap_many(self, points):
+        """
+        Troba el node més proper per a una llista de coordenades en una sola crida vectoritzada.
+
+        PRE: punts és una seqüència de tuples (longitud, latitud).
+        POST: retorna la llista d'IDs dels nodes més propers, en el mateix ordre que els punts.
+        """
+        with stage('snap_many'):
+            ids = self.spatial_index.ids
+            return [ids[i] for i in self.spatial_index.nearest_many(points)]
 
-    def uniform_cost_search(self, adjacent_list: dict, origin: str, dest: str):
+    def uniform_cost_search(self, adjacent_list, origin: str, dest: str):
         """
         Implementa l'algorisme de cerca de cost uniforme per trobar el camí òptim entre dos nodes.
         
-        PRE: llista_adjacencia és un diccionari que representa la llista d'adjacència dels nodes.
+        PRE: llista_adjacencia és un CSRGraph o un diccionari que representa la llista d'adjacència dels nodes.
             origen és l'ID del node d'origen.
             desti és l'ID del node de destí.
         POST: retorna el camí òptim, el cost total, la distància total i el temps total.
         """
-        priority_queue = [(0, 0, 0, origin, [origin])]
+        graph = self.as_graph(adjacent_list)
+        if origin == dest:
+            return [origin], 0, 0, 0
+        if origin not in graph.index or dest not in graph.index:
+            return [], float('inf'), float('inf'), float('inf')
+        origen, desti = graph.index[origin], graph.index[dest]
+        offsets, targets, weights = graph.views()
+        millors = {origen: 0}
+        predecessors = {origen: None}
         visitats = set()
+        comptador = itertools.count()
+        priority_queue = [(0, next(comptador), origen)]
         while priority_queue:
-            cost, dist_total, temps_total, node, cami = heapq.heappop(priority_queue)
-            if node == dest:
-                return cami, cost, dist_total, temps_total
-            if node not in visitats:
-                visitats.add(node)
-                for vei, pes, dist, temps in adjacent_list[node]:
-                    if vei not in visitats:
-                        heapq.heappush(priority_queue, (cost + pes, dist_total + dist, temps_total + temps, vei, cami + [vei]))
+            cost, _, node = heapq.heappop(priority_queue)
+            if node in visitats:
+                continue
+            if node == desti:
+                return self.graph_route(graph, predecessors, desti, cost)
+            visitats.add(node)
+            for aresta in range(offsets[node], offsets[node + 1]):
+                vei, nou_cost = targets[aresta], cost + weights[aresta]
+                if vei not in visitats and (vei not in millors or nou_cost < millors[vei]):
+                    millors[vei] = nou_cost
+                    predecessors[vei] = (node, aresta)
+                    heapq.heappush(priority_queue, (nou_cost, next(comptador), vei))
+        return [], float('inf'), float('inf'), float('inf')
+
+    def reconstruct_path(self, predecessors: dict, dest: int):
+        """
+        Reconstrueix el camí seguint els predecessors des del node de destí.
+
+        PRE: predecessors és un diccionari node -> (node anterior, aresta), amb l'origen apuntant a None.
+        POST: retorna la llista d'índexs de nodes i la llista d'índexs d'aresta des de l'origen fins al destí.
+        """
+        cami, arestes = [dest], []
+        while predecessors[cami[-1]] is not None:
+            anterior, aresta = predecessors[cami[-1]]
+            cami.append(anterior)
+            arestes.append(aresta)
+        cami.reverse()
+        arestes.reverse()
+        return cami, arestes
+
+    def graph_route(self, graph, predecessors: dict, dest: int, cost):
+        """
+        Construeix el resultat d'una cerca: camí amb IDs de text, cost, distància i temps totals.
+
+        PRE: graf és el CSRGraph de la cerca; predecessors i desti com a reconstruct_path.
+        POST: retorna el camí, el cost total, la distància total i el temps total.
+        """
+        cami, arestes = self.reconstruct_path(predecessors, dest)
+        dist_total, temps_total = graph.path_totals(arestes)
+        return [graph.ids[node] for node in cami], cost, dist_total, temps_total
+
+    def a_star_search(self, adjacent_list, origin: str, dest: str):
+        """
+        Implementa l'algorisme A* guiat per la cota inferior geogràfica fins al destí.
+
+        PRE: llista_adjacencia és un CSRGraph o un diccionari que representa la llista d'adjacència dels nodes.
+            origen és l'ID del node d'origen.
+            desti és l'ID del node de destí.
+        POST: retorna el camí òptim, el cost total, la distància total i el temps total.
+        """
+        graph = self.as_graph(adjacent_list)
+        if origin == dest:
+            return [origin], 0, 0, 0
+        if origin not in graph.index or dest not in graph.index:
+            return [], float('inf'), float('inf'), float('inf')
+        origen, desti = graph.index[origin], graph.index[dest]
+        offsets, targets, weights = graph.views()
+        estimate = self.cost_estimator(graph, desti)
+        estimacions = {}
+        millors = {origen: 0}
+        predecessors = {origen: None}
+        priority_queue = [(estimate(origen), 0, origen)]
+        while priority_queue:
+            _, cost, node = heapq.heappop(priority_queue)
+            if cost > millors[node]:
+                continue
+            if node == desti:
+                return self.graph_route(graph, predecessors, desti, cost)
+            for aresta in range(offsets[node], offsets[node + 1]):
+                vei, nou_cost = targets[aresta], cost + weights[aresta]
+                if vei not in millors or nou_cost < millors[vei]:
+                    millors[vei] = nou_cost
+                    predecessors[vei] = (node, aresta)
+                    if vei not in estimacions:
+                        estimacions[vei] = estimate(vei)
+                    heapq.heappush(priority_queue, (nou_cost + estimacions[vei], nou_cost, vei))
+        return [], float('inf'), float('inf'), float('inf')
+
+    def bidirectional_a_star_search(self, adjacent_list, origin: str, dest: str):
+        """
+        Implementa l'A* bidireccional amb potencials mitjans (pf = (h_desti - h_origen) / 2).
+
+        PRE: llista_adjacencia és un CSRGraph o un diccionari que representa la llista d'adjacència dels nodes.
+            origen és l'ID del node d'origen.
+            desti és l'ID del node de destí.
+        POST: retorna el camí òptim, el cost total, la distància total i el temps total.
+        """
+        graph = self.as_graph(adjacent_list)
+        if origin == dest:
+            return [origin], 0, 0, 0
+        if origin not in graph.index or dest not in graph.index:
+            return [], float('inf'), float('inf'), float('inf')
+        origen, desti = graph.index[origin], graph.index[dest]
+        cap_al_desti, cap_a_l_origen = self.cost_estimator(graph, desti), self.cost_estimator(graph, origen)
+        potencials = {}
+
+        def potencial(node):
+            if node not in potencials:
+                potencials[node] = (cap_al_desti(node) - cap_a_l_origen(node)) / 2
+            return potencials[node]
+
+        # Índex 0: cerca endavant des de l'origen; índex 1: cerca enrere des del destí.
+        grafs = (graph, graph.reverse())
+        signes = (1, -1)
+        millors = ({origen: 0}, {desti: 0})
+        predecessors = ({origen: None}, {desti: None})
+        queues = ([(potencial(origen), 0, origen)], [(-potencial(desti), 0, desti)])
+        mu, trobada = float('inf'), None
+        while queues[0] and queues[1]:
+            if queues[0][0][0] + queues[1][0][0] >= mu:
+                break
+            sentit = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+            _, cost, node = heapq.heappop(queues[sentit])
+            if cost > millors[sentit][node]:
+                continue
+            actuals, altres = millors[sentit], millors[1 - sentit]
+            offsets, targets, weights = grafs[sentit].views()
+            for aresta in range(offsets[node], offsets[node + 1]):
+                vei, nou_cost = targets[aresta], cost + weights[aresta]
+                if vei not in actuals or nou_cost < actuals[vei]:
+                    actuals[vei] = nou_cost
+                    predecessors[sentit][vei] = (node, aresta)
+                    heapq.heappush(queues[sentit], (nou_cost + signes[sentit] * potencial(vei), nou_cost, vei))
+                    if vei in altres and nou_cost + altres[vei] < mu:
+                        mu, trobada = nou_cost + altres[vei], vei
+        if trobada is None:
+            return [], float('inf'), float('inf'), float('inf')
+        endavant, arestes_endavant = self.reconstruct_path(predecessors[0], trobada)
+        enrere, arestes_enrere = self.reconstruct_path(predecessors[1], trobada)
+        dist_endavant, temps_endavant = grafs[0].path_totals(arestes_endavant)
+        dist_enrere, temps_enrere = grafs[1].path_totals(arestes_enrere)
+        cami = endavant + enrere[-2::-1]
+        return [graph.ids[node] for node in cami], mu, dist_endavant + dist_enrere, temps_endavant + temps_enrere
+
+    def contraction_hierarchy(self, adjacent_list=None, path=CONTRACTION_FILE):
+        """
+        Retorna la jerarquia de contracció del graf: la carrega del disc si correspon al graf o la construeix i la desa.
+
+        PRE: llista_adjacencia és un CSRGraph o un diccionari (per defecte el graf de la ruta).
+            path és el fitxer .npz on es desa la jerarquia del graf de la ruta.
+        POST: retorna una ContractionHierarchy del graf.
+        """
+        graph = self.as_graph(self.adjacent_list if adjacent_list is None else adjacent_list)
+        if self.contraction is not None and self.contraction.graph is graph:
+            return self.contraction
+        entrada = self.profile_entry(graph)
+        if entrada is not None:
+            if entrada[2] is None:
+                entrada[2] = ContractionHierarchy.build(graph)
+            return entrada[2]
+        contraction = None
+        if graph is self.adjacent_list:
+            contraction = ContractionHierarchy.load(path, graph)
+        if contraction is None:
+            contraction = ContractionHierarchy.build(graph)
+            if graph is self.adjacent_list and self.base_graph is None:
+                contraction.save(path)
+        self.contraction = contraction
+        return contraction
+
+    def contraction_search(self, adjacent_list, origin: str, dest: str):
+        """
+        Cerca el camí òptim amb la jerarquia de contracció, desempaquetant les dreceres en els nodes originals.
+
+        PRE: llista_adjacencia és un CSRGraph o un diccionari que representa la llista d'adjacència dels nodes.
+            origen és l'ID del node d'origen.
+            desti és l'ID del node de destí.
+        POST: retorna el camí òptim, el cost total, la distància total i el temps total.
+        """
+        graph = self.as_graph(adjacent_list)
+        if origin == dest:
+            return [origin], 0, 0, 0
+        if origin not in graph.index or dest not in graph.index:
+            return [], float('inf'), float('inf'), float('inf')
+        arestes = self.contraction_hierarchy(graph).query(graph.index[origin], graph.index[dest])
+        if arestes is None:
+            return [], float('inf'), float('inf'), float('inf')
+        cost = 0
+        for pes in graph.weight[arestes].tolist():
+            cost += pes
+        dist_total, temps_total = graph.path_totals(arestes)
+        return [origin] + [graph.ids[node] for node in graph.targets[arestes].tolist()], cost, dist_total, temps_total
+
+    def simplified_graph(self, adjacent_list=None, path=SIMPLIFIED_FILE):
+        """
+        Retorna el graf simplificat (cadenes de grau 2 contretes): el carrega del disc si correspon al graf
+        o el construeix i el desa.
+
+        PRE: llista_adjacencia és un CSRGraph o un diccionari (per defecte el graf de la ruta).
+            path és el fitxer .npz on es desa el graf simplificat del graf de la ruta.
+        POST: retorna un SimplifiedGraph del graf.
+        """
+        graph = self.as_graph(self.adjacent_list if adjacent_list is None else adjacent_list)
+        if self.simplified is not None and self.simplified.graph is graph:
+            return self.simplified
+        entrada = self.profile_entry(graph)
+        if entrada is not None:
+            if entrada[1] is None:
+                entrada[1] = self.simplified_graph().reweighted(graph)
+            return entrada[1]
+        simplified = None
+        if graph is self.adjacent_list:
+            simplified = SimplifiedGraph.load(path, graph)
+        if simplified is None:
+            simplified = SimplifiedGraph.build(graph)
+            if graph is self.adjacent_list and self.base_graph is None:
+                try:
+                    simplified.save(path)
+                except OSError:
+                    pass
+        self.simplified = simplified
+        return simplified
+
+    def simplified_search(self, adjacent_list, origin: str, dest: str, heuristic=True):
+        """
+        Cerca (A* o, sense heurística, cost uniforme) sobre el graf simplificat: només es fixen cruïlles, i el camí
+        resultant es desplega en els nodes originals. L'origen i el destí poden ser nodes intermedis d'una cadena.
+
+        PRE: llista_adjacencia és un CSRGraph o un diccionari que representa la llista d'adjacència dels nodes.
+            origen és l'ID del node d'origen.
+            desti és l'ID del node de destí.
+        POST: retorna el camí òptim, el cost total, la distància total i el temps total.
+        """
+        graph = self.as_graph(adjacent_list)
+        if origin == dest:
+            return [origin], 0, 0, 0
+        if origin not in graph.index or dest not in graph.index:
+            return [], float('inf'), float('inf'), float('inf')
+        simplified = self.simplified_graph(graph)
+        core = simplified.core
+        origen, desti = graph.index[origin], graph.index[dest]
+        arribades = simplified.arrivals(desti)
+        millor_cost, millor = simplified.direct(origen, desti)
+        final = None
+        estimate = self.cost_estimator(core, desti, graph) if heuristic else (lambda node: 0.0)
+        offsets, targets, weights = core.views()
+        inicials, millors, predecessors, priority_queue = {}, {}, {}, []
+        for node, cost, arestes in simplified.departures(origen):
+            if node not in millors or cost < millors[node]:
+                millors[node], inicials[node], predecessors[node] = cost, arestes, None
+        for node, cost in millors.items():
+            heapq.heappush(priority_queue, (cost + estimate(node), cost, node))
+        estimacions = {}
+        while priority_queue:
+            f, cost, node = heapq.heappop(priority_queue)
+            if f >= millor_cost:
+                break
+            if cost > millors[node]:
+                continue
+            if node in arribades and cost + arribades[node][0] < millor_cost:
+                millor_cost, final = cost + arribades[node][0], node
+            for aresta in range(offsets[node], offsets[node + 1]):
+                vei, nou_cost = targets[aresta], cost + weights[aresta]
+                if vei not in millors or nou_cost < millors[vei]:
+                    millors[vei] = nou_cost
+                    predecessors[vei] = (node, aresta)
+                    if vei not in estimacions:
+                        estimacions[vei] = estimate(vei)
+                    heapq.heappush(priority_queue, (nou_cost + estimacions[vei], nou_cost, vei))
+        if final is not None:
+            cami, arestes = self.reconstruct_path(predecessors, final)
+            millor = inicials[cami[0]] + simplified.expand(arestes) + arribades[final][1]
+        elif millor is None:
+            return [], float('inf'), float('inf'), float('inf')
+        dist_total, temps_total = graph.path_totals(millor)
+        return [origin] + [graph.ids[node] for node in graph.targets[millor].tolist()], millor_cost, dist_total, temps_total
+
+    def battery_search(self, adjacent_list, origin: str, dest: str, soc, capacity, consumption=DEFAULT_CONSUMPTION,
+                       reserve=0.0, charge_weight=None, max_stops=MAX_CHARGING_STOPS):
+        """
+        Camí òptim amb restricció de bateria: A* multi-etiqueta on cada etiqueta porta el cost i l'estat de càrrega
+        (kWh). Les etiquetes que deixarien la bateria per sota de la reserva es descarten, i als punts de càrrega
+        es generen etiquetes noves carregant fins a cada fracció de CHARGE_TARGETS (amb el temps de càrrega com a cost).
+
+        Com que les etiquetes d'un node surten de la cua en ordre de cost, una etiqueta està dominada (Pareto) si una
+        d'anterior al mateix node tenia almenys la mateixa càrrega amb no més parades, i es descarta en temps constant.
+        Sense punts de càrrega, també es descarten les etiquetes que no poden arribar al destí ni amb la cota inferior
+        de l'energia restant.
+
+        PRE: llista_adjacencia és un CSRGraph o un diccionari; origen i desti són IDs de nodes.
+            soc és la càrrega inicial, capacity la capacitat i reserve la reserva mínima, en kWh; consumption en kWh/km.
+            charge_weight és el cost de cada segon de càrrega (per defecte, el del temps a heuristc_graph).
+        POST: retorna el camí, el cost total, la distància total, el temps total (conducció i càrrega), les parades
+            [(ID del node, kWh carregats, segons)] i la càrrega en arribar a cada node del camí (kWh).
+            Si no hi ha cap camí factible, el camí és buit i el cost inf.
+        """
+        graph = self.as_graph(adjacent_list)
+        no_trobat = ([], float('inf'), float('inf'), float('inf'), [], [])
+        if origin not in graph.index or dest not in graph.index or soc < reserve:
+            return no_trobat
+        if origin == dest:
+            return [origin], 0, 0, 0, [], [soc]
+        if charge_weight is None:
+            charge_weight = self.heuristc_graph(0.0, 1.0, self.w_distancia, self.w_temps)
+        origen, desti = graph.index[origin], graph.index[dest]
+        offsets, targets, weights = graph.views()
+        graf_energia = self.energy_graph(graph, consumption)
+        consums = graf_energia.views()[2]
+        temps = memoryview(np.ascontiguousarray(graph.time, dtype=np.float64))
+        estacions = self.charging_stations(graph)
+        estimate = self.cost_estimator(graph, desti)
+        energia_minima = self.cost_estimator(graf_energia, desti) if not estacions else (lambda node: 0.0)
+        estimacions = {}
+
+        # Etiquetes: (node, etiqueta anterior, aresta o None si és una càrrega, càrrega, parades, rellotge).
+        etiquetes = [(origen, None, None, soc, 0, 0.0)]
+        fixades = defaultdict(list)
+        priority_queue = [(estimate(origen), 0, 0)]
+        while priority_queue:
+            _, cost, actual = heapq.heappop(priority_queue)
+            node, _, _, carrega, parades, rellotge = etiquetes[actual]
+            if any(c >= carrega and p <= parades for c, p in fixades[node]):
+                continue
+            fixades[node].append((carrega, parades))
+            if node == desti:
+                return self.battery_route(graph, etiquetes, actual, cost)
+            if node in estacions and parades < max_stops:
+                for fraccio in CHARGE_TARGETS:
+                    objectiu = fraccio * capacity
+                    if objectiu > carrega + 1e-9:
+                        segons = CHARGE_OVERHEAD + charge_seconds(carrega, objectiu, capacity, estacions[node])
+                        etiquetes.append((node, actual, None, objectiu, parades + 1, rellotge + segons))
+                        heapq.heappush(priority_queue, (cost + segons * charge_weight + estimate(node), cost + segons * charge_weight, len(etiquetes) - 1))
+            for aresta in range(offsets[node], offsets[node + 1]):
+                vei, nova_carrega = targets[aresta], carrega - consums[aresta]
+                if nova_carrega < reserve:
+                    continue
+                if any(c >= nova_carrega and p <= parades for c, p in fixades[vei]):
+                    continue
+                if vei not in estimacions:
+                    estimacions[vei] = (estimate(vei), energia_minima(vei))
+                h, energia = estimacions[vei]
+                if nova_carrega - energia < reserve:
+                    continue
+                nou_cost = cost + weights[aresta]
+                etiquetes.append((vei, actual, aresta, nova_carrega, parades, rellotge + temps[aresta]))
+                heapq.heappush(priority_queue, (nou_cost + h, nou_cost, len(etiquetes) - 1))
+        return no_trobat
+
+    def battery_route(self, graph, labels, label: int, cost):
+        """
+        Construeix el resultat de battery_search seguint les etiquetes anteriors des de la del destí.
+        """
+        cadena = []
+        while label is not None:
+            cadena.append(labels[label])
+            label = labels[label][1]
+        cadena.reverse()
+        cami, arestes, parades, carregues = [cadena[0][0]], [], [], [cadena[0][3]]
+        for node, anterior, aresta, carrega, _, rellotge in cadena[1:]:
+            if aresta is None:
+                parades.append((graph.ids[node], carrega - labels[anterior][3], rellotge - labels[anterior][5]))
+                carregues[-1] = carrega
+            else:
+                cami.append(node)
+                arestes.append(aresta)
+                carregues.append(carrega)
+        dist_total, _ = graph.path_totals(arestes)
+        return [graph.ids[node] for node in cami], cost, dist_total, cadena[-1][5], parades, carregues
+
+    def time_dependent_weights(self, base, slot=None):
+        """
+        Retorna (i desa) els pesos i temps de les arestes a una franja horària, o el graf de cota inferior
+        (multiplicador mínim de cada aresta) si la franja és None.
+
+        PRE: base és el CSRGraph base; franja és un índex de franja del model de trànsit o None.
+        POST: retorna (pesos, temps) com a memoryviews per a la cerca, o el CSRGraph de cota inferior preparat.
+            Es recalculen quan canvia el graf base o el trànsit.
+        """
+        model = self.traffic_model()
+        if self.td_weights is None or self.td_weights[0] is not base or self.td_weights[1] != model.version:
+            self.td_weights = (base, model.version, {})
+        franges = self.td_weights[2]
+        if slot not in franges:
+            if slot is None:
+                pesos, temps = self.traffic_weights(base, model.lower_bound())
+                cota = base.with_weights(pesos, temps)
+                cota.heuristic_factor = self.compute_heuristic_factor(cota, None)
+                franges[slot] = cota
+            else:
+                pesos, temps = self.traffic_weights(base, model.factors(slot))
+                franges[slot] = (memoryview(pesos), memoryview(temps))
+        return franges[slot]
+
+    def time_dependent_search(self, adjacent_list, origin: str, dest: str, departure=None):
+        """
+        A* dependent del temps: el pes i el temps de cada aresta són els de la franja horària en què s'hi entra,
+        és a dir, la de l'hora de sortida del node d'on surt (sortida més el temps acumulat fins al node), amb els
+        perfils horaris i el trànsit en directe del model de trànsit.
+
+        L'heurística fa servir el multiplicador mínim de cada aresta, de manera que és admissible a qualsevol hora.
+
+        És una aproximació: les etiquetes s'assenten pel cost i el rellotge de cada node és el del camí de menor cost
+        fins al node. Els pesos per franges són esglaonats i no garanteixen FIFO (arribar més tard a un node pot
+        permetre sortir-ne en una franja més barata), de manera que, si el viatge creua un canvi de franja, el camí
+        pot no ser l'òptim dependent del temps. Dins d'una sola franja el resultat és el de l'A* amb els pesos
+        d'aquella franja.
+
+        PRE: llista_adjacencia és el CSRGraph base (sense trànsit aplicat).
+            origen és l'ID del node d'origen.
+            desti és l'ID del node de destí.
+            departure és l'hora de sortida en segons des de l'època (per defecte, ara).
+        POST: retorna el camí òptim, el cost total, la distància total i el temps total (amb trànsit).
+        """
+        graph = self.as_graph(adjacent_list)
+        if origin == dest:
+            return [origin], 0, 0, 0
+        if origin not in graph.index or dest not in graph.index:
+            return [], float('inf'), float('inf'), float('inf')
+        departure = time.time() if departure is None else departure
+        model = self.traffic_model()
+        origen, desti = graph.index[origin], graph.index[dest]
+        offsets, targets, _ = graph.views()
+        estimate = self.cost_estimator(self.time_dependent_weights(graph), desti)
+        franges = {}
+        estimacions = {}
+        millors = {origen: 0}
+        rellotge = {origen: 0.0}
+        predecessors = {origen: None}
+        priority_queue = [(estimate(origen), 0, origen)]
+        while priority_queue:
+            _, cost, node = heapq.heappop(priority_queue)
+            if cost > millors[node]:
+                continue
+            if node == desti:
+                cami, arestes = self.reconstruct_path(predecessors, desti)
+                dist_total, _ = graph.path_totals(arestes)
+                return [graph.ids[n] for n in cami], cost, dist_total, rellotge[desti]
+            slot = model.slot(departure + rellotge[node])
+            if slot not in franges:
+                franges[slot] = self.time_dependent_weights(graph, slot)
+            weights, temps = franges[slot]
+            for aresta in range(offsets[node], offsets[node + 1]):
+                vei, nou_cost = targets[aresta], cost + weights[aresta]
+                if vei not in millors or nou_cost < millors[vei]:
+                    millors[vei] = nou_cost
+                    rellotge[vei] = rellotge[node] + temps[aresta]
+                    predecessors[vei] = (node, aresta)
+                    if vei not in estimacions:
+                        estimacions[vei] = estimate(vei)
+                    heapq.heappush(priority_queue, (nou_cost + estimacions[vei], nou_cost, vei))
         return [], float('inf'), float('inf'), float('inf')
 
     def load_coordinates(self, info_nodes):
@@ -110,43 +1011,271 @@ class Route():
         """
         Obtain a random node from the dictionary 'self.coordinates_nodes'
         """
-        rand = random.randint(0, len(self.nodes))
-        return self.coordinates_nodes[self.nodes[rand]]
+        return self.coordinates_nodes[random.choice(self.nodes)]
+
+    def search(self, origin: str, dest: str, engine=None, departure=None, profile=None, consumption=None):
+        """
+        Executa la cerca del camí òptim amb el motor indicat, reutilitzant els resultats de la memòria cau de rutes
+        (clau: signatura del graf, motor, node d'origen, node de destí i perfil de cost).
+
+        PRE: origen i desti són IDs de nodes del graf.
+            engine és 'ucs', 'astar', 'bidirectional', 'ch' o 'td' (per defecte self.engine). Amb simplify, 'ucs' i 'astar'
+            es fan sobre el graf simplificat (simplified_search). 'td' és l'A* dependent del temps sobre el graf base
+            a partir de departure (per defecte, ara); els seus resultats no es desen a la memòria cau.
+            profile i consumption com a resolve_profile (per defecte, el perfil del graf); 'td' només admet el perfil per defecte.
+        POST: retorna el camí òptim, el cost total (en les unitats del perfil), la distància total i el temps total.
+        """
+        motors = {
+            'ucs': self.uniform_cost_search,
+            'astar': self.a_star_search,
+            'bidirectional': self.bidirectional_a_star_search,
+            'ch': self.contraction_search,
+        }
+        if self.simplify:
+            motors['ucs'] = lambda graph, origin, dest: self.simplified_search(graph, origin, dest, heuristic=False)
+            motors['astar'] = self.simplified_search
+        engine = engine or self.engine
+        perfil = resolve_profile(profile, consumption, self.default_profile())
+        if engine == 'td':
+            if perfil.key != self.default_profile().key:
+                raise ValueError("The 'td' engine only supports the default cost profile.")
+            with search_stats('td', *SEARCH_MODULES):
+                cami, cost, dist_total, temps_total = self.time_dependent_search(self.base(), origin, dest, departure)
+            return list(cami), cost, dist_total, temps_total
+        if engine not in motors:
+            raise ValueError(f"Unknown search engine '{engine}'.")
+        graph = self.profile_graph(perfil)
+        # El motor (i si la cerca és sobre el graf simplificat) forma part de la clau: amb empats de cost, motors
+        # diferents poden retornar camins diferents, i el magatzem SQLite es comparteix entre Routes.
+        clau = (graph.signature(), engine, self.simplify, origin, dest) + perfil.key
+        resultat = self.route_cache.get(clau)
+        if resultat is None:
+            # El preprocessament (jerarquia o graf simplificat) es fa abans, per no comptar-lo com a part de la cerca.
+            with stage('preprocess', engine=engine):
+                if engine == 'ch':
+                    self.contraction_hierarchy(graph)
+                elif self.simplify and engine in ('ucs', 'astar'):
+                    self.simplified_graph(graph)
+            with search_stats(engine, *SEARCH_MODULES):
+                resultat = motors[engine](graph, origin, dest)
+            self.route_cache.put(clau, resultat)
+        cami, cost, dist_total, temps_total = resultat
+        return list(cami), cost, dist_total, temps_total
+
+    def find_route(self, lat_origin, long_origin, lat_dest, long_dest, engine=None, departure=None, profile=None,
+                   price_km=None, consumption=None, capacity=None, battery=None, reserve=RESERVE_BATTERY):
+        """
+        Calcula la ruta entre dues coordenades amb el perfil de cost indicat.
 
-    def find_route(self, lat_origin, long_origin, lat_dest, long_dest):
+        PRE: profile és None (perfil per defecte), 'balanced', 'shortest', 'fastest', 'energy', una parella
+            (w_distancia, w_temps) o un diccionari {'distance': w, 'time': w}.
+            price_km és el preu per km, consumption el consum en kWh/km i capacity la capacitat de la bateria en kWh
+            (opcionals; consumption també és el consum del perfil 'energy').
+            battery és el percentatge de bateria a l'origen i reserve el que no s'ha de gastar; amb battery i capacity
+            la ruta ha de ser factible amb la bateria i pot incloure parades de càrrega (battery_search).
+        POST: retorna la ruta, la distància (km) i el temps (min) i, si s'han donat, el consum (kWh), el preu
+            i el percentatge de bateria necessari. Amb battery, també la bateria a cada punt de la ruta ("battery", %),
+            la bateria en arribar i les parades de càrrega. Llança ValueError si no hi ha cap ruta factible.
+        """
         node_origin = self.find_closest_node((long_origin, lat_origin), self.coordinates_nodes)
         node_dest   = self.find_closest_node((long_dest, lat_dest), self.coordinates_nodes)
         print(f'node_origin: {node_origin}, node_dest: {node_dest}')
+        return self.route_between(node_origin, node_dest, lat_origin, long_origin, lat_dest, long_dest, engine, departure,
+                                  profile, price_km, consumption, capacity, battery, reserve)
+
+    def route_between(self, node_origin: str, node_dest: str, lat_origin, long_origin, lat_dest, long_dest, engine=None,
+                      departure=None, profile=None, price_km=None, consumption=None, capacity=None, battery=None,
+                      reserve=RESERVE_BATTERY):
+        """
+        Calcula la ruta entre dos nodes ja enganxats (p. ex. amb snap_many per a un lot de peticions).
 
-        optimal_route, cost_total, dist_total, time_total = self.uniform_cost_search(self.adjacent_list, node_origin, node_dest)
+        PRE: node_origin i node_dest són IDs de nodes del graf; les coordenades són les dels punts originals
+            (són el primer i l'últim punt de la ruta). La resta de paràmetres com a find_route.
+        POST: com a find_route.
+        """
+        with stage('search'):
+            optimal_route, cost_total, dist_total, time_total = self.search(node_origin, node_dest, engine, departure, profile, consumption)
         if not optimal_route:
             raise ValueError("No optimal route has been found.")
         
         if cost_total == float('inf'):
             raise ValueError("The route exceeds the autonomy of the vehicle.")
+
+        parades, carregues = [], None
+        if battery is not None and capacity:
+            consumption = DEFAULT_CONSUMPTION if consumption is None else consumption
+            graph = self.profile_graph(profile, consumption)
+            inicial, minima = battery / 100 * capacity, reserve / 100 * capacity
+            arestes = graph.path_edges([graph.index[node] for node in optimal_route])
+            carregues = (inicial - np.concatenate([[0.0], np.cumsum(energy(graph.distance[arestes], graph.time[arestes], consumption))])).tolist()
+            if carregues[-1] < minima:
+                # La ruta òptima no és factible amb la bateria: cerca amb restricció de bateria i parades de càrrega.
+                perfil = resolve_profile(profile, consumption, self.default_profile())
+                pes_carrega = 0.0 if perfil.energy else self.heuristc_graph(0.0, 1.0, perfil.w_distancia, perfil.w_temps)
+                with search_stats('battery', *SEARCH_MODULES, unit='labels'):
+                    optimal_route, cost_total, dist_total, time_total, parades, carregues = self.battery_search(
+                        graph, node_origin, node_dest, inicial, capacity, consumption, minima, pes_carrega)
+                if not optimal_route:
+                    raise ValueError("The route exceeds the autonomy of the vehicle.")
         
-        coordinates = [{"longitude": long_origin, "latitude": lat_origin}] + [
-            {"longitude": lon, "latitude": lat} for node in optimal_route for lon, lat in [self.obtain_coordinates(node, self.coordinates_nodes)]
-        ] + [{"longitude": long_dest, "latitude": lat_dest}]
+        with stage('assemble'):
+            coordinates = [{"longitude": long_origin, "latitude": lat_origin}] + [
+                {"longitude": lon, "latitude": lat} for node in optimal_route for lon, lat in [self.obtain_coordinates(node, self.coordinates_nodes)]
+            ] + [{"longitude": long_dest, "latitude": lat_dest}]
         
-        return {
-            "route": coordinates,
-            #"consumption": round(dist_total / 1000 * consum_kWh, 2),
-            "distance": round(dist_total / 1000, 2),
-            "time": round(time_total / 60, 2),
-            #"necessary_battery": round(dist_total / 1000 * consum_kWh / capacitat_bateria_kWh * 100, 2)
-        }
+            resultat = {
+                "route": coordinates,
+                "distance": round(dist_total / 1000, 2),
+                "time": round(time_total / 60, 2),
+            }
+            if consumption is not None:
+                graph = self.profile_graph(profile, consumption)
+                arestes = graph.path_edges([graph.index[node] for node in optimal_route])
+                kwh = float(energy(graph.distance[arestes], graph.time[arestes], consumption).sum())
+                resultat["consumption"] = round(kwh, 2)
+                if capacity:
+                    resultat["necessary_battery"] = round(kwh / capacity * 100, 2)
+            if price_km is not None:
+                resultat["price"] = round(dist_total / 1000 * price_km, 2)
+            if carregues is not None:
+                percentatges = [round(carrega / capacity * 100, 2) for carrega in carregues]
+                resultat["battery"] = percentatges[:1] + percentatges + percentatges[-1:]
+                resultat["arrival_battery"] = percentatges[-1]
+                resultat["charging_stops"] = [
+                    {"longitude": lon, "latitude": lat, "charged_kwh": round(kwh, 2), "minutes": round(segons / 60, 2)}
+                    for node, kwh, segons in parades for lon, lat in [self.obtain_coordinates(node, self.coordinates_nodes)]]
+        return resultat
+
+    def one_to_many(self, graph, origin: int, targets):
+        """
+        Dijkstra des d'un node que s'atura quan tots els nodes objectiu estan fixats.
+
+        PRE: graf és un CSRGraph; origen és l'índex del node d'origen; objectius és un conjunt d'índexs de nodes.
+        POST: retorna un diccionari objectiu -> (cost, distància, temps) amb els objectius assolibles.
+        """
+        offsets, targets_view, weights = graph.views()
+        pendents = set(targets)
+        millors = {origin: 0}
+        predecessors = {origin: None}
+        visitats = set()
+        priority_queue = [(0, origin)]
+        while priority_queue and pendents:
+            cost, node = heapq.heappop(priority_queue)
+            if node in visitats:
+                continue
+            visitats.add(node)
+            pendents.discard(node)
+            for aresta in range(offsets[node], offsets[node + 1]):
+                vei, nou_cost = targets_view[aresta], cost + weights[aresta]
+                if vei not in visitats and (vei not in millors or nou_cost < millors[vei]):
+                    millors[vei] = nou_cost
+                    predecessors[vei] = (node, aresta)
+                    heapq.heappush(priority_queue, (nou_cost, vei))
+        # Distància i temps acumulats sobre l'arbre de camins, reaprofitant els prefixos comuns.
+        distance, time = graph.distance, graph.time
+        acumulats = {origin: (0.0, 0.0)}
+        resultat = {}
+        for objectiu in targets:
+            if objectiu not in visitats:
+                continue
+            cami, node = [], objectiu
+            while node not in acumulats:
+                cami.append(node)
+                node = predecessors[node][0]
+            dist_total, temps_total = acumulats[node]
+            for node in reversed(cami):
+                aresta = predecessors[node][1]
+                dist_total, temps_total = dist_total + float(distance[aresta]), temps_total + float(time[aresta])
+                acumulats[node] = (dist_total, temps_total)
+            resultat[objectiu] = (millors[objectiu], dist_total, temps_total)
+        return resultat
+
+    def distance_matrix_rows(self, origins, targets, profile=None):
+        """
+        Calcula les files de la matriu per a una llista d'orígens (índexs de node o None si no són al graf).
+
+        PRE: origens és una llista d'índexs de node (o None); objectius és una llista d'índexs de node (o None).
+            perfil com a resolve_profile (per defecte, el perfil del graf).
+        POST: retorna tres arrays len(origens) x len(objectius) amb cost, distància (km) i temps (min).
+        """
+        graph = self.profile_graph(profile)
+        forma = (len(origins), len(targets))
+        cost, dist, temps = np.full(forma, np.inf), np.full(forma, np.inf), np.full(forma, np.inf)
+        assolibles = {objectiu for objectiu in targets if objectiu is not None}
+        for fila, origen in enumerate(origins):
+            if origen is None:
+                continue
+            resultat = self.one_to_many(graph, origen, assolibles)
+            for columna, objectiu in enumerate(targets):
+                if objectiu in resultat:
+                    cost[fila, columna], dist[fila, columna], temps[fila, columna] = resultat[objectiu]
+        return cost, dist / 1000, temps / 60
+
+    def distance_matrix(self, origins, destinations, processes=None, profile=None):
+        """
+        Calcula la matriu de costos, distàncies i temps entre molts orígens i destinacions.
+
+        Cada punt s'enganxa una sola vegada al node més proper (snap_many) i per a cada node d'origen diferent
+        es fa un únic Dijkstra un-a-molts que s'atura quan totes les destinacions estan fixades.
+
+        PRE: origens i destinacions són seqüències de tuples (longitud, latitud).
+            processes és el nombre de processos per repartir les files (None o 1: sense paral·lelisme).
+            profile és el perfil de cost de la matriu (com a resolve_profile).
+        POST: retorna un diccionari amb els arrays "cost", "distance" (km) i "time" (min), de forma
+            len(origens) x len(destinacions); les parelles sense camí valen inf.
+            Llança ValueError si algun punt s'enganxa a un node que no és al graf.
+        """
+        graph = self.adjacent_list
+        nodes_origen, nodes_desti = self.snap_many(origins), self.snap_many(destinations)
+        for node in nodes_origen + nodes_desti:
+            if node not in graph.index:
+                raise ValueError(f"Node '{node}' not found in the graph.")
+        unics = list(dict.fromkeys(graph.index[node] for node in nodes_origen))
+        targets = list(dict.fromkeys(graph.index[node] for node in nodes_desti))
+        if processes and processes > 1 and len(unics) > 1:
+            blocs = [unics[i::processes] for i in range(processes) if unics[i::processes]]
+            with ProcessPoolExecutor(len(blocs), mp_context=multiprocessing.get_context('fork'),
+                                     initializer=init_matrix_worker, initargs=(self,)) as executor:
+                parts = list(executor.map(matrix_worker_rows, blocs, itertools.repeat(targets), itertools.repeat(profile)))
+            files = {origen: (parts[i][0][k], parts[i][1][k], parts[i][2][k])
+                     for i, bloc in enumerate(blocs) for k, origen in enumerate(bloc)}
+        else:
+            cost, dist, temps = self.distance_matrix_rows(unics, targets, profile)
+            files = {origen: (cost[k], dist[k], temps[k]) for k, origen in enumerate(unics)}
+        posicions = {objectiu: columna for columna, objectiu in enumerate(targets)}
+        columnes = [posicions[graph.index[node]] for node in nodes_desti]
+        matriu = [np.stack([files[graph.index[node]][camp] for node in nodes_origen]).reshape(len(nodes_origen), -1)
+                  for camp in range(3)]
+        return {"cost": matriu[0][:, columnes], "distance": matriu[1][:, columnes], "time": matriu[2][:, columnes]}
+
+_matrix_route = None
+
+def init_matrix_worker(route):
+    """
+    Inicialitza un procés de la matriu de distàncies amb la ruta heretada del pare (fork, sense còpia).
+    """
+    global _matrix_route
+    _matrix_route = route
+
+def matrix_worker_rows(origins, targets, profile=None):
+    """
+    Calcula, en un procés de treball, les files de la matriu per a un bloc d'orígens.
+    """
+    return _matrix_route.distance_matrix_rows(origins, targets, profile)
+
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calcula la ruta òptima entre dos punts.')
+    for nom in ('lat_origin', 'long_origin', 'lat_dest', 'long_dest', 'price_km', 'consumption', 'capacity'):
+        parser.add_argument(nom, type=float)
+    parser.add_argument('--profile', default=None, help=f"perfil de cost: {', '.join(NAMED_PROFILES)}, energy o 'w_distancia,w_temps'")
+    parser.add_argument('--engine', default=None)
+    args = parser.parse_args()
+    profile = args.profile
+    if profile and ',' in profile:
+        profile = tuple(float(w) for w in profile.split(','))
+
     route = Route()
-    if len(sys.argv) != 8:
-        exit(-1)
-    lat_origin  = float(sys.argv[1])
-    long_origin = float(sys.argv[2])
-    lat_dest    = float(sys.argv[3])
-    long_dest   = float(sys.argv[4])
-    price_km    = float(sys.argv[5])
-    consumption = float(sys.argv[6])
-    capacity    = float(sys.argv[7])
-
-    print(json.dumps(route.find_route(lat_origin, long_origin, lat_dest, long_dest, price_km, consumption, capacity), indent=4))
+    print(json.dumps(route.find_route(args.lat_origin, args.long_origin, args.lat_dest, args.long_dest, args.engine,
+                                      profile=profile, price_km=args.price_km, consumption=args.consumption,
+                                      capacity=args.capacity), indent=4))
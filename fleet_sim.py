@@ -0,0 +1,271 @@
+import argparse
+import heapq
+import json
+import os
+import random
+import time
+from battery import CHARGE_OVERHEAD, DEFAULT_CHARGING_POWER, RESERVE_BATTERY, charge_seconds
+from profiles import DEFAULT_CONSUMPTION, energy
+
+#----------------------------------------------------------------
+# DISCRETE-EVENT FLEET SIMULATOR                                |
+#----------------------------------------------------------------
+# Drives the cars of virtual_car.py on a virtual clock instead of sleeps.
+# Each car has one pending event in a priority queue (time, sequence, car)
+# and the clock jumps from event to event. While driving, a car reaches
+# the next node after the time of the edge in the graph (with the traffic
+# of the Route, if any) and drains the energy of the edge (profiles.energy,
+# proportional to its distance). Destinations come from a per-car random
+# generator seeded from the run seed, so a run is reproducible and its
+# event log can be replayed against the real API afterwards:
+#
+#   python fleet_sim.py run --cars 2000 --hours 1 --seed 7 --log events.jsonl
+#   API_HOST=http://127.0.0.1:8000 python fleet_sim.py replay events.jsonl --speed 60
+
+CAPACITY        = 50.0     # kWh
+ROUTE_ATTEMPTS  = 10       # destinations tried before the car waits
+IDLE_SECONDS    = 60.0     # wait after ROUTE_ATTEMPTS destinations without a route
+
+class SimCar():
+    """
+    State of one simulated car: the API record (same shape as virtual_car's cars), its node and battery,
+    and the trip in progress (nodes, edge times and energies, and the index of the last node reached).
+    """
+    __slots__ = ('record', 'name', 'edge', 'rng', 'node', 'soc', 'reported', 'state',
+                 'path', 'times', 'energies', 'index', 'trips', 'charges', 'distance')
+
+    def __init__(self, record: dict, node: str, capacity: float, seed):
+        self.record   = record
+        self.name     = record['car']['licenseplate']
+        self.edge     = record['edgedevice']['name']
+        self.rng      = random.Random(f'{seed}:{self.name}')
+        self.node     = node
+        self.soc      = float(record['car']['battery']) / 100 * capacity
+        self.reported = round(float(record['car']['battery']))
+        self.state    = 'idle'
+        self.path, self.times, self.energies = [], [], []
+        self.index    = 0
+        self.trips    = 0
+        self.charges  = 0
+        self.distance = 0.0
+
+class FleetSimulator():
+    def __init__(self, route, cars: list, seed=0, engine=None, consumption=DEFAULT_CONSUMPTION, capacity=CAPACITY,
+                 reserve=RESERVE_BATTERY, charging_power=DEFAULT_CHARGING_POWER, log=None):
+        self.route    = route
+        self.seed     = seed
+        self.engine   = engine
+        self.consumption = consumption
+        self.capacity = capacity
+        self.reserve  = reserve / 100 * capacity
+        self.charging_power = charging_power
+        self.log      = log
+        self.now      = 0.0
+        self.queue    = []
+        self.sequence = 0
+        self.events   = 0
+        self.graph    = route.profile_graph()
+        self.destinations = [node for node in route.nodes if node in self.graph.index]
+        nodes = route.snap_many([(float(car['edgedevice']['longitude']), float(car['edgedevice']['latitude'])) for car in cars])
+        self.cars = [SimCar(car, node, capacity, seed) for car, node in zip(cars, nodes)]
+        self.emit('header', None, seed=seed, engine=engine, consumption=consumption, capacity=capacity, reserve=reserve,
+                  cars=cars)
+        for i in range(len(self.cars)):
+            self.schedule(0.0, i)
+
+    #-----------------------------+
+    #       EVENTS                |
+    #-----------------------------+
+    def schedule(self, when: float, i: int):
+        heapq.heappush(self.queue, (when, self.sequence, i))
+        self.sequence += 1
+
+    def emit(self, kind: str, car: SimCar, **fields):
+        self.events += 1
+        if self.log is None:
+            return
+        record = {'time': round(self.now, 3), 'type': kind}
+        if car is not None:
+            record['car'], record['edge'] = car.name, car.edge
+        record.update(fields)
+        self.log.write(json.dumps(record) + '\n')
+
+    def run(self, until: float):
+        """
+        Process the events up to `until` seconds of virtual time and return the run statistics.
+        """
+        start = time.perf_counter()
+        while self.queue and self.queue[0][0] <= until:
+            self.now, _, i = heapq.heappop(self.queue)
+            car = self.cars[i]
+            if car.state == 'driving':
+                self.advance(car, i)
+            elif car.state == 'charging':
+                self.charged(car, i)
+            else:
+                self.start_trip(car, i)
+        self.now = max(self.now, until)
+        return self.stats(time.perf_counter() - start)
+
+    def stats(self, wall: float):
+        return {
+            'cars': len(self.cars),
+            'simulated_s': round(self.now, 3),
+            'wall_s': round(wall, 3),
+            'speedup': round(self.now / wall, 1) if wall > 0 else None,
+            'events': self.events,
+            'trips': sum(car.trips for car in self.cars),
+            'charges': sum(car.charges for car in self.cars),
+            'distance_km': round(sum(car.distance for car in self.cars) / 1000, 3),
+        }
+
+    #-----------------------------+
+    #       CARS                  |
+    #-----------------------------+
+    def position(self, node: str):
+        longitude, latitude = self.route.coordinates_nodes[node]
+        return {'latitude': latitude, 'longitude': longitude}
+
+    def battery(self, car: SimCar):
+        """
+        Emit a battery event when the whole percentage changes (the API stores integers).
+        """
+        percent = round(car.soc / self.capacity * 100)
+        if percent != car.reported:
+            car.reported = percent
+            self.emit('battery', car, battery=percent)
+
+    def charge(self, car: SimCar, i: int):
+        car.state = 'charging'
+        car.charges += 1
+        seconds = CHARGE_OVERHEAD + charge_seconds(max(0.0, car.soc), self.capacity, self.capacity, self.charging_power)
+        self.emit('charge', car, minutes=round(seconds / 60, 2), **self.position(car.node))
+        self.schedule(self.now + seconds, i)
+
+    def charged(self, car: SimCar, i: int):
+        car.soc = self.capacity
+        self.battery(car)
+        self.start_trip(car, i)
+
+    def start_trip(self, car: SimCar, i: int):
+        """
+        Pick seeded random destinations until one is reachable on a full battery (down to the reserve) and start
+        driving to it (charging first, in place, on the reserve or when the battery would not last the trip,
+        as virtual_car does on the reserve).
+        """
+        car.state = 'idle'
+        if car.soc <= self.reserve:
+            return self.charge(car, i)
+        for _ in range(ROUTE_ATTEMPTS):
+            dest = car.rng.choice(self.destinations)
+            if dest == car.node:
+                continue
+            path, _, distance, seconds = self.route.search(car.node, dest, self.engine)
+            if len(path) < 2:
+                continue
+            edges = self.graph.path_edges([self.graph.index[node] for node in path])
+            energies = energy(self.graph.distance[edges], self.graph.time[edges], self.consumption)
+            if energies.sum() <= self.capacity - self.reserve:
+                break
+        else:
+            self.schedule(self.now + IDLE_SECONDS, i)
+            return
+        if car.soc - energies.sum() < self.reserve:
+            return self.charge(car, i)
+        car.path, car.times, car.energies = path, self.graph.time[edges].tolist(), energies.tolist()
+        car.index = 0
+        car.distance += distance
+        car.state = 'driving'
+        self.emit('trip', car, origin=car.node, destination=dest, distance=round(distance / 1000, 3),
+                  minutes=round(seconds / 60, 2))
+        self.schedule(self.now + car.times[0], i)
+
+    def advance(self, car: SimCar, i: int):
+        car.soc -= car.energies[car.index]
+        car.index += 1
+        car.node = car.path[car.index]
+        self.emit('location', car, **self.position(car.node))
+        self.battery(car)
+        if car.index == len(car.path) - 1:
+            car.trips += 1
+            self.start_trip(car, i)
+        else:
+            self.schedule(self.now + car.times[car.index], i)
+
+#-----------------------------+
+#       REPLAY                |
+#-----------------------------+
+def read_log(path: str):
+    with open(path, 'r') as f:
+        for line in f:
+            yield json.loads(line)
+
+def replay(path: str, api_host: str, token: str, speed=1.0, flush_interval=1.0, batch_size=50):
+    """
+    Send the location and battery events of a log to the API through the telemetry pipeline, keeping the
+    virtual times divided by `speed` (0: as fast as possible).
+    """
+    from telemetry import TelemetryPipeline
+    events = read_log(path)
+    header = next(events)
+    cars = {car['car']['licenseplate']: car for car in header['cars']}
+    telemetry = TelemetryPipeline(api_host, token, flush_interval=flush_interval, batch_size=batch_size).start()
+    start = time.monotonic()
+    try:
+        for event in events:
+            if event['type'] not in ('location', 'battery'):
+                continue
+            if speed > 0:
+                delay = event['time'] / speed - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if event['type'] == 'location':
+                telemetry.submit_location(cars[event['car']], event)
+            else:
+                telemetry.submit_battery(cars[event['car']], event['battery'])
+    finally:
+        telemetry.stop()
+    return telemetry.metrics()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Discrete-event fleet simulator with a replayable event log.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='simulate the fleet on a virtual clock')
+    run_parser.add_argument('--cars', type=int, default=100, help='synthetic cars (ignored with --from-api)')
+    run_parser.add_argument('--from-api', action='store_true', help='start from the cars of API_HOST')
+    run_parser.add_argument('--hours', type=float, default=1.0, help='virtual hours to simulate')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--engine', default=None, help='search engine (default: the Route default)')
+    run_parser.add_argument('--consumption', type=float, default=float(os.getenv('CAR_CONSUMPTION', DEFAULT_CONSUMPTION)))
+    run_parser.add_argument('--capacity', type=float, default=float(os.getenv('CAR_CAPACITY', CAPACITY)))
+    run_parser.add_argument('--log', help='write the event log (JSONL) to this file')
+    replay_parser = subparsers.add_parser('replay', help='send an event log to the API')
+    replay_parser.add_argument('log')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='virtual seconds per real second (0: no pacing)')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        from find_route import Route
+        if args.from_api:
+            import requests
+            from dotenv import load_dotenv
+            load_dotenv()
+            cars = requests.get(os.getenv('API_HOST') + '/api/v1/car').json()['data']
+        else:
+            from stub_server import make_cars
+            cars = make_cars(args.cars, args.seed)
+        route = Route(route_cache_path=os.getenv('ROUTE_CACHE_PATH'))
+        log = open(args.log, 'w') if args.log else None
+        try:
+            simulator = FleetSimulator(route, cars, args.seed, args.engine, args.consumption, args.capacity, log=log)
+            print(json.dumps(simulator.run(args.hours * 3600), indent=2))
+        finally:
+            if log is not None:
+                log.close()
+    else:
+        from dotenv import load_dotenv
+        from virtual_car import obtain_token
+        load_dotenv()
+        api_host = os.getenv('API_HOST')
+        token = obtain_token(api_host + '/api/v1/login/access-token', os.getenv('USERNAME'), os.getenv('PASSWORD'))
+        print(json.dumps(replay(args.log, api_host, token, args.speed), indent=2))
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from battery import CHARGE_OVERHEAD, CHARGE_TAPER, DEFAULT_CHARGING_POWER, RESERVE_BATTERY
+from fleet_sim import CAPACITY, ROUTE_ATTEMPTS
+from profiles import DEFAULT_CONSUMPTION, energy
+
+#----------------------------------------------------------------
+# VECTORISED FLEET STATE                                        |
+#----------------------------------------------------------------
+# The whole fleet as a struct of NumPy arrays (one entry per car) instead
+# of one nested dict per car: position, last node reached, progress along
+# the current edge, battery and state. The routes of all cars live in one
+# flat buffer of graph edge indices; each car only keeps its current
+# offset and the end of its route. step(dt) moves every car dt seconds
+# along its edges (using the edge times of the graph), drains the energy
+# of the distance covered and interpolates the positions, all with array
+# operations. Only the cars that finish a trip go back to Python, to get
+# a new route from Route.search.
+#
+#   python fleet_state.py --cars 10000 --seconds 600 --tick 1 --engine ch
+
+DRIVING, CHARGING, IDLE = 0, 1, 2
+BUFFER_SIZE = 1 << 16      # initial edges of the route buffer
+
+class FleetState():
+    def __init__(self, route, cars: list, seed=0, engine=None, consumption=DEFAULT_CONSUMPTION, capacity=CAPACITY,
+                 reserve=RESERVE_BATTERY, charging_power=DEFAULT_CHARGING_POWER):
+        self.route    = route
+        self.engine   = engine
+        self.capacity = capacity
+        self.reserve  = reserve / 100 * capacity
+        self.charging_power = charging_power
+        self.rng      = np.random.default_rng(seed)
+        self.now      = 0.0
+        self.records  = cars
+
+        graph = self.graph = route.profile_graph()
+        self.edge_source = graph.sources().astype(np.int64)
+        self.edge_target = np.asarray(graph.targets, dtype=np.int64)
+        self.edge_time   = np.maximum(np.asarray(graph.time, dtype=np.float64), 1e-6)
+        self.edge_energy = energy(graph.distance, graph.time, consumption)
+        coordinates = np.asarray(graph.coordinates, dtype=np.float64)
+        self.node_lon, self.node_lat = coordinates[:, 0], coordinates[:, 1]
+        self.destinations = np.array([graph.index[node] for node in route.nodes if node in graph.index], dtype=np.int64)
+
+        n = len(cars)
+        starts = route.snap_many([(float(car['edgedevice']['longitude']), float(car['edgedevice']['latitude'])) for car in cars])
+        self.node      = np.array([graph.index[node] for node in starts], dtype=np.int64)
+        self.lon       = self.node_lon[self.node].copy()
+        self.lat       = self.node_lat[self.node].copy()
+        self.battery   = np.array([float(car['car']['battery']) for car in cars]) / 100 * capacity
+        self.state     = np.full(n, IDLE, dtype=np.int8)
+        self.position  = np.zeros(n, dtype=np.int64)    # offset of the current edge in the route buffer
+        self.route_end = np.zeros(n, dtype=np.int64)    # offset just after the last edge of the route
+        self.progress  = np.zeros(n, dtype=np.float64)  # seconds driven on the current edge
+        self.wait      = np.zeros(n, dtype=np.float64)  # seconds left of the charging stop before charging
+        self.trips     = np.zeros(n, dtype=np.int64)
+        self.buffer    = np.empty(BUFFER_SIZE, dtype=np.int64)
+        self.used      = 0
+        self.assign_routes(np.arange(n))
+
+    def __len__(self):
+        return len(self.node)
+
+    @property
+    def battery_percent(self):
+        return self.battery / self.capacity * 100
+
+    #-----------------------------+
+    #       ROUTE BUFFER          |
+    #-----------------------------+
+    def reserve_buffer(self, size: int):
+        """
+        Make room for `size` more edges: compact the buffer to the edges still ahead of the driving cars
+        when they fill less than half of it, otherwise double it.
+        """
+        if self.used + size <= len(self.buffer):
+            return
+        driving = np.flatnonzero(self.state == DRIVING)
+        lengths = self.route_end[driving] - self.position[driving]
+        live = int(lengths.sum())
+        total = len(self.buffer)
+        while live + size > total // 2:
+            total *= 2
+        starts = np.cumsum(lengths) - lengths
+        buffer = np.empty(total, dtype=np.int64)
+        buffer[:live] = self.buffer[np.arange(live) - np.repeat(starts, lengths) + np.repeat(self.position[driving], lengths)]
+        self.buffer, self.used = buffer, live
+        self.position[driving] = starts
+        self.route_end[driving] = starts + lengths
+
+    def assign_routes(self, cars):
+        """
+        Give a new random destination (seeded) reachable on a full battery (down to the reserve) to each of the
+        given idle cars, or send it to charge in place when it is on the reserve or the battery would not last
+        the trip (as virtual_car does on the reserve).
+        """
+        graph = self.graph
+        for i in cars.tolist():
+            if self.battery[i] <= self.reserve:
+                self.start_charging(i)
+                continue
+            origin = graph.ids[self.node[i]]
+            for dest in self.rng.choice(self.destinations, ROUTE_ATTEMPTS).tolist():
+                path = self.route.search(origin, graph.ids[dest], self.engine)[0]
+                if len(path) < 2:
+                    continue
+                edges = graph.path_edges([graph.index[node] for node in path])
+                if self.edge_energy[edges].sum() <= self.capacity - self.reserve:
+                    break
+            else:
+                continue
+            if self.battery[i] - self.edge_energy[edges].sum() < self.reserve:
+                self.start_charging(i)
+                continue
+            self.reserve_buffer(len(edges))
+            self.buffer[self.used:self.used + len(edges)] = edges
+            self.position[i], self.route_end[i] = self.used, self.used + len(edges)
+            self.used += len(edges)
+            self.progress[i] = 0.0
+            self.state[i] = DRIVING
+
+    def start_charging(self, i: int):
+        self.state[i] = CHARGING
+        self.wait[i] = CHARGE_OVERHEAD
+
+    #-----------------------------+
+    #       STEP                  |
+    #-----------------------------+
+    def step(self, dt: float):
+        """
+        Advance the whole fleet dt seconds. Cars that finish a trip during the tick get their next route
+        at the end of it (and start it on the next tick).
+        """
+        self.charge(dt)
+        active = np.flatnonzero(self.state == DRIVING)
+        remaining = np.full(len(active), float(dt))
+        # Each pass moves every active car to the end of its current edge or of the tick; a car only takes
+        # part in as many passes as edges it finishes in the tick.
+        while len(active):
+            edges = self.buffer[self.position[active]]
+            times = self.edge_time[edges]
+            left = times - self.progress[active]
+            finished = remaining >= left
+            move = np.minimum(remaining, left)
+            self.progress[active] += move
+            self.battery[active] -= self.edge_energy[edges] * (move / times)
+            remaining -= move
+            done = active[finished]
+            self.node[done] = self.edge_target[edges[finished]]
+            self.position[done] += 1
+            self.progress[done] = 0.0
+            arrived = done[self.position[done] == self.route_end[done]]
+            self.state[arrived] = IDLE
+            self.trips[arrived] += 1
+            keep = finished & (self.state[active] == DRIVING) & (remaining > 0)
+            active, remaining = active[keep], remaining[keep]
+        self.interpolate()
+        self.now += dt
+        self.assign_routes(np.flatnonzero(self.state == IDLE))
+
+    def charge(self, dt: float):
+        charging = np.flatnonzero(self.state == CHARGING)
+        if not len(charging):
+            return
+        waited = np.minimum(self.wait[charging], dt)
+        self.wait[charging] -= waited
+        # Full power up to CHARGE_TAPER of the capacity and half power above it.
+        power = np.where(self.battery[charging] < CHARGE_TAPER * self.capacity, self.charging_power, self.charging_power / 2)
+        self.battery[charging] = np.minimum(self.capacity, self.battery[charging] + power * (dt - waited) / 3600)
+        self.state[charging[self.battery[charging] >= self.capacity]] = IDLE
+
+    def interpolate(self):
+        driving = self.state == DRIVING
+        edges = self.buffer[self.position[driving]]
+        fraction = self.progress[driving] / self.edge_time[edges]
+        source, target = self.edge_source[edges], self.edge_target[edges]
+        self.lon[driving] = self.node_lon[source] + (self.node_lon[target] - self.node_lon[source]) * fraction
+        self.lat[driving] = self.node_lat[source] + (self.node_lat[target] - self.node_lat[source]) * fraction
+        self.lon[~driving] = self.node_lon[self.node[~driving]]
+        self.lat[~driving] = self.node_lat[self.node[~driving]]
+
+    #-----------------------------+
+    #       API                   |
+    #-----------------------------+
+    def submit(self, telemetry, reported: np.ndarray):
+        """
+        Queue the location of every car and the battery of the cars whose whole percentage changed since
+        `reported` (updated in place) in a TelemetryPipeline.
+        """
+        percent = np.round(self.battery_percent).astype(np.int64)
+        for i, (lon, lat) in enumerate(zip(self.lon.tolist(), self.lat.tolist())):
+            telemetry.submit_location(self.records[i], {'latitude': lat, 'longitude': lon})
+        for i in np.flatnonzero(percent != reported).tolist():
+            telemetry.submit_battery(self.records[i], int(percent[i]))
+        reported[:] = percent
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tick-based simulation of a large fleet with vectorised state.')
+    parser.add_argument('--cars', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=600, help='virtual seconds to simulate')
+    parser.add_argument('--tick', type=float, default=1.0, help='virtual seconds per step')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engine', default=None, help='search engine (default: the Route default)')
+    parser.add_argument('--api', action='store_true', help='send the positions and batteries to API_HOST every tick, in real time')
+    args = parser.parse_args()
+
+    from find_route import Route
+    from stub_server import make_cars
+    route = Route(route_cache_path=os.getenv('ROUTE_CACHE_PATH'))
+    start = time.perf_counter()
+    fleet = FleetState(route, make_cars(args.cars, args.seed), args.seed, args.engine,
+                       float(os.getenv('CAR_CONSUMPTION', DEFAULT_CONSUMPTION)), float(os.getenv('CAR_CAPACITY', CAPACITY)))
+    print(f'{len(fleet)} cars routed in {time.perf_counter() - start:.2f} s')
+
+    telemetry = None
+    if args.api:
+        from dotenv import load_dotenv
+        from telemetry import TelemetryPipeline
+        from virtual_car import obtain_token
+        load_dotenv()
+        api_host = os.getenv('API_HOST')
+        token = obtain_token(api_host + '/api/v1/login/access-token', os.getenv('USERNAME'), os.getenv('PASSWORD'))
+        telemetry = TelemetryPipeline(api_host, token, batch_size=len(fleet)).start()
+        reported = np.round(fleet.battery_percent).astype(np.int64)
+
+    ticks = []
+    while fleet.now < args.seconds:
+        start = time.perf_counter()
+        fleet.step(args.tick)
+        if telemetry is not None:
+            fleet.submit(telemetry, reported)
+        ticks.append(time.perf_counter() - start)
+        if telemetry is not None:
+            time.sleep(max(0.0, args.tick - ticks[-1]))
+    if telemetry is not None:
+        telemetry.stop()
+    ticks = np.array(ticks) * 1e3
+    print(json.dumps({
+        'cars': len(fleet),
+        'ticks': len(ticks),
+        'tick_ms_p50': round(float(np.percentile(ticks, 50)), 3),
+        'tick_ms_p99': round(float(np.percentile(ticks, 99)), 3),
+        'tick_ms_max': round(float(ticks.max()), 3),
+        'trips': int(fleet.trips.sum()),
+        'charging': int((fleet.state == CHARGING).sum()),
+        'mean_battery': round(float(fleet.battery_percent.mean()), 2),
+    }, indent=2))
@@ -0,0 +1,245 @@
+import hashlib
+import numpy as np
+
+class CSRGraph():
+    """
+    Graf dirigit en format CSR (compressed sparse row): els veïns del node i són targets[offsets[i]:offsets[i + 1]].
+
+    Els nodes s'identifiquen internament amb enters; ids i index fan la correspondència amb els IDs de text.
+    """
+    def __init__(self, ids, offsets, targets, weight, distance, time):
+        self.ids      = list(ids)
+        self.index    = {_id: i for i, _id in enumerate(self.ids)}
+        self.offsets  = offsets
+        self.targets  = targets
+        self.weight   = weight
+        self.distance = distance
+        self.time     = time
+        self._reverse = None
+        self._views   = None
+        self._signature = None
+        self.coordinates      = None
+        self.heuristic_factor = 0.0
+
+    @classmethod
+    def from_edges(cls, ids, sources, targets, weight, distance, time):
+        """
+        Construeix el graf a partir d'una llista d'arestes amb nodes ja numerats.
+
+        PRE: ids és la llista d'IDs dels nodes; sources i targets són arrays d'índexs (posicions a ids).
+            weight, distance i time són arrays alineats amb les arestes.
+        POST: retorna el CSRGraph amb les arestes agrupades per node d'origen (ordre estable).
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        ordre = np.argsort(sources, kind='stable')
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(ids)), out=offsets[1:])
+        return cls(ids, offsets,
+                   np.asarray(targets, dtype=np.int32)[ordre],
+                   np.asarray(weight, dtype=np.float64)[ordre],
+                   np.asarray(distance, dtype=np.float32)[ordre],
+                   np.asarray(time, dtype=np.float32)[ordre])
+
+    @classmethod
+    def from_adjacency(cls, adjacent_list: dict):
+        """
+        Converteix una llista d'adjacència (node -> [(vei, pes, distancia, temps)]) en un CSRGraph.
+
+        PRE: llista_adjacencia és un diccionari com el que retorna Route.read_file.
+        POST: retorna el CSRGraph equivalent.
+        """
+        index = {}
+        sources, targets, weight, distance, time = [], [], [], [], []
+        for node, arestes in adjacent_list.items():
+            origen = index.setdefault(node, len(index))
+            for vei, pes, dist, temps in arestes:
+                sources.append(origen)
+                targets.append(index.setdefault(vei, len(index)))
+                weight.append(pes)
+                distance.append(dist)
+                time.append(temps)
+        return cls.from_edges(list(index), sources, targets, weight, distance, time)
+
+    def with_weights(self, weight, time=None):
+        """
+        Retorna un graf amb la mateixa topologia (i coordenades) i uns altres pesos, sense copiar l'estructura.
+
+        PRE: pesos és un array alineat amb les arestes; temps, si es dona, substitueix el temps de les arestes.
+        POST: retorna un CSRGraph nou que comparteix ids, index, offsets, targets i distance amb aquest.
+        """
+        graph = CSRGraph.__new__(CSRGraph)
+        graph.__dict__.update(self.__dict__)
+        graph.weight = np.asarray(weight, dtype=np.float64)
+        if time is not None:
+            graph.time = np.asarray(time, dtype=np.float32)
+        graph._reverse = None
+        graph._views = None
+        graph._signature = None
+        return graph
+
+    def patched(self, removed_nodes, removed_pairs, added_edges):
+        """
+        Retorna un graf nou amb un conjunt de canvis aplicat, sense reconstruir-lo des dels fitxers.
+
+        PRE: nodes_eliminats és un conjunt d'IDs; parells_eliminats és un conjunt de tuples (ID origen, ID destí)
+            de les arestes a treure; arestes_afegides és una llista de tuples (ID origen, ID destí, pes, distancia, temps).
+            Els IDs nous de les arestes afegides s'afegeixen al graf.
+        POST: retorna un CSRGraph amb els nodes restants (en el mateix ordre, seguits dels nous) i les arestes restants
+            més les afegides. Les arestes que toquen un node eliminat també s'eliminen.
+        """
+        conservats = np.array([_id not in removed_nodes for _id in self.ids], dtype=bool)
+        ids = [_id for _id, conservat in zip(self.ids, conservats.tolist()) if conservat]
+        nou_index = np.full(len(self.ids), -1, dtype=np.int64)
+        nou_index[conservats] = np.arange(len(ids))
+
+        origen, desti = self.sources().astype(np.int64), np.asarray(self.targets, dtype=np.int64)
+        mantenir = conservats[origen] & conservats[desti]
+        parells = [(self.index[u], self.index[v]) for u, v in removed_pairs if u in self.index and v in self.index]
+        if parells:
+            codis = origen * len(self.ids) + desti
+            mantenir &= ~np.isin(codis, np.array([u * len(self.ids) + v for u, v in parells], dtype=np.int64))
+
+        index = {_id: i for i, _id in enumerate(ids)}
+        for u, v, *_ in added_edges:
+            index.setdefault(u, len(index))
+            index.setdefault(v, len(index))
+        ids = list(index)
+        afegides = np.array([(index[u], index[v]) for u, v, *_ in added_edges], dtype=np.int64).reshape(-1, 2)
+        dades = np.array([aresta[2:] for aresta in added_edges], dtype=np.float64).reshape(-1, 3)
+        return CSRGraph.from_edges(ids,
+                                   np.concatenate([nou_index[origen[mantenir]], afegides[:, 0]]),
+                                   np.concatenate([nou_index[desti[mantenir]], afegides[:, 1]]),
+                                   np.concatenate([np.asarray(self.weight)[mantenir], dades[:, 0]]),
+                                   np.concatenate([np.asarray(self.distance, dtype=np.float64)[mantenir], dades[:, 1]]),
+                                   np.concatenate([np.asarray(self.time, dtype=np.float64)[mantenir], dades[:, 2]]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_edges(self):
+        return len(self.targets)
+
+    @property
+    def nbytes(self):
+        """
+        Memòria ocupada pels arrays del graf (sense comptar la correspondència d'IDs).
+        """
+        return sum(a.nbytes for a in (self.offsets, self.targets, self.weight, self.distance, self.time))
+
+    def set_coordinates(self, coordinates_nodes: dict):
+        """
+        Alinea les coordenades dels nodes amb els índexs del graf.
+
+        PRE: coordenades_nodes és un diccionari ID -> (longitud, latitud).
+        POST: desa i retorna un array N x 2 (longitud, latitud) en graus, amb NaN als nodes sense coordenades.
+            També desa latituds i longituds en radians i el cosinus de la latitud per a l'heurística.
+        """
+        sense_coordenades = (float('nan'), float('nan'))
+        return self.set_coordinate_array(np.array([coordinates_nodes.get(_id, sense_coordenades) for _id in self.ids],
+                                                  dtype=np.float64).reshape(-1, 2))
+
+    def set_coordinate_array(self, coordinates):
+        """
+        Desa les coordenades ja alineades amb els índexs del graf (p. ex. carregades de la memòria cau).
+
+        PRE: coordenades és un array N x 2 (longitud, latitud) en graus.
+        POST: desa i retorna l'array, amb els radians i el cosinus de la latitud per a l'heurística.
+        """
+        self.coordinates = coordinates
+        self.lon_rad, self.lat_rad = np.radians(coordinates[:, 0]), np.radians(coordinates[:, 1])
+        self.cos_lat = np.cos(self.lat_rad)
+        return self.coordinates
+
+    def signature(self):
+        """
+        Retorna (i desa) el hash SHA-256 dels IDs, la topologia, els pesos, les distàncies i els temps del graf.
+
+        Serveix per lligar-hi dades derivades (jerarquies de contracció, rutes desades) i invalidar-les quan canvia.
+        Inclou els IDs perquè els camins desats es tradueixen a IDs, i les distàncies i els temps perquè les rutes
+        desades els retornen.
+        """
+        if self._signature is None:
+            sha = hashlib.sha256(f"{len(self.ids)}:{self.num_edges}".encode())
+            sha.update("\0".join(self.ids).encode())
+            for array in (self.offsets, self.targets, self.weight, self.distance, self.time):
+                sha.update(np.ascontiguousarray(array).tobytes())
+            self._signature = sha.hexdigest()
+        return self._signature
+
+    def views(self):
+        """
+        Retorna (i desa) memoryviews d'offsets, targets i weight per al bucle de relaxació de les cerques.
+
+        Indexar i tallar un memoryview retorna escalars i llistes de Python sense copiar el graf,
+        i és força més ràpid que indexar els arrays de numpy element a element.
+        """
+        if self._views is None:
+            self._views = tuple(memoryview(np.ascontiguousarray(a)) for a in (self.offsets, self.targets, self.weight))
+        return self._views
+
+    def sources(self):
+        """
+        Retorna l'array amb el node d'origen de cada aresta.
+        """
+        return np.repeat(np.arange(len(self.ids), dtype=np.int32), np.diff(self.offsets))
+
+    def reverse(self):
+        """
+        Retorna (i desa) el graf transposat, amb les mateixes dades d'aresta.
+
+        PRE: cert.
+        POST: retorna un CSRGraph amb els mateixos IDs on cada aresta u -> v passa a ser v -> u.
+        """
+        if self._reverse is None:
+            self._reverse = CSRGraph.from_edges(self.ids, self.targets, self.sources(), self.weight, self.distance, self.time)
+            self._reverse.index = self.index
+        return self._reverse
+
+    def path_totals(self, edges):
+        """
+        Suma la distància i el temps d'una seqüència d'arestes.
+
+        PRE: arestes és una llista d'índexs d'aresta.
+        POST: retorna (distància total, temps total) com a floats.
+        """
+        dist_total, temps_total = 0.0, 0.0
+        for dist, temps in zip(self.distance[edges].tolist(), self.time[edges].tolist()):
+            dist_total += dist
+            temps_total += temps
+        return dist_total, temps_total
+
+    def path_edges(self, nodes):
+        """
+        Retorna les arestes d'un camí donat pels seus nodes (la de menys pes si n'hi ha de paral·leles).
+
+        PRE: nodes és una llista d'índexs de node on cada parell consecutiu està connectat.
+        POST: retorna la llista d'índexs d'aresta.
+        """
+        if len(nodes) < 2:
+            return []
+        nodes = np.asarray(nodes, dtype=np.int64)
+        inici = np.asarray(self.offsets)[nodes[:-1]]
+        graus = np.asarray(self.offsets)[nodes[:-1] + 1] - inici
+        # Totes les arestes que surten de cada node del camí, amb el parell (posició al camí) al qual pertanyen.
+        parell = np.repeat(np.arange(len(nodes) - 1), graus)
+        candidates = np.arange(graus.sum()) - np.repeat(np.cumsum(graus) - graus, graus) + np.repeat(inici, graus)
+        pesos = np.where(np.asarray(self.targets)[candidates] == nodes[1:][parell], np.asarray(self.weight)[candidates], np.inf)
+        # Ordenades per parell i pes (estable: entre pesos iguals, la primera), la primera de cada parell és la bona.
+        ordre = np.lexsort((pesos, parell))
+        return candidates[ordre[np.cumsum(graus) - graus]].tolist()
+
+    def to_adjacency(self) -> dict:
+        """
+        Converteix el graf en una llista d'adjacència amb IDs de text (per compatibilitat).
+
+        PRE: cert.
+        POST: retorna un diccionari node -> [(vei, pes, distancia, temps)].
+        """
+        adjacent_list = {}
+        for i, _id in enumerate(self.ids):
+            inici, fi = self.offsets[i], self.offsets[i + 1]
+            adjacent_list[_id] = [(self.ids[v], w, float(d), float(t)) for v, w, d, t in zip(
+                self.targets[inici:fi].tolist(), self.weight[inici:fi].tolist(),
+                self.distance[inici:fi].tolist(), self.time[inici:fi].tolist())]
+        return adjacent_list
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+from graph import CSRGraph
+
+FORMAT_VERSION = 1
+GRAPH_CACHE_DIR = "inputs/graph_cache"
+ARRAYS = ('offsets', 'targets', 'weight', 'distance', 'time', 'ids', 'graph_coordinates', 'coordinate_ids', 'coordinates')
+
+def file_hash(path):
+    """
+    Calcula el hash SHA-256 del contingut d'un fitxer.
+
+    PRE: path és el camí d'un fitxer existent.
+    POST: retorna el hash en hexadecimal.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloc in iter(lambda: f.read(1 << 20), b''):
+            sha.update(bloc)
+    return sha.hexdigest()
+
+def source_signature(path):
+    """
+    Retorna la signatura d'un fitxer font: mida, data de modificació i hash.
+
+    PRE: path és el camí d'un fitxer existent.
+    POST: retorna un diccionari amb les claus size, mtime_ns i sha256.
+    """
+    estat = os.stat(path)
+    return {"size": estat.st_size, "mtime_ns": estat.st_mtime_ns, "sha256": file_hash(path)}
+
+def source_matches(path, signatura):
+    """
+    Comprova si un fitxer font és el mateix amb què es va compilar la memòria cau.
+
+    Si la mida i la data de modificació coincideixen no es torna a calcular el hash;
+    si només ha canviat la data (p. ex. una còpia) es compara el hash del contingut.
+
+    PRE: path és el camí d'un fitxer; signatura és el diccionari desat per source_signature.
+    POST: retorna True si el contingut no ha canviat.
+    """
+    try:
+        estat = os.stat(path)
+    except OSError:
+        return False
+    if estat.st_size != signatura["size"]:
+        return False
+    if estat.st_mtime_ns == signatura["mtime_ns"]:
+        return True
+    return file_hash(path) == signatura["sha256"]
+
+def encode_ids(ids):
+    """
+    Converteix una llista d'IDs de text en un array: int64 si tots són numèrics (IDs d'OSM), text altrament.
+    """
+    if all(_id.isdigit() for _id in ids):
+        return np.array([int(_id) for _id in ids], dtype=np.int64)
+    return np.array(ids, dtype=np.str_)
+
+def decode_ids(array):
+    """
+    Converteix l'array d'IDs desat per encode_ids en una llista d'IDs de text.
+    """
+    return [str(_id) for _id in array.tolist()]
+
+def save_array(cache_dir, name, array):
+    """
+    Desa un array en format .npy de manera atòmica (fitxer temporal + os.replace).
+    """
+    desti = os.path.join(cache_dir, f"{name}.npy")
+    temporal = f"{desti}.tmp-{os.getpid()}"
+    with open(temporal, 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(temporal, desti)
+
+def write_graph_cache(cache_dir, graph: CSRGraph, coordinates_nodes: dict, sources, weights):
+    """
+    Escriu el graf compilat i les coordenades dels nodes en fitxers .npy amb una metadada versionada.
+
+    PRE: cache_dir és el directori de sortida; graf és un CSRGraph preparat (amb coordenades i factor heurístic).
+        coordenades_nodes és el diccionari ID -> (longitud, latitud); fonts és la llista de fitxers JSON d'origen;
+        pesos és la tupla (w_distancia, w_temps) amb què s'han calculat els pesos.
+    POST: el directori conté un array .npy per camp i meta.json, que s'escriu l'últim.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    coordinate_ids = list(coordinates_nodes.keys())
+    arrays = {
+        'offsets': graph.offsets,
+        'targets': graph.targets,
+        'weight': graph.weight,
+        'distance': graph.distance,
+        'time': graph.time,
+        'ids': encode_ids(graph.ids),
+        'graph_coordinates': graph.coordinates,
+        'coordinate_ids': encode_ids(coordinate_ids),
+        'coordinates': np.array([coordinates_nodes[_id] for _id in coordinate_ids], dtype=np.float64).reshape(-1, 2),
+    }
+    for name, array in arrays.items():
+        save_array(cache_dir, name, array)
+    meta = {
+        "version": FORMAT_VERSION,
+        "sources": {path: source_signature(path) for path in sources},
+        "weights": list(weights),
+        "heuristic_factor": graph.heuristic_factor,
+        "nodes": len(graph),
+        "edges": graph.num_edges,
+    }
+    temporal = f"{meta_path}.tmp-{os.getpid()}"
+    with open(temporal, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(temporal, meta_path)
+
+def load_graph_cache(cache_dir, sources, weights):
+    """
+    Carrega el graf compilat amb numpy.memmap (sense còpia), de manera que els processos comparteixen les pàgines.
+
+    PRE: cache_dir és el directori de la memòria cau; fonts i pesos com a write_graph_cache.
+    POST: retorna (graf, coordenades_nodes) si la memòria cau existeix, és de la versió actual i correspon
+        als fitxers font i als pesos indicats; altrament retorna None.
+    """
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != FORMAT_VERSION or meta.get("weights") != list(weights):
+        return None
+    if set(meta.get("sources", {})) != set(sources):
+        return None
+    if not all(source_matches(path, meta["sources"][path]) for path in sources):
+        return None
+    try:
+        arrays = {name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r') for name in ARRAYS}
+    except (OSError, ValueError):
+        return None
+    graph = CSRGraph(decode_ids(arrays['ids']), arrays['offsets'], arrays['targets'],
+                     arrays['weight'], arrays['distance'], arrays['time'])
+    graph.set_coordinate_array(arrays['graph_coordinates'])
+    graph.heuristic_factor = meta["heuristic_factor"]
+    coordinates_nodes = dict(zip(decode_ids(arrays['coordinate_ids']), map(tuple, arrays['coordinates'].tolist())))
+    return graph, coordinates_nodes
+
+def compile_graph(route, cache_dir=GRAPH_CACHE_DIR):
+    """
+    Compila el graf d'una instància de Route (carregada des dels JSON) a la memòria cau binària.
+
+    PRE: route és una instància de Route.
+    POST: escriu la memòria cau a cache_dir.
+    """
+    write_graph_cache(cache_dir, route.adjacent_list, route.coordinates_nodes,
+                      [route.connection_nodes, route.info_nodes], (route.w_distancia, route.w_temps))
+
+if __name__ == '__main__':
+    from find_route import Route
+    cache_dir = sys.argv[1] if len(sys.argv) > 1 else GRAPH_CACHE_DIR
+    route = Route(graph_cache=None)
+    compile_graph(route, cache_dir)
+    print(f"Graph compiled to {cache_dir}: {len(route.adjacent_list)} nodes, {route.adjacent_list.num_edges} edges.")
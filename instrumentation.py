@@ -0,0 +1,499 @@
+import argparse
+import atexit
+import bisect
+import cProfile
+import heapq
+import json
+import multiprocessing.util
+import os
+import pstats
+import runpy
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import nullcontext
+
+#----------------------------------------------------------------
+# INSTRUMENTATION                                               |
+#----------------------------------------------------------------
+# Opt-in timers and counters around the hot stages of Route and the car
+# simulators (graph load, snapping, search, route assembly, API calls),
+# plus per-query search statistics (heap pushes, pops and settled nodes).
+# It is off by default, and then every hook is a single flag check. Set
+# ROUTE_METRICS to enable it in any entry point; each process exports
+# every ROUTE_METRICS_INTERVAL seconds and at exit:
+#
+#   ROUTE_METRICS=metrics.jsonl python virtual_car.py           # JSONL snapshots and one line per search
+#   ROUTE_METRICS=textfile/route-{pid}.prom python route_server.py  # Prometheus text format, one file per process
+#
+# Any entry point can also be run under a profiler. The sampling mode
+# writes folded stacks (the format of py-spy --format raw, flamegraph.pl
+# and speedscope) and an SVG flame graph, also for forked children:
+#
+#   python instrumentation.py profile --mode sample --output prof/car virtual_car.py
+#   python instrumentation.py profile --mode cprofile --output prof/route find_route.py 41.2237 1.7253 41.2300 1.7300 0.2 0.15 50
+
+BUCKETS         = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)   # s
+FLUSH_INTERVAL  = 10.0
+MAX_EVENTS      = 100000     # search events kept between two JSONL flushes
+SAMPLE_INTERVAL = 0.005
+FLAME_WIDTH     = 1200
+FLAME_ROW       = 16
+WRAPPER_FILES   = (__file__, '<frozen runpy>', runpy.__file__)
+
+#-----------------------------+
+#       REGISTRY              |
+#-----------------------------+
+class Registry():
+    """
+    Timers (with Prometheus histogram buckets) and counters of this process, keyed by name and labels.
+    """
+    def __init__(self):
+        self.lock     = threading.Lock()
+        self.timers   = {}
+        self.counters = Counter()
+        self.events   = []
+        self.keep_events = False
+
+    def observe(self, name: str, labels: tuple, seconds: float):
+        with self.lock:
+            timer = self.timers.get((name, labels))
+            if timer is None:
+                timer = self.timers[(name, labels)] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * (len(BUCKETS) + 1)}
+            timer['count'] += 1
+            timer['sum'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            timer['buckets'][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def add(self, name: str, labels: tuple, value=1):
+        with self.lock:
+            self.counters[(name, labels)] += value
+
+    def event(self, record: dict):
+        if not self.keep_events:
+            return
+        with self.lock:
+            if len(self.events) < MAX_EVENTS:
+                self.events.append(record)
+            else:
+                self.counters[('events_dropped', ())] += 1
+
+    def take_events(self):
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'time': time.time(),
+                'pid': os.getpid(),
+                'timers': [{'name': name, 'labels': dict(labels), 'count': t['count'], 'sum': t['sum'], 'max': t['max']}
+                           for (name, labels), t in self.timers.items()],
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self.counters.items()],
+            }
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.timers, self.counters, self.events = {}, Counter(), []
+
+def label_text(labels: dict):
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+def prometheus_text(registry=None):
+    """
+    The metrics of this process in the Prometheus text exposition format (every sample has a pid label).
+    """
+    registry = registry or REGISTRY
+    with registry.lock:
+        timers = sorted((key, dict(t, buckets=list(t['buckets']))) for key, t in registry.timers.items())
+        counters = sorted(registry.counters.items())
+    pid = {'pid': os.getpid()}
+    lines = ['# HELP route_stage_seconds Time spent in each instrumented stage.',
+             '# TYPE route_stage_seconds histogram']
+    for (name, labels), timer in timers:
+        labels = {'stage': name, **dict(labels), **pid}
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), timer['buckets']):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"route_stage_seconds_bucket{label_text({**labels, 'le': le})} {cumulative}")
+        lines.append(f"route_stage_seconds_sum{label_text(labels)} {timer['sum']!r}")
+        lines.append(f"route_stage_seconds_count{label_text(labels)} {timer['count']}")
+    declared = set()
+    for (name, labels), value in counters:
+        if name not in declared:
+            lines.append(f'# TYPE route_{name}_total counter')
+            declared.add(name)
+        lines.append(f'route_{name}_total{label_text({**dict(labels), **pid})} {value!r}')
+    return '\n'.join(lines) + '\n'
+
+#-----------------------------+
+#       SINKS                 |
+#-----------------------------+
+class JsonlSink():
+    """
+    Appends the search events and a snapshot of the registry to a JSONL file ({pid} in the path is replaced).
+    """
+    events = True
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, registry: Registry):
+        records = [dict(record, type='search') for record in registry.take_events()]
+        records.append(dict(registry.snapshot(), type='snapshot'))
+        with open(self.path.replace('{pid}', str(os.getpid())), 'a') as f:
+            f.write(''.join(json.dumps(record) + '\n' for record in records))
+
+class PrometheusSink():
+    """
+    Rewrites a Prometheus text file atomically, as the node_exporter textfile collector expects.
+    """
+    events = False
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, registry: Registry):
+        path = self.path.replace('{pid}', str(os.getpid()))
+        temporal = f"{path}.tmp-{os.getpid()}"
+        with open(temporal, 'w') as f:
+            f.write(prometheus_text(registry))
+        os.replace(temporal, path)
+
+#-----------------------------+
+#       STATE                 |
+#-----------------------------+
+REGISTRY = Registry()
+NOOP     = nullcontext()
+enabled  = False
+sink     = None
+flusher  = None
+interval = FLUSH_INTERVAL
+
+def configure(path=None, flush_interval=FLUSH_INTERVAL):
+    """
+    Enable the instrumentation in this process (and the processes forked from it). With a path ending in .jsonl
+    it is exported as JSONL, with any other path in the Prometheus text format, every flush_interval seconds and at exit.
+    """
+    global enabled, sink, interval
+    enabled  = True
+    interval = flush_interval
+    sink     = None if not path else (JsonlSink if path.endswith('.jsonl') else PrometheusSink)(path)
+    REGISTRY.keep_events = bool(sink and sink.events)
+    start_flusher()
+
+def enable(flag=True):
+    """
+    Turn the hooks on or off in this process without changing the sink (e.g. to read REGISTRY directly for a
+    single pass, as benchmarks/routing.py does). Returns the previous state.
+    """
+    global enabled
+    previous, enabled = enabled, flag
+    return previous
+
+def flush():
+    if enabled and sink is not None:
+        try:
+            sink.write(REGISTRY)
+        except OSError as error:
+            print(f"Instrumentation: cannot write {sink.path}: {error}", file=sys.stderr)
+
+def start_flusher():
+    global flusher
+    if sink is None or (flusher is not None and flusher.is_alive()):
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            flush()
+    flusher = threading.Thread(target=run, name='instrumentation-flush', daemon=True)
+    flusher.start()
+
+def after_fork():
+    # The child starts with empty metrics (the parent exports its own) and without the flusher thread.
+    global flusher
+    if enabled:
+        REGISTRY.reset()
+        flusher = None
+        start_flusher()
+
+def at_process_exit(function):
+    """
+    Run function when this process exits, and also in the multiprocessing children forked from it
+    (they leave through os._exit and skip atexit, but run the multiprocessing finalizers).
+    """
+    atexit.register(function)
+    multiprocessing.util.register_after_fork(function, lambda function: multiprocessing.util.Finalize(None, function, exitpriority=10))
+
+os.register_at_fork(after_in_child=after_fork)
+at_process_exit(flush)
+
+#-----------------------------+
+#       HOOKS                 |
+#-----------------------------+
+class Stage():
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name: str, labels: tuple):
+        self.name   = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        REGISTRY.observe(self.name, self.labels, time.perf_counter() - self.start)
+        return False
+
+def stage(name: str, **labels):
+    """
+    Context manager that times a stage (a no-op unless the instrumentation is enabled).
+    """
+    if not enabled:
+        return NOOP
+    return Stage(name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+def count(name: str, value=1, **labels):
+    if enabled:
+        REGISTRY.add(name, tuple(sorted((key, str(value)) for key, value in labels.items())), value)
+
+class CountingHeapq():
+    """
+    Stand-in for the heapq module of the search modules that counts the pushes, pops and settled items of a search.
+    The searches use lazy deletion, so an item (the last element of every queue entry: a node, or a label for the
+    battery search) is settled the first time it is popped from a queue. Only the calls of the thread that owns
+    the counter are counted; other threads go straight to heapq.
+    """
+    def __init__(self):
+        self.owner   = threading.get_ident()
+        self.pushes  = 0
+        self.pops    = 0
+        self.settled = set()
+
+    def __getattr__(self, name):
+        return getattr(heapq, name)
+
+    def heappush(self, queue, item):
+        if threading.get_ident() == self.owner:
+            self.pushes += 1
+        heapq.heappush(queue, item)
+
+    def heapify(self, queue):
+        if threading.get_ident() == self.owner:
+            self.pushes += len(queue)
+        heapq.heapify(queue)
+
+    def heappop(self, queue):
+        item = heapq.heappop(queue)
+        if threading.get_ident() == self.owner:
+            self.pops += 1
+            self.settled.add((id(queue), item[-1]))
+        return item
+
+# Swapping the global heapq of the search modules is not thread-safe: only one search at a time (per process)
+# installs its counter. Searches that start meanwhile, in other threads (route_server, RoutePool) or nested in
+# the same thread, are timed but not counted (search_unsampled).
+SWAP_LOCK = threading.Lock()
+
+class SearchStats():
+    """
+    Swaps a CountingHeapq into the given modules for the duration of one search and records its statistics.
+    `unit` names what the queue settles: 'nodes' (search_settled) or 'labels' (search_settled_labels).
+    """
+    def __init__(self, engine: str, modules, unit='nodes'):
+        self.engine  = engine
+        self.modules = modules
+        self.unit    = unit
+        self.counter = None
+
+    def __enter__(self):
+        if SWAP_LOCK.acquire(blocking=False):
+            self.counter = CountingHeapq()
+            for module in self.modules:
+                module.heapq = self.counter
+        self.start = time.perf_counter()
+        return self.counter
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        labels = (('engine', self.engine),)
+        REGISTRY.observe('search_query', labels, seconds)
+        REGISTRY.add('search_queries', labels)
+        if self.counter is None:
+            REGISTRY.add('search_unsampled', labels)
+            return False
+        try:
+            for module in self.modules:
+                module.heapq = heapq
+        finally:
+            SWAP_LOCK.release()
+        settled_name = 'settled' if self.unit == 'nodes' else f'settled_{self.unit}'
+        settled = len(self.counter.settled)
+        REGISTRY.add('search_heap_pushes', labels, self.counter.pushes)
+        REGISTRY.add('search_heap_pops', labels, self.counter.pops)
+        REGISTRY.add(f'search_{settled_name}', labels, settled)
+        REGISTRY.event({'time': time.time(), 'pid': os.getpid(), 'engine': self.engine, 'seconds': seconds,
+                        'pushes': self.counter.pushes, 'pops': self.counter.pops, settled_name: settled})
+        return False
+
+def search_stats(engine: str, *modules, unit='nodes'):
+    """
+    Context manager around one search (not a cache lookup) that counts its heap operations in the given modules,
+    the ones whose global heapq the search uses (a no-op unless the instrumentation is enabled). See SWAP_LOCK
+    for searches running at the same time.
+    """
+    if not enabled:
+        return NOOP
+    return SearchStats(engine, modules, unit)
+
+#-----------------------------+
+#       PROFILING             |
+#-----------------------------+
+class Sampler():
+    """
+    Sampling profiler: a daemon thread records the stack of every other thread of the process every interval
+    seconds, as folded stacks ("root;caller;callee" -> samples).
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks   = Counter()
+        self.stopping = threading.Event()
+        self.thread   = threading.Thread(target=self.run, name='instrumentation-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self.stopping.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    # Without the frames of the profile() wrapper around the entry point.
+                    if code.co_filename not in WRAPPER_FILES:
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(f"thread {names.get(ident, ident)}")
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, prefix: str):
+        with open(f'{prefix}.folded', 'w') as f:
+            f.write(''.join(f'{stack} {samples}\n' for stack, samples in self.stacks.most_common()))
+        flame_graph(self.stacks, f'{prefix}.svg', os.path.basename(prefix))
+
+def flame_graph(stacks: Counter, path: str, title: str):
+    """
+    Write a flame graph of folded stacks as SVG (callers at the bottom, frames ordered by name, width = samples).
+    """
+    root = {'samples': 0, 'children': {}}
+    for stack, samples in stacks.items():
+        node = root
+        node['samples'] += samples
+        for frame in stack.split(';'):
+            node = node['children'].setdefault(frame, {'samples': 0, 'children': {}})
+            node['samples'] += samples
+    total = max(1, root['samples'])
+
+    def depth(node):
+        return 1 + max((depth(child) for child in node['children'].values()), default=0)
+    height = (depth(root) + 1) * FLAME_ROW
+    rects = []
+
+    def draw(node, name, x, level):
+        width = node['samples'] / total * FLAME_WIDTH
+        if width < 0.5:
+            return
+        y = height - (level + 1) * FLAME_ROW
+        hue = zlib.crc32(name.encode()) % 60
+        label = name if len(name) * 7 < width else name[:max(0, int(width / 7) - 2)] + '..' if width > 28 else ''
+        text = name.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        label = label.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+        rects.append(f'<g><title>{text} ({node["samples"]} samples, {node["samples"] / total:.1%})</title>'
+                     f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{FLAME_ROW - 1}" fill="hsl({hue},90%,60%)"/>'
+                     f'<text x="{x + 3:.1f}" y="{y + FLAME_ROW - 4}">{label}</text></g>')
+        for child_name in sorted(node['children']):
+            child = node['children'][child_name]
+            draw(child, child_name, x, level + 1)
+            x += child['samples'] / total * FLAME_WIDTH
+
+    draw(root, f'{title} (all samples)', 0.0, 0)
+    with open(path, 'w') as f:
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAME_WIDTH}" height="{height}" font-family="monospace" '
+                f'font-size="11">\n' + '\n'.join(rects) + '\n</svg>\n')
+
+def profile(command, mode='sample', output='profile', interval=SAMPLE_INTERVAL):
+    """
+    Run a script (or "-m module") with its arguments as __main__ under the profiler. 'cprofile' writes
+    output.prof (pstats) and prints the top functions; 'sample' writes output.folded and output.svg, and
+    output.<pid>.folded/.svg for every forked child.
+    """
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    sys.argv = list(command)
+    if command[0] == '-m':
+        sys.argv = command[1:]
+        run = lambda: runpy.run_module(command[1], run_name='__main__', alter_sys=True)
+    else:
+        sys.path[0] = os.path.dirname(os.path.abspath(command[0]))
+        run = lambda: runpy.run_path(command[0], run_name='__main__')
+
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            run()
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f'{output}.prof')
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(25)
+        return
+
+    samplers = {'current': Sampler(interval).start()}
+    main_pid = os.getpid()
+
+    def restart():
+        samplers['current'] = Sampler(interval).start()
+
+    def write():
+        sampler = samplers['current']
+        sampler.stopping.set()
+        sampler.write(output if os.getpid() == main_pid else f'{output}.{os.getpid()}')
+    os.register_at_fork(after_in_child=restart)
+    at_process_exit(write)
+    run()
+
+# Run as a script (profile), the entry point imports the module again; that copy is the one to configure.
+if os.getenv('ROUTE_METRICS') and __name__ != '__main__':
+    configure(os.getenv('ROUTE_METRICS'), float(os.getenv('ROUTE_METRICS_INTERVAL', FLUSH_INTERVAL)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Profile any entry point of the project.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    profiler = subparsers.add_parser('profile', help='run a script (or -m module) under a profiler')
+    profiler.add_argument('--mode', choices=('sample', 'cprofile'), default='sample')
+    profiler.add_argument('--output', default='profile', help='prefix of the output files')
+    profiler.add_argument('--interval', type=float, default=SAMPLE_INTERVAL, help='seconds between samples')
+    profiler.add_argument('target', nargs=argparse.REMAINDER, help='script.py [args...] or -m module [args...]')
+    args = parser.parse_args()
+    if not args.target:
+        parser.error('profile needs a script to run')
+    profile(args.target, args.mode, args.output, args.interval)
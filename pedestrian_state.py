@@ -0,0 +1,202 @@
+import threading
+from collections import Counter
+
+def coordenades(node):
+    """
+    Retorna la tupla (longitud, latitud) d'un node de ruta o d'un document de carrer.
+
+    PRE: node és un diccionari amb les claus longitud/latitud (o longitude/latitude),
+         directament o dins de 'coordenades'.
+    POST: retorna la tupla (longitud, latitud).
+    """
+    node = node.get('coordenades', node)
+    return (node.get('longitud', node.get('longitude')), node.get('latitud', node.get('latitude')))
+
+class RouteIndex():
+    """
+    Índex d'una ruta: posició de cada node, per trobar la posició actual en O(1) en lloc de ruta.index.
+
+    Com que la ruta és una llista que es pot modificar al lloc, l'índex recorda la llargada i els extrems
+    (current) i cada posició trobada es comprova contra el node de la ruta (find).
+    """
+    def __init__(self, ruta, precision=7):
+        self.ruta = ruta
+        self.precision = precision
+        self.posicions = {}
+        for i, node in enumerate(ruta):
+            self.posicions.setdefault(self.clau(node), i)
+        self.longitud = len(ruta)
+        self.extrems = self.endpoints(ruta)
+
+    def clau(self, node):
+        lon, lat = coordenades(node)
+        return (round(lon, self.precision), round(lat, self.precision))
+
+    def endpoints(self, ruta):
+        return (self.clau(ruta[0]), self.clau(ruta[-1])) if ruta else None
+
+    def current(self, ruta):
+        """
+        PRE: ruta és una llista de nodes.
+        POST: retorna True si l'índex és d'aquesta mateixa llista i no n'han canviat la llargada ni els extrems.
+        """
+        return ruta is self.ruta and len(ruta) == self.longitud and self.endpoints(ruta) == self.extrems
+
+    def find(self, posicio_actual):
+        """
+        PRE: posicio_actual és un node.
+        POST: retorna la posició del node a la ruta, o None si no hi és o la ruta ha canviat en aquella posició.
+        """
+        clau = self.clau(posicio_actual)
+        i = self.posicions.get(clau)
+        if i is None or i >= len(self.ruta) or self.clau(self.ruta[i]) != clau:
+            return None
+        return i
+
+    def index(self, posicio_actual):
+        """
+        PRE: posicio_actual és un node de la ruta.
+        POST: retorna la posició del node a la ruta; llança ValueError si no hi és.
+        """
+        i = self.find(posicio_actual)
+        if i is None:
+            raise ValueError("La posició actual no es troba a la ruta.")
+        return i
+
+class PedestrianState():
+    """
+    Estat en memòria dels carrers amb presència de vianants, mantingut de manera incremental.
+
+    Es carrega una foto inicial de la col·lecció i després s'aplica el canal de canvis de MongoDB (change streams)
+    o, si el servidor no en té (p. ex. sense replica set o amb mongomock), una diferència periòdica per sondeig.
+    Les claus són les coordenades quantitzades del node (comptades per document, ja que dos carrers poden
+    compartir node), de manera que consultar un node és O(1).
+    """
+    def __init__(self, collection, precision=7, poll_interval=1.0):
+        self.collection = collection
+        self.precision = precision
+        self.poll_interval = poll_interval
+        self.vianants = Counter()
+        self.documents = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.mode = None
+        self.rutes = {}
+        self.refresh()
+
+    def clau(self, node):
+        lon, lat = coordenades(node)
+        return (round(lon, self.precision), round(lat, self.precision))
+
+    def refresh(self):
+        """
+        Sincronitza l'estat amb la col·lecció (una sola consulta) i en calcula la diferència.
+
+        PRE: cert.
+        POST: retorna (afegits, eliminats): el nombre de nodes que han guanyat o perdut vianants.
+        """
+        documents = {document['_id']: self.clau(document)
+                     for document in self.collection.find({"vianants": True}, {"coordenades": 1})}
+        nous = Counter(documents.values())
+        with self.lock:
+            afegits, eliminats = nous.keys() - self.vianants.keys(), self.vianants.keys() - nous.keys()
+            self.vianants = nous
+            self.documents = documents
+        return len(afegits), len(eliminats)
+
+    def apply_change(self, canvi):
+        """
+        Aplica un esdeveniment del canal de canvis (insert, update, replace o delete).
+
+        PRE: canvi és un document de change stream amb fullDocument (updateLookup) quan escau.
+        POST: l'estat reflecteix el canvi.
+        """
+        _id = canvi['documentKey']['_id']
+        document = canvi.get('fullDocument')
+        with self.lock:
+            anterior = self.documents.pop(_id, None)
+            if anterior is not None:
+                self.vianants[anterior] -= 1
+                if self.vianants[anterior] <= 0:
+                    del self.vianants[anterior]
+            if canvi['operationType'] != 'delete' and document and document.get('vianants'):
+                clau = self.clau(document)
+                self.documents[_id] = clau
+                self.vianants[clau] += 1
+
+    def watch(self):
+        """
+        Segueix el canal de canvis de la col·lecció; si no està disponible, sondeja cada poll_interval segons.
+        """
+        try:
+            with self.collection.watch(full_document='updateLookup') as stream:
+                self.mode = 'change_stream'
+                self.refresh()
+                while not self.stopping.is_set():
+                    canvi = stream.try_next()
+                    if canvi is None:
+                        self.stopping.wait(0.05)
+                    else:
+                        self.apply_change(canvi)
+        except Exception:
+            if self.mode == 'change_stream' and self.stopping.is_set():
+                return
+            self.mode = 'polling'
+            while not self.stopping.wait(self.poll_interval):
+                self.refresh()
+
+    def start(self):
+        """
+        Arrenca el fil que manté l'estat al dia.
+        """
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def has_pedestrians(self, node):
+        """
+        PRE: node és un node de ruta o un document de carrer.
+        POST: retorna True si el node té presència de vianants.
+        """
+        return self.clau(node) in self.vianants
+
+    def route_index(self, ruta, rebuild=False):
+        """
+        Retorna (i desa) l'índex d'una ruta, reutilitzant-lo mentre es consulta la mateixa ruta sense canvis.
+
+        Les llistes no admeten weakref, així que la clau és id(ruta); l'índex desat manté viva la llista,
+        de manera que el seu id no es pot reutilitzar mentre l'índex és a la memòria cau.
+        """
+        index = self.rutes.get(id(ruta))
+        if rebuild or index is None or not index.current(ruta):
+            if len(self.rutes) > 64:
+                self.rutes.clear()
+            index = self.rutes[id(ruta)] = RouteIndex(ruta, self.precision)
+        return index
+
+    def position(self, ruta, posicio_actual):
+        """
+        PRE: ruta és una llista de nodes; posicio_actual és un node de la ruta.
+        POST: retorna la posició del node a la ruta (reconstruint l'índex si la ruta ha canviat al lloc);
+            llança ValueError si no hi és.
+        """
+        i = self.route_index(ruta).find(posicio_actual)
+        if i is None:
+            i = self.route_index(ruta, rebuild=True).index(posicio_actual)
+        return i
+
+    def lookahead(self, ruta, posicio_actual, k=1):
+        """
+        Comprova la presència de vianants als k nodes següents de la ruta, en O(k).
+
+        PRE: ruta és una llista de nodes; posicio_actual és un node de la ruta; k >= 1.
+        POST: retorna una llista de k booleans com a màxim (un per node següent, en ordre).
+        """
+        inici = self.position(ruta, posicio_actual) + 1
+        return [self.has_pedestrians(node) for node in ruta[inici:inici + k]]
@@ -0,0 +1,166 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import ijson
+import numpy as np
+from ingesta_osm import RAIZ, EscritorJSON, iterar_elementos
+from modelo_costes import costes, segmentos
+
+# Actualización incremental del grafo a partir de dos exports de Overpass (el anterior y el nuevo). Se comparan
+# los nodos y las vías por ID y versión (o por contenido si el export no trae metadatos), se calculan solo las
+# aristas afectadas y se escribe un delta que:
+#   1. se aplica a inputs/connection_nodes.json e inputs/info_nodes.json (leídos y reescritos en streaming), y
+#   2. se deja en inputs/graph_deltas/ para que los Route en marcha lo apliquen en caliente (Route.reload_delta).
+#
+#   python pre/actualizar_grafo.py Vilanova3_anterior.json Vilanova3.json --compilar
+
+FORMATO_DELTA = 1
+
+def firma_via(element):
+    if 'version' in element:
+        return element['version']
+    contenido = json.dumps([element['nodes'], element.get('tags', {})], sort_keys=True)
+    return hashlib.sha1(contenido.encode()).hexdigest()
+
+def indexar(archivo):
+    """
+    Devuelve (coordenadas de los nodos, firma de las vías, nodos usados por las vías) de un export.
+    """
+    nodos, vias, usados = {}, {}, set()
+    for element in iterar_elementos(archivo):
+        if element['type'] == 'node':
+            nodos[element['id']] = (element['lon'], element['lat'])
+        elif element['type'] == 'way':
+            vias[element['id']] = firma_via(element)
+            usados.update(element['nodes'])
+    return nodos, vias, usados
+
+def pares(elements):
+    nodo1, nodo2, _ = segmentos(elements)
+    return set(zip(nodo1.tolist(), nodo2.tolist()))
+
+def toca(nodes, afectados):
+    return any((n1, n2) in afectados or (n2, n1) in afectados for n1, n2 in zip(nodes, nodes[1:]))
+
+def calcular_delta(archivo_anterior, archivo_nuevo):
+    """
+    Compara dos exports y devuelve el delta del grafo (diccionario serializable en JSON).
+
+    Las aristas afectadas son los pares (origen, destino) de las vías nuevas, modificadas o eliminadas y los que
+    tocan un nodo que se ha movido. El delta elimina todas las aristas de esos pares y añade las que tienen en
+    el export nuevo, de manera que aplicarlo es idempotente.
+    """
+    nodos_anteriores, vias_anteriores, usados_anteriores = indexar(archivo_anterior)
+    nodos, vias, usados = indexar(archivo_nuevo)
+
+    vias_cambiadas = {via for via in vias_anteriores.keys() | vias.keys() if vias_anteriores.get(via) != vias.get(via)}
+    movidos = {nodo for nodo in nodos_anteriores.keys() & nodos.keys() if nodos_anteriores[nodo] != nodos[nodo]}
+
+    afectados = pares(element for element in iterar_elementos(archivo_anterior, 'way') if element['id'] in vias_cambiadas)
+    for element in iterar_elementos(archivo_nuevo, 'way'):
+        if element['id'] in vias_cambiadas:
+            afectados |= pares([element])
+        elif movidos.intersection(element['nodes']):
+            afectados |= {par for par in pares([element]) if par[0] in movidos or par[1] in movidos}
+
+    nodo1, nodo2, velocidad = segmentos(element for element in iterar_elementos(archivo_nuevo, 'way')
+                                        if toca(element['nodes'], afectados))
+    seleccion = np.array([(n1, n2) in afectados and n1 in nodos and n2 in nodos
+                          for n1, n2 in zip(nodo1.tolist(), nodo2.tolist())], dtype=bool).reshape(-1)
+    nodo1, nodo2, velocidad = nodo1[seleccion], nodo2[seleccion], velocidad[seleccion]
+    origen = np.array([nodos[n] for n in nodo1.tolist()], dtype=np.float64).reshape(-1, 2)
+    destino = np.array([nodos[n] for n in nodo2.tolist()], dtype=np.float64).reshape(-1, 2)
+    distancia, tiempo = costes(origen, destino, velocidad)
+
+    nodos_actualizados = (usados - usados_anteriores) | (movidos & usados)
+    delta = {
+        "format": FORMATO_DELTA,
+        "created": time.time(),
+        "edges_removed": sorted([n1, n2] for n1, n2 in afectados),
+        "edges_added": [{"node1": n1, "node2": n2, "distance": d, "time": t}
+                        for n1, n2, d, t in zip(nodo1.tolist(), nodo2.tolist(), distancia.tolist(), tiempo.tolist())],
+        "nodes_removed": sorted(usados_anteriores - usados),
+        "nodes_upserted": [{"node_id": nodo, "coordinates": {"longitude": nodos[nodo][0], "latitude": nodos[nodo][1]}}
+                           for nodo in sorted(nodos_actualizados) if nodo in nodos],
+    }
+    delta["id"] = hashlib.sha1(json.dumps(delta, sort_keys=True).encode()).hexdigest()[:12]
+    return delta
+
+def reescribir(archivo, transformar):
+    """
+    Reescribe una lista JSON elemento a elemento: transformar(elementos) devuelve los elementos a escribir.
+    """
+    temporal = f"{archivo}.tmp-{os.getpid()}"
+    escritor = EscritorJSON(temporal)
+    with open(archivo, 'rb') as file:
+        escritor.escribir(transformar(ijson.items(file, 'item', use_float=True)))
+    escritor.cerrar()
+    os.replace(temporal, archivo)
+    return escritor.total
+
+def aplicar_delta(delta, directorio):
+    """
+    Aplica el delta a connection_nodes.json e info_nodes.json del directorio.
+    """
+    eliminadas = {tuple(par) for par in delta['edges_removed']}
+
+    def conexiones(elementos):
+        for conexion in elementos:
+            if (conexion['node1'], conexion['node2']) not in eliminadas:
+                yield conexion
+        yield from delta['edges_added']
+
+    eliminados = set(delta['nodes_removed'])
+    actualizados = {nodo['node_id']: nodo['coordinates'] for nodo in delta['nodes_upserted']}
+
+    def info_nodos(elementos):
+        for nodo in elementos:
+            if nodo['node_id'] in eliminados:
+                continue
+            if nodo['node_id'] in actualizados:
+                nodo['coordinates'] = actualizados.pop(nodo['node_id'])
+            yield nodo
+        for nodo_id, coordenadas in actualizados.items():
+            yield {"node_id": nodo_id, "coordinates": coordenadas, "address": None, "status": "disponible"}
+
+    aristas = reescribir(os.path.join(directorio, 'connection_nodes.json'), conexiones)
+    nodos = reescribir(os.path.join(directorio, 'info_nodes.json'), info_nodos)
+    return nodos, aristas
+
+def guardar_delta(delta, directorio):
+    """
+    Deja el delta en graph_deltas/ para los Route en marcha. Se escribe después de parchear los JSON.
+    """
+    carpeta = os.path.join(directorio, 'graph_deltas')
+    os.makedirs(carpeta, exist_ok=True)
+    numero = len([nombre for nombre in os.listdir(carpeta) if nombre.endswith('.json')])
+    destino = os.path.join(carpeta, f"{numero:06d}-{delta['id']}.json")
+    temporal = f"{destino}.tmp-{os.getpid()}"
+    with open(temporal, 'w', encoding='utf-8') as file:
+        json.dump(delta, file)
+    os.replace(temporal, destino)
+    return destino
+
+def main():
+    parser = argparse.ArgumentParser(description='Actualiza el grafo a partir de la diferencia entre dos exports de Overpass.')
+    parser.add_argument('anterior')
+    parser.add_argument('nuevo')
+    parser.add_argument('--salida', default=os.path.join(RAIZ, 'inputs'), help='directorio de connection_nodes.json e info_nodes.json')
+    parser.add_argument('--compilar', action='store_true', help='recompilar también la caché binaria del grafo')
+    args = parser.parse_args()
+
+    delta = calcular_delta(args.anterior, args.nuevo)
+    print(f"Delta {delta['id']}: {len(delta['edges_removed'])} pares de aristas afectados, {len(delta['edges_added'])} aristas nuevas, "
+          f"{len(delta['nodes_removed'])} nodos eliminados, {len(delta['nodes_upserted'])} nodos nuevos o movidos")
+    if not (delta['edges_removed'] or delta['nodes_removed'] or delta['nodes_upserted']):
+        return
+    nodos, aristas = aplicar_delta(delta, args.salida)
+    print(f"{nodos} nodos y {aristas} conexiones en {args.salida}; delta guardado en {guardar_delta(delta, args.salida)}")
+    if args.compilar:
+        from ingesta_osm import compilar
+        compilar(args.salida)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Caché persistente (SQLite) de las respuestas de Mapbox y limitador de tasa para los scripts de preprocesado.
+# Las claves son coordenadas redondeadas, de manera que al relanzar un trabajo interrumpido o al procesar una
+# actualización de OSM solo se piden a la API los puntos y segmentos nuevos.
+
+DECIMALES = 6  # ~0.1 m
+
+def clave_punto(lon, lat):
+    return f"{round(float(lon), DECIMALES)},{round(float(lat), DECIMALES)}"
+
+def clave_segmento(lon1, lat1, lon2, lat2):
+    return f"{clave_punto(lon1, lat1)};{clave_punto(lon2, lat2)}"
+
+class CachePersistente():
+    """
+    Diccionario clave -> valor JSON guardado en SQLite, compartido por los hilos de un proceso.
+
+    Las escrituras se confirman cada `lote` valores (y al cerrar), así que una interrupción pierde como mucho
+    el último lote. El estado de los trabajos (total y hechos) se guarda en la misma base de datos.
+    """
+    def __init__(self, archivo, tabla, lote=100):
+        self.tabla = tabla
+        self.lote = lote
+        self.pendientes = 0
+        self.lock = threading.Lock()
+        self.conexion = sqlite3.connect(archivo, timeout=30, check_same_thread=False)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute(f"CREATE TABLE IF NOT EXISTS {tabla} (clave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+        self.conexion.execute("CREATE TABLE IF NOT EXISTS trabajos (nombre TEXT PRIMARY KEY, total INTEGER, hechos INTEGER, actualizado REAL)")
+        self.conexion.commit()
+
+    def __contains__(self, clave):
+        return self.get(clave) is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.conexion.execute(f"SELECT COUNT(*) FROM {self.tabla}").fetchone()[0]
+
+    def get(self, clave):
+        with self.lock:
+            fila = self.conexion.execute(f"SELECT valor FROM {self.tabla} WHERE clave = ?", (clave,)).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def put(self, clave, valor):
+        with self.lock:
+            self.conexion.execute(f"INSERT OR REPLACE INTO {self.tabla} (clave, valor) VALUES (?, ?)", (clave, json.dumps(valor)))
+            self.pendientes += 1
+            if self.pendientes >= self.lote:
+                self.conexion.commit()
+                self.pendientes = 0
+
+    def guardar_progreso(self, nombre, total, hechos):
+        with self.lock:
+            self.conexion.execute("INSERT OR REPLACE INTO trabajos (nombre, total, hechos, actualizado) VALUES (?, ?, ?, ?)",
+                                  (nombre, total, hechos, time.time()))
+            self.conexion.commit()
+            self.pendientes = 0
+
+    def progreso(self, nombre):
+        """
+        Devuelve (total, hechos) del último punto de control del trabajo, o None si no se ha empezado.
+        """
+        with self.lock:
+            fila = self.conexion.execute("SELECT total, hechos FROM trabajos WHERE nombre = ?", (nombre,)).fetchone()
+        return tuple(fila) if fila else None
+
+    def cerrar(self):
+        with self.lock:
+            self.conexion.commit()
+            self.conexion.close()
+
+class LimitadorTasa():
+    """
+    Cubo de fichas (token bucket): permite `tasa` peticiones por segundo con ráfagas de hasta `capacidad`.
+
+    Tras un 429, penalizar() vacía el cubo y bloquea a todos los hilos durante la espera indicada,
+    en lugar de que cada hilo duerma y reintente por su cuenta.
+    """
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad if capacidad is not None else max(1.0, tasa))
+        self.fichas = self.capacidad
+        self.ultimo = time.monotonic()
+        self.bloqueado_hasta = 0.0
+        self.lock = threading.Lock()
+
+    def adquirir(self):
+        while True:
+            with self.lock:
+                ahora = time.monotonic()
+                if ahora >= self.bloqueado_hasta:
+                    self.fichas = min(self.capacidad, self.fichas + (ahora - max(self.ultimo, self.bloqueado_hasta)) * self.tasa)
+                    self.ultimo = ahora
+                    if self.fichas >= 1:
+                        self.fichas -= 1
+                        return
+                    espera = (1 - self.fichas) / self.tasa
+                else:
+                    espera = self.bloqueado_hasta - ahora
+            time.sleep(espera)
+
+    def penalizar(self, segundos):
+        with self.lock:
+            self.fichas = 0.0
+            self.bloqueado_hasta = max(self.bloqueado_hasta, time.monotonic() + segundos)
+
+def espera_reintento(response, defecto):
+    """
+    Segundos a esperar tras un 429: la cabecera Retry-After o x-rate-limit-reset de Mapbox si están, o `defecto`.
+    """
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        return max(0.0, float(response.headers['x-rate-limit-reset']) - time.time())
+    except (KeyError, ValueError):
+        return defecto
@@ -1,4 +1,6 @@
+import argparse
 import json
+import numpy as np
 import requests
 import time
 import os
@@ -6,6 +8,8 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from dotenv import load_dotenv
+from cache_persistente import CachePersistente, LimitadorTasa, clave_punto, espera_reintento
+from modelo_costes import costes, factor_calibracion, segmentos
 
 num = 1
 len_elements = 0
@@ -20,30 +24,43 @@ def cargar_datos(archivo):
         print("Error al decodificar el archivo JSON.")
     return None
 
-def obtener_distancia_tiempo(coordenadas_origen, coordenadas_destino, access_token, session):
+def obtener_distancia_tiempo(coordenadas_origen, coordenadas_destino, access_token, session, cache=None, limitador=None):
     global num
     global len_elements
+    clave = f"{coordenadas_origen};{coordenadas_destino}"
+    if cache is not None:
+        guardado = cache.get(clave)
+        if guardado is not None:
+            return tuple(guardado)
     url = f"https://api.mapbox.com/directions/v5/mapbox/driving/{coordenadas_origen};{coordenadas_destino}?access_token={access_token}"
-    response = session.get(url)
+    while True:
+        if limitador is not None:
+            limitador.adquirir()
+        response = session.get(url)
+        if response.status_code != 429:
+            break
+        if limitador is not None:
+            limitador.penalizar(espera_reintento(response, 10))
+        else:
+            time.sleep(espera_reintento(response, 10))
     if response.status_code == 200:
         data = response.json()
         distancia = data['routes'][0]['distance']
         tiempo = data['routes'][0]['duration']
+        if cache is not None:
+            cache.put(clave, [distancia, tiempo])
         num = num + 1
         print('Processed the element %d of %d' % (num, len_elements), end='\r')
         return distancia, tiempo
-    elif response.status_code == 429:
-        time.sleep(10)  # Pausa durante 10 segundos
-        return obtener_distancia_tiempo(coordenadas_origen, coordenadas_destino, access_token, session)  # Reintentar la solicitud
     else:
         print("Error al obtener la distancia y tiempo:", response.text)
         return None, None
 
-def procesar_conexion(nodo1, nodo2, nodos_coordenadas, access_token, session):
+def procesar_conexion(nodo1, nodo2, nodos_coordenadas, access_token, session, cache=None, limitador=None):
     if nodo1 in nodos_coordenadas and nodo2 in nodos_coordenadas:
         lon1, lat1 = nodos_coordenadas[nodo1]
         lon2, lat2 = nodos_coordenadas[nodo2]
-        distancia, tiempo = obtener_distancia_tiempo(f"{lon1},{lat1}", f"{lon2},{lat2}", access_token, session)
+        distancia, tiempo = obtener_distancia_tiempo(clave_punto(lon1, lat1), clave_punto(lon2, lat2), access_token, session, cache, limitador)
         if distancia is not None and tiempo is not None:
             return {"node1": nodo1, "node2": nodo2, "distance": distancia, "time": tiempo}
     return None
@@ -52,54 +69,79 @@ def guardar_conexiones(conexiones, archivo_salida):
     with open(archivo_salida, 'w', encoding='utf-8') as file:
         json.dump(conexiones, file, indent=2)
 
-def main():
+def calibrar(nodo1, nodo2, tiempo, nodos_coordenadas, muestra, access_token, session, cache=None, limitador=None):
+    """
+    Compara el tiempo del modelo offline con Mapbox Directions en una muestra de aristas y devuelve el factor
+    (mediana de tiempo Mapbox / tiempo del modelo) por el que multiplicar los tiempos del modelo.
+
+    La muestra es siempre la misma (semilla fija), así que al relanzar una calibración interrumpida las aristas
+    ya consultadas salen de la caché.
+    """
     global len_elements
+    indices = np.random.default_rng(0).choice(len(nodo1), size=min(muestra, len(nodo1)), replace=False)
+    len_elements = len(indices)
+    referencia = np.full(len(indices), np.nan)
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        futures = {executor.submit(procesar_conexion, int(nodo1[i]), int(nodo2[i]), nodos_coordenadas, access_token, session, cache, limitador): k
+                   for k, i in enumerate(indices)}
+        for hechos, future in enumerate(as_completed(futures), 1):
+            conexion = future.result()
+            if conexion:
+                referencia[futures[future]] = conexion['time']
+            if cache is not None and hechos % 100 == 0:
+                cache.guardar_progreso('calibracion', len(indices), hechos)
+    if cache is not None:
+        cache.guardar_progreso('calibracion', len(indices), len(indices))
+    medidas = ~np.isnan(referencia)
+    return factor_calibracion(tiempo[indices][medidas], referencia[medidas])
+
+def main():
     load_dotenv()
-    archivo_json = 'Vilanova3.json'
-    archivo_salida = 'conexion_nodos.json'
-    access_token = os.getenv('MAPBOX_ACCESS_TOKEN')
+    parser = argparse.ArgumentParser(description='Genera las conexiones entre nodos con el modelo de costes offline.')
+    parser.add_argument('archivo', nargs='?', default='Vilanova3.json')
+    parser.add_argument('--salida', default='conexion_nodos.json')
+    parser.add_argument('--calibrar', type=int, default=0, metavar='N', help='calibrar los tiempos con Mapbox en N aristas')
+    parser.add_argument('--cache', default='cache_mapbox.sqlite', help='caché persistente de las respuestas de Mapbox')
+    parser.add_argument('--tasa', type=float, default=5.0, help='peticiones por segundo a Mapbox Directions')
+    args = parser.parse_args()
 
-    data = cargar_datos(archivo_json)
+    data = cargar_datos(args.archivo)
     if not data:
         return
 
     nodos_coordenadas = {}
-    conexiones = []
-
     for element in data['elements']:
         if element['type'] == 'node':
-            nodo_id = element['id']
-            lat = element['lat']
-            lon = element['lon']
-            nodos_coordenadas[nodo_id] = (lon, lat)
+            nodos_coordenadas[element['id']] = (element['lon'], element['lat'])
 
-    session = requests.Session()
-    retry = Retry(connect=3, backoff_factor=0.5)
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('https://', adapter)
+    nodo1, nodo2, velocidad = segmentos(data['elements'])
+    validos = np.array([n1 in nodos_coordenadas and n2 in nodos_coordenadas for n1, n2 in zip(nodo1.tolist(), nodo2.tolist())], dtype=bool)
+    nodo1, nodo2, velocidad = nodo1[validos], nodo2[validos], velocidad[validos]
+    origen = np.array([nodos_coordenadas[n] for n in nodo1.tolist()], dtype=np.float64).reshape(-1, 2)
+    destino = np.array([nodos_coordenadas[n] for n in nodo2.tolist()], dtype=np.float64).reshape(-1, 2)
+    distancia, tiempo = costes(origen, destino, velocidad)
 
-    len_elements = len(data['elements'])
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = []
-        num = 1
-        for element in data['elements']:
-            if element['type'] == 'way':
-                nodes = element['nodes']
-                oneway = element['tags'].get('oneway', 'no')
-                for i in range(len(nodes) - 1):
-                    nodo1 = nodes[i]
-                    nodo2 = nodes[i+1]
-                    if oneway == 'yes':
-                        futures.append(executor.submit(procesar_conexion, nodo1, nodo2, nodos_coordenadas, access_token, session))
-                    else:
-                        futures.append(executor.submit(procesar_conexion, nodo1, nodo2, nodos_coordenadas, access_token, session))
-                        futures.append(executor.submit(procesar_conexion, nodo2, nodo1, nodos_coordenadas, access_token, session))
-        for future in as_completed(futures):
-            conexion = future.result()
-            if conexion:
-                conexiones.append(conexion)
+    if args.calibrar:
+        session = requests.Session()
+        retry = Retry(connect=3, backoff_factor=0.5)
+        adapter = HTTPAdapter(max_retries=retry)
+        session.mount('https://', adapter)
+        cache = CachePersistente(args.cache, 'direcciones')
+        progreso = cache.progreso('calibracion')
+        if progreso and progreso[1] < progreso[0]:
+            print(f'Reanudando la calibración: {progreso[1]} de {progreso[0]} aristas ya consultadas')
+        try:
+            factor = calibrar(nodo1, nodo2, tiempo, nodos_coordenadas, args.calibrar, os.getenv('MAPBOX_ACCESS_TOKEN'),
+                              session, cache, LimitadorTasa(args.tasa))
+        finally:
+            cache.cerrar()
+        print(f'\nFactor de calibración de los tiempos: {factor:.3f}')
+        tiempo = tiempo * factor
 
-    guardar_conexiones(conexiones, archivo_salida)
+    conexiones = [{"node1": n1, "node2": n2, "distance": d, "time": t}
+                  for n1, n2, d, t in zip(nodo1.tolist(), nodo2.tolist(), distancia.tolist(), tiempo.tolist())]
+    guardar_conexiones(conexiones, args.salida)
+    print(f'{len(conexiones)} conexiones guardadas en {args.salida}')
 
 if __name__ == "__main__":
     main()
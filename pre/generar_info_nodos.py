@@ -6,6 +6,7 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from cache_persistente import CachePersistente, LimitadorTasa, clave_punto, espera_reintento
 
 num = 1
 len_elements = 0
@@ -20,38 +21,46 @@ def cargar_datos(archivo):
         print("Error al decodificar el archivo JSON.")
     return None
 
-def obtener_direccion(lat, lon, access_token, session, cache):
+def obtener_direccion(lat, lon, access_token, session, cache, limitador=None):
     global num, len_elements
-    if (lat, lon) in cache:
-        return cache[(lat, lon)]
+    clave = clave_punto(lon, lat)
+    guardada = cache.get(clave)
+    if guardada is not None:
+        return guardada
     
     url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{lon},{lat}.json"
     params = {'access_token': access_token}
 
-    try:
-        response = session.get(url, params=params)
-        response.raise_for_status()
-        datos = response.json()
-        if datos['features']:
-            direccion = datos['features'][0]['place_name']
-            cache[(lat, lon)] = direccion
+    while True:
+        try:
+            if limitador is not None:
+                limitador.adquirir()
+            response = session.get(url, params=params)
+            response.raise_for_status()
+            datos = response.json()
+            if datos['features']:
+                direccion = datos['features'][0]['place_name']
+            else:
+                direccion = "No se encontró ninguna dirección para las coordenadas dadas."
+            cache.put(clave, direccion)
             num = num + 1
             print('Processed the element %d of %d' % (num, len_elements), end='\r')
             return direccion
-        else:
-            return "No se encontró ninguna dirección para las coordenadas dadas."
-    except requests.RequestException as e:
-        if isinstance(e, requests.HTTPError) and e.response.status_code == 429:
-            time.sleep(30)  # Pausa durante 5 segundos
-            return obtener_direccion(lat, lon, access_token, session, cache)  # Reintentar la solicitud
-        else:
-            return f"Error en la solicitud: {e}"
+        except requests.RequestException as e:
+            if isinstance(e, requests.HTTPError) and e.response.status_code == 429:
+                espera = espera_reintento(e.response, 30)
+                if limitador is not None:
+                    limitador.penalizar(espera)
+                else:
+                    time.sleep(espera)
+            else:
+                return f"Error en la solicitud: {e}"
             
-def procesar_nodo(element, access_token, session, cache):
+def procesar_nodo(element, access_token, session, cache, limitador=None):
     nodo_id = element['id']
     lat = element['lat']
     lon = element['lon']
-    direccion = obtener_direccion(lat, lon, access_token, session, cache)
+    direccion = obtener_direccion(lat, lon, access_token, session, cache, limitador)
     return {"node_id": nodo_id,
             "coordinates": {
                 "longitude": lon,
@@ -75,7 +84,8 @@ def main():
     if not data:
         return
 
-    cache = {}
+    cache = CachePersistente(os.getenv('MAPBOX_CACHE', 'cache_mapbox.sqlite'), 'geocodificacion')
+    limitador = LimitadorTasa(float(os.getenv('MAPBOX_GEOCODING_RATE', 10)))
 
     session = requests.Session()
     retry = Retry(connect=3, backoff_factor=0.5)
@@ -84,12 +94,22 @@ def main():
 
     info_nodos = []
 
-    len_elements = len(data['elements'])
+    nodos = [element for element in data['elements'] if element['type'] == 'node']
+    len_elements = len(nodos)
+    progreso = cache.progreso('info_nodos')
+    if progreso and progreso[1] < progreso[0]:
+        print(f'Reanudando: {progreso[1]} de {progreso[0]} nodos ya geocodificados')
 
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = [executor.submit(procesar_nodo, element, access_token, session, cache) for element in data['elements'] if element['type'] == 'node']
-        for future in as_completed(futures):
-            info_nodos.append(future.result())
+    try:
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            futures = [executor.submit(procesar_nodo, element, access_token, session, cache, limitador) for element in nodos]
+            for future in as_completed(futures):
+                info_nodos.append(future.result())
+                if len(info_nodos) % 100 == 0:
+                    cache.guardar_progreso('info_nodos', len_elements, len(info_nodos))
+        cache.guardar_progreso('info_nodos', len_elements, len(info_nodos))
+    finally:
+        cache.cerrar()
 
     guardar_info_nodos(info_nodos, archivo_salida)
 
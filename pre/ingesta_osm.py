@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import sys
+from array import array
+import numpy as np
+import ijson
+from modelo_costes import costes, segmentos
+
+# Ingesta en streaming de un export JSON de Overpass: en lugar de json.load de todo el fichero, los elementos se
+# leen uno a uno con ijson y se recorren en tres pasadas (nodos usados por las vías, sus coordenadas y los
+# segmentos). Solo se guardan en memoria los IDs y las coordenadas de los nodos de la red (arrays numpy) y las
+# aristas se escriben por bloques directamente en los ficheros que carga Route:
+#
+#   python pre/ingesta_osm.py pre/Vilanova3.json --compilar
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BLOQUE = 65536
+BLOQUE_VIAS = 8192    # vías por bloque de segmentos (unos diez segmentos por vía)
+
+def iterar_elementos(archivo, tipo=None):
+    with open(archivo, 'rb') as file:
+        for element in ijson.items(file, 'elements.item', use_float=True):
+            if tipo is None or element['type'] == tipo:
+                yield element
+
+def iterar_nodos(archivo):
+    for element in iterar_elementos(archivo, 'node'):
+        yield element['id'], element['lon'], element['lat']
+
+def iterar_bloques(generador, tamano=BLOQUE):
+    bloque = []
+    for elemento in generador:
+        bloque.append(elemento)
+        if len(bloque) == tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+class TablaCoordenadas():
+    """
+    Coordenadas de los nodos usados por las vías: IDs ordenados (int64) y (longitud, latitud) en float64.
+    """
+    def __init__(self, ids, coordenadas):
+        self.ids = ids
+        self.coordenadas = coordenadas
+
+    @classmethod
+    def desde_archivo(cls, archivo):
+        usados = array('q')
+        for element in iterar_elementos(archivo, 'way'):
+            usados.extend(element['nodes'])
+        usados = np.unique(np.frombuffer(usados, dtype=np.int64))
+        ids, coordenadas = array('q'), array('d')
+        for bloque in iterar_bloques(iterar_nodos(archivo)):
+            bloque_ids = np.array([nodo[0] for nodo in bloque], dtype=np.int64)
+            bloque_coordenadas = np.array([nodo[1:] for nodo in bloque], dtype=np.float64)
+            posicion = np.minimum(np.searchsorted(usados, bloque_ids), len(usados) - 1)
+            validos = usados[posicion] == bloque_ids
+            ids.extend(bloque_ids[validos].tolist())
+            coordenadas.extend(bloque_coordenadas[validos].ravel().tolist())
+        ids = np.frombuffer(ids, dtype=np.int64)
+        coordenadas = np.frombuffer(coordenadas, dtype=np.float64).reshape(-1, 2)
+        ids, unicos = np.unique(ids, return_index=True)
+        return cls(ids, coordenadas[unicos])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def buscar(self, nodos):
+        """
+        Devuelve (coordenadas, encontrados) para un array de IDs de nodo.
+        """
+        if not len(self.ids):
+            return np.zeros((len(nodos), 2)), np.zeros(len(nodos), dtype=bool)
+        posicion = np.minimum(np.searchsorted(self.ids, nodos), len(self.ids) - 1)
+        encontrados = self.ids[posicion] == nodos
+        return self.coordenadas[posicion], encontrados
+
+def iterar_conexiones(archivo, tabla):
+    """
+    Genera bloques de aristas (node1, node2, distancia en m, tiempo en s) con las coordenadas de la tabla.
+    Los segmentos de cada bloque de vías salen de modelo_costes.segmentos, con sus sentidos y velocidades.
+    """
+    for vias in iterar_bloques(iterar_elementos(archivo, 'way'), BLOQUE_VIAS):
+        nodo1, nodo2, velocidad = segmentos(vias)
+        origen, encontrados1 = tabla.buscar(nodo1)
+        destino, encontrados2 = tabla.buscar(nodo2)
+        validos = encontrados1 & encontrados2
+        distancia, tiempo = costes(origen[validos], destino[validos], velocidad[validos])
+        yield nodo1[validos], nodo2[validos], distancia, tiempo
+
+class EscritorJSON():
+    """
+    Escribe una lista JSON elemento a elemento, sin tenerla entera en memoria.
+    """
+    def __init__(self, archivo):
+        self.file = open(archivo, 'w', encoding='utf-8')
+        self.file.write('[')
+        self.total = 0
+
+    def escribir(self, elementos):
+        for elemento in elementos:
+            self.file.write(', ' if self.total else '')
+            self.file.write(json.dumps(elemento))
+            self.total += 1
+
+    def cerrar(self):
+        self.file.write(']')
+        self.file.close()
+
+def guardar_info_nodos(tabla, archivo_salida):
+    escritor = EscritorJSON(archivo_salida)
+    for inicio in range(0, len(tabla), BLOQUE):
+        ids = tabla.ids[inicio:inicio + BLOQUE].tolist()
+        coordenadas = tabla.coordenadas[inicio:inicio + BLOQUE].tolist()
+        escritor.escribir({"node_id": nodo_id,
+                           "coordinates": {"longitude": lon, "latitude": lat},
+                           "address": None,
+                           "status": "disponible"} for nodo_id, (lon, lat) in zip(ids, coordenadas))
+    escritor.cerrar()
+    return escritor.total
+
+def guardar_conexiones(archivo, tabla, archivo_salida):
+    escritor = EscritorJSON(archivo_salida)
+    for nodo1, nodo2, distancia, tiempo in iterar_conexiones(archivo, tabla):
+        escritor.escribir({"node1": n1, "node2": n2, "distance": d, "time": t}
+                          for n1, n2, d, t in zip(nodo1.tolist(), nodo2.tolist(), distancia.tolist(), tiempo.tolist()))
+    escritor.cerrar()
+    return escritor.total
+
+def potencia_estacion(tags):
+    """
+    Potencia máxima (kW) de un punto de carga según las etiquetas socket:*:output (p. ej. "50 kW"), o None.
+    """
+    potencias = []
+    for clave, valor in tags.items():
+        if clave.startswith('socket:') and clave.endswith(':output'):
+            try:
+                potencias.append(float(valor.lower().replace('kw', '').strip()))
+            except ValueError:
+                pass
+    return max(potencias) if potencias else None
+
+def guardar_estaciones(archivo, archivo_salida):
+    """
+    Guarda los puntos de carga (nodos amenity=charging_station) del export para la planificación con batería de Route.
+    """
+    escritor = EscritorJSON(archivo_salida)
+    escritor.escribir({"longitude": element['lon'], "latitude": element['lat'],
+                       "power_kw": potencia_estacion(element.get('tags', {}))}
+                      for element in iterar_elementos(archivo, 'node')
+                      if element.get('tags', {}).get('amenity') == 'charging_station')
+    escritor.cerrar()
+    return escritor.total
+
+def compilar(directorio_salida):
+    """
+    Compila los ficheros generados a la caché binaria del grafo (inputs/graph_cache) con Route.
+    """
+    sys.path.insert(0, RAIZ)
+    from find_route import Route
+    from graph_cache import compile_graph
+    os.chdir(os.path.dirname(os.path.abspath(directorio_salida)))
+    compile_graph(Route(graph_cache=None))
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingesta en streaming de un export JSON de Overpass.')
+    parser.add_argument('archivo', nargs='?', default='Vilanova3.json')
+    parser.add_argument('--salida', default=os.path.join(RAIZ, 'inputs'), help='directorio de connection_nodes.json e info_nodes.json')
+    parser.add_argument('--compilar', action='store_true', help='compilar también la caché binaria del grafo')
+    args = parser.parse_args()
+
+    os.makedirs(args.salida, exist_ok=True)
+    tabla = TablaCoordenadas.desde_archivo(args.archivo)
+    nodos = guardar_info_nodos(tabla, os.path.join(args.salida, 'info_nodes.json'))
+    conexiones = guardar_conexiones(args.archivo, tabla, os.path.join(args.salida, 'connection_nodes.json'))
+    estaciones = guardar_estaciones(args.archivo, os.path.join(args.salida, 'charging_stations.json'))
+    print(f'{nodos} nodos, {conexiones} conexiones y {estaciones} puntos de carga escritos en {args.salida}')
+    if args.compilar:
+        if os.path.basename(os.path.normpath(args.salida)) != 'inputs':
+            print('Route carga el grafo de inputs/: no se compila la caché para otro directorio.')
+        else:
+            compilar(args.salida)
+
+if __name__ == "__main__":
+    main()
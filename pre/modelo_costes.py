@@ -0,0 +1,130 @@
+import re
+import numpy as np
+
+# Modelo offline del coste de las aristas a partir de las etiquetas de OSM: la distancia es la haversine entre los
+# dos nodos del segmento y el tiempo sale de la velocidad de la vía (maxspeed o, si no hay, el tipo de highway),
+# corregida por el número de carriles y por un factor de circulación. Todo se calcula con numpy sobre todos los
+# segmentos a la vez; Mapbox solo se usa, opcionalmente, para calibrar el factor con una muestra de aristas.
+
+RADIO_TIERRA = 6371008.8
+VELOCIDAD_DEFECTO = 30  # km/h
+FACTOR_CIRCULACION = 0.8  # fracción del límite a la que se circula de media (cruces, semáforos...)
+
+VELOCIDADES_HIGHWAY = {
+    'motorway': 120, 'motorway_link': 60,
+    'trunk': 90, 'trunk_link': 50,
+    'primary': 50, 'primary_link': 40,
+    'secondary': 50, 'secondary_link': 40,
+    'tertiary': 40, 'tertiary_link': 30,
+    'unclassified': 30, 'residential': 30,
+    'living_street': 10, 'service': 20, 'track': 15,
+    'pedestrian': 10, 'road': 30,
+}
+
+VELOCIDADES_ZONA = {
+    'urban': 50, 'rural': 90, 'trunk': 100, 'motorway': 120,
+    'living_street': 20, 'zone20': 20, 'zone30': 30, 'walk': 5,
+}
+
+ONEWAY_SI = {'yes', 'true', '1'}
+ONEWAY_NO = {'no', 'false', '0'}
+ONEWAY_CONTRARIO = {'-1', 'reverse'}
+
+def parsear_maxspeed(valor):
+    """
+    Convierte una etiqueta maxspeed ('50', '30 mph', 'ES:urban', 'ES:zone30', '30;50') en km/h, o None.
+    """
+    velocidades = []
+    for parte in str(valor).split(';'):
+        parte = parte.strip()
+        numero = re.match(r'^(\d+(?:\.\d+)?)\s*(mph|km/h|kmh)?$', parte)
+        if numero:
+            velocidad = float(numero.group(1))
+            velocidades.append(velocidad * 1.609344 if numero.group(2) == 'mph' else velocidad)
+        elif ':' in parte and parte.split(':', 1)[1] in VELOCIDADES_ZONA:
+            velocidades.append(VELOCIDADES_ZONA[parte.split(':', 1)[1]])
+    return min(velocidades) if velocidades else None
+
+def sentidos(tags):
+    """
+    Sentidos de circulación de una vía: (adelante, atrás) respecto al orden de sus nodos.
+
+    oneway=yes/true/1 solo hacia adelante y oneway=-1 solo hacia atrás. Sin oneway (o con un valor desconocido),
+    las rotondas (junction=roundabout o circular) y las autopistas (highway=motorway) son de sentido único
+    implícito; oneway=no/false/0 abre los dos sentidos también en ellas.
+    """
+    oneway = str(tags.get('oneway', '')).strip().lower()
+    if oneway in ONEWAY_SI:
+        return True, False
+    if oneway in ONEWAY_CONTRARIO:
+        return False, True
+    if oneway in ONEWAY_NO:
+        return True, True
+    implicito = tags.get('junction') in ('roundabout', 'circular') or tags.get('highway') == 'motorway'
+    return True, not implicito
+
+def velocidad_via(tags):
+    """
+    Velocidad media estimada (km/h) de una vía según sus etiquetas maxspeed, highway y lanes.
+    """
+    velocidad = parsear_maxspeed(tags['maxspeed']) if 'maxspeed' in tags else None
+    if velocidad is None or velocidad <= 0:
+        velocidad = VELOCIDADES_HIGHWAY.get(tags.get('highway'), VELOCIDAD_DEFECTO)
+    try:
+        carriles = int(str(tags.get('lanes', '')).split(';')[0])
+    except ValueError:
+        carriles = None
+    if carriles == 1 and all(sentidos(tags)):
+        velocidad *= 0.8  # un solo carril para los dos sentidos
+    elif carriles is not None and carriles >= 3:
+        velocidad *= 1.1
+    return velocidad * FACTOR_CIRCULACION
+
+def haversine(origen, destino):
+    lon1, lat1 = np.radians(origen[:, 0]), np.radians(origen[:, 1])
+    lon2, lat2 = np.radians(destino[:, 0]), np.radians(destino[:, 1])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def costes(origen, destino, velocidad):
+    """
+    Distancia (m) y tiempo (s) de cada segmento.
+
+    origen y destino son arrays (n, 2) de (longitud, latitud); velocidad es un array de n velocidades en km/h.
+    """
+    distancia = haversine(origen, destino)
+    return distancia, distancia / (np.asarray(velocidad, dtype=np.float64) / 3.6)
+
+def segmentos(elements):
+    """
+    Devuelve los arrays (nodo1, nodo2, velocidad) de los segmentos dirigidos de las vías, en los sentidos que
+    permite cada una (sentidos). elements puede ser cualquier iterable de elementos de OSM; los que no son vías
+    se ignoran.
+    """
+    nodo1, nodo2, velocidad = [], [], []
+    for element in elements:
+        if element['type'] != 'way':
+            continue
+        tags = element.get('tags', {})
+        nodes = element['nodes']
+        adelante, atras = sentidos(tags)
+        v = velocidad_via(tags)
+        if adelante:
+            nodo1.extend(nodes[:-1])
+            nodo2.extend(nodes[1:])
+            velocidad.extend([v] * (len(nodes) - 1))
+        if atras:
+            nodo1.extend(nodes[1:])
+            nodo2.extend(nodes[:-1])
+            velocidad.extend([v] * (len(nodes) - 1))
+    return np.array(nodo1, dtype=np.int64), np.array(nodo2, dtype=np.int64), np.array(velocidad, dtype=np.float64)
+
+def factor_calibracion(tiempo_modelo, tiempo_referencia):
+    """
+    Factor por el que multiplicar los tiempos del modelo: mediana de la razón referencia / modelo.
+    """
+    tiempo_modelo, tiempo_referencia = np.asarray(tiempo_modelo), np.asarray(tiempo_referencia)
+    validos = (tiempo_modelo > 0) & (tiempo_referencia > 0)
+    if not validos.any():
+        return 1.0
+    return float(np.median(tiempo_referencia[validos] / tiempo_modelo[validos]))
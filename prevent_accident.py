@@ -1,4 +1,19 @@
 from ..config.db import conn
+from .pedestrian_state import PedestrianState
+
+estat_vianants = None
+
+def pedestrian_state():
+    """
+    Retorna el servei d'estat de vianants compartit, creant-lo i arrencant-lo el primer cop.
+    
+    PRE: cert.
+    POST: retorna un PedestrianState sobre conn['cloud']['carrer'] que es manté al dia en segon pla.
+    """
+    global estat_vianants
+    if estat_vianants is None:
+        estat_vianants = PedestrianState(conn['cloud']['carrer']).start()
+    return estat_vianants
 
 def trobar_seguent_node(ruta, posicio_actual):
     """
@@ -8,11 +23,18 @@ def trobar_seguent_node(ruta, posicio_actual):
          posicio_actual és el node actual en la ruta.
     POST: retorna el següent node en la ruta si existeix, en cas contrari retorna None.
     """
-    try:
-        index_actual = ruta.index(posicio_actual)
-        return ruta[index_actual + 1] if index_actual + 1 < len(ruta) else None
-    except ValueError:
-        raise ValueError("La posició actual no es troba a la ruta.")
+    index_actual = pedestrian_state().position(ruta, posicio_actual)
+    return ruta[index_actual + 1] if index_actual + 1 < len(ruta) else None
+
+def vianants_propers(ruta, posicio_actual, k=5):
+    """
+    Comprova la presència de vianants als k nodes següents de la ruta.
+    
+    PRE: ruta és una llista de nodes que formen el camí.
+         posicio_actual és el node actual en la ruta; k >= 1.
+    POST: retorna una llista amb un booleà per a cadascun dels (com a màxim) k nodes següents.
+    """
+    return pedestrian_state().lookahead(ruta, posicio_actual, k)
 
 def main(ruta, posicio_actual):
     """
@@ -22,15 +44,8 @@ def main(ruta, posicio_actual):
          posicio_actual és el node actual en la ruta.
     POST: retorna l'atribut vianants del següent node en la ruta, en cas contrari retorna False.
     """
-    nodes_vianants_dict = { (node["coordenades"]["longitud"], node["coordenades"]["latitud"]): node['vianants'] for node in conn['cloud']['carrer'].find({"vianants": True}) }
-    
-    seguent_node = trobar_seguent_node(ruta, posicio_actual)
-    if seguent_node is None:
-        return False
-    
-    seguent_node_coords = (seguent_node['longitud'], seguent_node['latitud'])
-    
-    return nodes_vianants_dict.get(seguent_node_coords, False)
+    seguent = vianants_propers(ruta, posicio_actual, 1)
+    return seguent[0] if seguent else False
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,78 @@
+import numpy as np
+
+DEFAULT_CONSUMPTION = 0.15   # kWh/km a la velocitat de referència
+REFERENCE_SPEED     = 50.0   # km/h
+AERO_SHARE          = 0.3    # part del consum a la velocitat de referència que creix amb v^2 (resistència de l'aire)
+
+class CostProfile():
+    """
+    Perfil de cost d'una cerca: combinació lineal de distància i temps (w_distancia, w_temps), o energia (kWh)
+    amb un consum donat.
+
+    key identifica el perfil a la memòria cau de rutes i als pesos precalculats.
+    """
+    def __init__(self, name, w_distancia=0.0, w_temps=0.0, consumption=None):
+        self.name        = name
+        self.w_distancia = float(w_distancia)
+        self.w_temps     = float(w_temps)
+        self.consumption = None if consumption is None else float(consumption)
+
+    @property
+    def energy(self):
+        return self.consumption is not None
+
+    @property
+    def key(self):
+        if self.energy:
+            return ('energy', self.consumption)
+        return ('linear', self.w_distancia, self.w_temps)
+
+    def __repr__(self):
+        return f"CostProfile({self.name!r}, key={self.key})"
+
+NAMED_PROFILES = {
+    'balanced': (0.5, 0.5),
+    'shortest': (1.0, 0.0),
+    'fastest':  (0.0, 1.0),
+}
+
+def resolve_profile(profile, consumption=None, default=None):
+    """
+    Interpreta el perfil de cost d'una petició.
+
+    PRE: perfil és None (perfil per defecte), un nom ('balanced', 'shortest', 'fastest' o 'energy'),
+        una parella (w_distancia, w_temps), un diccionari {'distance': w, 'time': w} o un CostProfile.
+        consum és el consum del vehicle en kWh/km (només per a 'energy'); default és el CostProfile per defecte.
+    POST: retorna el CostProfile. Llança ValueError si el perfil no és vàlid.
+    """
+    if profile is None:
+        return default if default is not None else CostProfile('balanced', *NAMED_PROFILES['balanced'])
+    if isinstance(profile, CostProfile):
+        return profile
+    if isinstance(profile, str):
+        if profile == 'energy':
+            return CostProfile('energy', consumption=DEFAULT_CONSUMPTION if consumption is None else consumption)
+        if profile in NAMED_PROFILES:
+            return CostProfile(profile, *NAMED_PROFILES[profile])
+        raise ValueError(f"Unknown cost profile '{profile}'.")
+    if isinstance(profile, dict):
+        profile = (profile.get('distance', 0.0), profile.get('time', 0.0))
+    try:
+        w_distancia, w_temps = (float(w) for w in profile)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid cost profile {profile!r}.")
+    if w_distancia < 0 or w_temps < 0 or w_distancia + w_temps == 0:
+        raise ValueError("Custom cost weights must be non-negative and not both zero.")
+    return CostProfile('custom', w_distancia, w_temps)
+
+def energy(distance, time, consumption):
+    """
+    Calcula (vectoritzadament) l'energia en kWh per recórrer unes arestes: el consum nominal a la velocitat
+    de referència, amb la part aerodinàmica proporcional al quadrat de la velocitat de cada aresta.
+
+    PRE: distància (m) i temps (s) són escalars o arrays; consum és en kWh/km.
+    POST: retorna l'energia en kWh amb la forma de distància.
+    """
+    distance = np.asarray(distance, dtype=np.float64)
+    velocitat = distance / np.maximum(np.asarray(time, dtype=np.float64), 1e-9) * 3.6
+    return distance / 1000 * consumption * ((1 - AERO_SHARE) + AERO_SHARE * (velocitat / REFERENCE_SPEED) ** 2)
@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+
+class RouteCache():
+    """
+    Memòria cau LRU acotada de resultats de cerca, amb comptadors d'encerts, errades i expulsions.
+
+    Opcionalment té un segon nivell en SQLite (store_path) compartit entre processos: les errades de memòria
+    es consulten al disc i els resultats nous s'hi escriuen. Les claus inclouen la signatura del graf,
+    de manera que els resultats d'un altre graf o d'uns altres pesos no es poden confondre.
+    """
+    def __init__(self, maxsize=4096, store_path=None):
+        self.maxsize   = maxsize
+        self.entries   = OrderedDict()
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self.store_hits = 0
+        self.store_path = store_path
+        self._store     = None
+        self._store_pid = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Busca un resultat a la memòria cau.
+
+        PRE: clau és una tupla de valors convertibles a text.
+        POST: retorna el resultat desat (i el marca com a usat recentment) o None si no hi és.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.store_path:
+            fila = self.store().execute("SELECT value FROM routes WHERE key = ?", (self.store_key(key),)).fetchone()
+            if fila is not None:
+                self.store_hits += 1
+                valor = tuple(json.loads(fila[0]))
+                self.remember(key, valor)
+                return valor
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Desa un resultat a la memòria cau (i al magatzem compartit, si n'hi ha).
+
+        PRE: clau com a get; valor és la tupla (camí, cost, distància, temps).
+        POST: el resultat queda desat; si se supera maxsize s'expulsa l'entrada menys usada recentment.
+        """
+        self.remember(key, value)
+        if self.store_path:
+            self.store().execute("INSERT OR REPLACE INTO routes (key, value) VALUES (?, ?)",
+                               (self.store_key(key), json.dumps(value)))
+
+    def store(self):
+        """
+        Retorna la connexió SQLite al magatzem compartit, oberta per aquest procés.
+
+        Els processos creats amb fork no poden compartir la connexió del pare, de manera que se'n reobre una
+        quan canvia el PID.
+        """
+        if self._store is None or self._store_pid != os.getpid():
+            self._store = sqlite3.connect(self.store_path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._store.execute("PRAGMA journal_mode=WAL")
+            self._store.execute("CREATE TABLE IF NOT EXISTS routes (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._store_pid = os.getpid()
+        return self._store
+
+    def remember(self, key, value):
+        """
+        Desa un resultat només a la memòria LRU, expulsant les entrades més antigues si cal.
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def store_key(self, key):
+        """
+        Converteix una clau en el text amb què es desa al magatzem compartit.
+        """
+        return ":".join(str(part) for part in key)
+
+    def clear(self):
+        """
+        Buida la memòria cau en memòria (el magatzem compartit es conserva: les seves claus porten la signatura del graf).
+        """
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Retorna els comptadors de la memòria cau.
+        """
+        return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "store_hits": self.store_hits}
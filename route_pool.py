@@ -0,0 +1,304 @@
+import json
+import multiprocessing
+import os
+import queue
+import random
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from find_route import Route
+
+#----------------------------------------------------------------
+# SHARED ROUTE POOL                                             |
+#----------------------------------------------------------------
+# One pool of route workers for all the car processes of virtual_car.py,
+# instead of every car searching with its own copy of the Route. Cars put
+# their requests on one shared queue; a dispatcher thread in the parent
+# snaps them, merges identical in-flight requests (same snapped origin
+# and destination and same options) and hands each distinct one to the
+# worker processes. A worker writes the JSON answer to a shared-memory
+# block and only the block name travels back: the dispatcher forwards it
+# to the reply queue of every car waiting for it, each car copies it out
+# and releases it, and the last release unlinks the block. The node
+# coordinates (for random destinations) are shared the same way.
+#
+# The Route of the dispatcher applies the graph deltas (OSM updates) before
+# snapping each batch, like the workers do before each search, so requests
+# never snap to removed nodes. When a delta changes the graph, the shared
+# coordinates are written to a new block with the next version number and
+# the clients switch to it on their next random destination.
+
+MAX_BATCH = 256     # requests snapped together by the dispatcher
+
+#-----------------------------+
+#       WORKERS               |
+#-----------------------------+
+worker_route = None
+
+def init_worker(route: Route):
+    """
+    Keep the Route inherited from the parent process (fork) for the searches of this worker.
+    """
+    global worker_route
+    worker_route = route
+
+def warm_up(_):
+    return os.getpid()
+
+def route_task(node_origin: str, node_dest: str, coordinates, options: dict):
+    """
+    Compute one route and leave its JSON in a new shared-memory block. Returns ('ok', name, size) or ('error', detail).
+    """
+    worker_route.reload_delta()
+    worker_route.refresh_traffic()
+    lat_origin, long_origin, lat_dest, long_dest = coordinates
+    index = worker_route.adjacent_list.index
+    if node_origin not in index or node_dest not in index:
+        # A delta that arrived after the dispatcher snapped the request removed one of its nodes.
+        node_origin, node_dest = worker_route.snap_many([(long_origin, lat_origin), (long_dest, lat_dest)])
+    try:
+        result = worker_route.route_between(node_origin, node_dest, lat_origin, long_origin, lat_dest, long_dest, **options)
+    except ValueError as error:
+        return 'error', str(error)
+    data = json.dumps(result).encode()
+    block = SharedMemory(create=True, size=max(1, len(data)))
+    block.buf[:len(data)] = data
+    name = block.name
+    block.close()
+    return 'ok', name, len(data)
+
+#-----------------------------+
+#       COORDINATES           |
+#-----------------------------+
+def coordinates_name(prefix: str, version: int):
+    return f'{prefix}_{version}'
+
+def write_coordinates(route: Route, name: str):
+    """
+    Shared-memory block with the number of nodes (int64) followed by their (longitude, latitude) pairs (float64).
+    """
+    coordinates = np.array([route.coordinates_nodes[node] for node in route.nodes], dtype=np.float64).reshape(-1, 2)
+    block = SharedMemory(name=name, create=True, size=8 + coordinates.nbytes)
+    np.ndarray(1, dtype=np.int64, buffer=block.buf)[0] = len(coordinates)
+    np.ndarray(coordinates.shape, dtype=np.float64, buffer=block.buf, offset=8)[:] = coordinates
+    return block
+
+def read_coordinates(block: SharedMemory):
+    count = int(np.ndarray(1, dtype=np.int64, buffer=block.buf)[0])
+    return np.ndarray((count, 2), dtype=np.float64, buffer=block.buf, offset=8)
+
+#-----------------------------+
+#       POOL                  |
+#-----------------------------+
+class RoutePool():
+    """
+    Route workers forked from the loaded Route, fed by a dispatcher thread that deduplicates in-flight requests.
+
+    Create it before forking the car processes, connect each car's reply queue, fork the cars (each one uses
+    pool.client(car_id, reply_queue)) and then start() the dispatcher.
+    """
+    def __init__(self, route: Route, workers=None):
+        self.route    = route
+        self.workers  = workers or os.cpu_count() or 1
+        ctx = multiprocessing.get_context('fork')
+        # Every process forked from here shares the tracker of the shared-memory blocks.
+        resource_tracker.ensure_running()
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=ctx, initializer=init_worker, initargs=(route,))
+        list(self.executor.map(warm_up, range(self.workers)))
+        self.requests = ctx.Queue()
+        self.replies  = {}
+        self.inflight = {}
+        self.blocks   = {}
+        self.lock     = threading.Lock()
+        self.counters = {'requests': 0, 'deduplicated': 0, 'computed': 0, 'errors': 0, 'deltas': 0}
+        self.thread   = threading.Thread(target=self.run, daemon=True)
+
+        self.prefix      = f'routes_{os.getpid()}_{secrets.token_hex(4)}'
+        self.version     = ctx.Value('q', 0)
+        self.coordinates = write_coordinates(route, coordinates_name(self.prefix, 0))
+
+    def connect(self, car_id, reply_queue):
+        self.replies[car_id] = reply_queue
+
+    def client(self, car_id, reply_queue):
+        return RouteClient(self.requests, reply_queue, car_id, self.prefix, self.version)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+        self.executor.shutdown(cancel_futures=True)
+        with self.lock:
+            names = list(self.blocks)
+            self.blocks.clear()
+        for name in names:
+            unlink(name)
+        self.coordinates.close()
+        self.coordinates.unlink()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, inflight=len(self.inflight), blocks=len(self.blocks), version=self.version.value)
+
+    def refresh_coordinates(self):
+        """
+        Publish the coordinates of the current graph as the next version and unlink the previous block
+        (clients that still map it keep reading it until they switch).
+        """
+        version = self.version.value + 1
+        block = write_coordinates(self.route, coordinates_name(self.prefix, version))
+        self.version.value = version
+        previous, self.coordinates = self.coordinates, block
+        previous.close()
+        previous.unlink()
+
+    #-----------------------------+
+    #       DISPATCHER            |
+    #-----------------------------+
+    def collect(self):
+        batch = [self.requests.get()]
+        while batch[-1] is not None and len(batch) < MAX_BATCH:
+            try:
+                batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            routes = []
+            for message in batch:
+                if message is None:
+                    return
+                if message[0] == 'release':
+                    self.release(message[1])
+                else:
+                    routes.append(message[1:])
+            if routes:
+                self.dispatch(routes)
+
+    def dispatch(self, routes):
+        applied = self.route.reload_delta()
+        if applied:
+            with self.lock:
+                self.counters['deltas'] += applied
+            self.refresh_coordinates()
+        nodes = self.route.snap_many([p for _, (lat_o, long_o, lat_d, long_d), _ in routes
+                                      for p in ((long_o, lat_o), (long_d, lat_d))])
+        for i, (car_id, coordinates, options) in enumerate(routes):
+            key = (nodes[2 * i], nodes[2 * i + 1], json.dumps(options, sort_keys=True))
+            with self.lock:
+                self.counters['requests'] += 1
+                if key in self.inflight:
+                    self.counters['deduplicated'] += 1
+                    self.inflight[key].append(car_id)
+                    continue
+                self.inflight[key] = [car_id]
+            task = self.executor.submit(route_task, nodes[2 * i], nodes[2 * i + 1], coordinates, options)
+            task.add_done_callback(lambda task, key=key: self.deliver(key, task))
+
+    def deliver(self, key, task):
+        with self.lock:
+            waiting = self.inflight.pop(key)
+        try:
+            answer = task.result()
+        except Exception as error:
+            answer = ('error', f'{type(error).__name__}: {error}')
+        with self.lock:
+            if answer[0] == 'ok':
+                self.counters['computed'] += 1
+                self.blocks[answer[1]] = len(waiting)
+            else:
+                self.counters['errors'] += 1
+        for car_id in waiting:
+            self.replies[car_id].put(answer)
+
+    def release(self, name: str):
+        with self.lock:
+            self.blocks[name] -= 1
+            if self.blocks[name] > 0:
+                return
+            del self.blocks[name]
+        unlink(name)
+
+def unlink(name: str):
+    try:
+        block = SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+#-----------------------------+
+#       CLIENT                |
+#-----------------------------+
+class RouteClient():
+    """
+    What a car process uses instead of a Route: the same find_route and get_random_node, answered by the pool.
+    reload_delta and refresh_traffic do nothing here: the dispatcher applies the graph deltas before snapping
+    and publishes the new coordinates, and the workers apply the deltas and the traffic before every search.
+    """
+    def __init__(self, requests, replies, car_id, prefix: str, version):
+        self.requests = requests
+        self.replies  = replies
+        self.car_id   = car_id
+        self.prefix   = prefix
+        self.version  = version
+        self.block    = None
+        self.block_version = None
+
+    def coordinates(self):
+        """
+        The node coordinates of the latest published version (attached again when the version changes).
+        """
+        while self.block is None or self.block_version != self.version.value:
+            version = self.version.value
+            try:
+                block = SharedMemory(name=coordinates_name(self.prefix, version))
+            except FileNotFoundError:
+                # Replaced by a newer version in the meantime.
+                continue
+            if self.block is not None:
+                self.block.close()
+            self.block, self.block_version = block, version
+        return read_coordinates(self.block)
+
+    def get_random_node(self):
+        coordinates = self.coordinates()
+        longitude, latitude = coordinates[random.randrange(len(coordinates))].tolist()
+        return longitude, latitude
+
+    def reload_delta(self):
+        pass
+
+    def refresh_traffic(self):
+        pass
+
+    def find_route(self, lat_origin, long_origin, lat_dest, long_dest, **options):
+        """
+        Same arguments and result as Route.find_route (the keyword options are passed through).
+        Raises ValueError if there is no route.
+        """
+        coordinates = (lat_origin, long_origin, lat_dest, long_dest)
+        self.requests.put(('route', self.car_id, coordinates, options))
+        answer = self.replies.get()
+        if answer[0] == 'error':
+            raise ValueError(answer[1])
+        _, name, size = answer
+        block = SharedMemory(name=name)
+        try:
+            result = json.loads(bytes(block.buf[:size]))
+        finally:
+            block.close()
+            self.requests.put(('release', name))
+        # A deduplicated answer was computed for another car: the end points are this car's own.
+        result['route'][0] = {"longitude": long_origin, "latitude": lat_origin}
+        result['route'][-1] = {"longitude": long_dest, "latitude": lat_dest}
+        return result
@@ -0,0 +1,342 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+from find_route import Route
+
+#----------------------------------------------------------------
+# ROUTE SERVER                                                  |
+#----------------------------------------------------------------
+# Long-running HTTP front end for Route. The graph is loaded once in the
+# parent and the worker processes are forked from it, so they share it
+# copy-on-write (with the compiled graph cache the arrays are read-only
+# memmaps, shared page by page). Concurrent /route requests are gathered
+# for a few milliseconds and sent to the workers in batches: one IPC
+# round trip and one vectorised snap per batch instead of per request.
+#
+#   python route_server.py --port 8080 --workers 4
+#   python benchmarks/route_load.py --url http://127.0.0.1:8080
+
+BATCH_WINDOW     = 0.005    # s to wait for more requests once one arrives
+BATCH_SIZE       = 64
+REQUEST_TIMEOUT  = 60.0
+LATENCY_WINDOW   = 10000    # latencies kept per endpoint for the percentiles
+MAX_MATRIX_CELLS = 250000
+NUMERIC_OPTIONS  = ('departure', 'price_km', 'consumption', 'capacity', 'battery', 'reserve')
+
+class BadRequest(Exception):
+    pass
+
+def point(value):
+    """
+    Parse a point given as {"latitude": .., "longitude": ..} or [longitude, latitude] into (longitude, latitude).
+    """
+    try:
+        if isinstance(value, dict):
+            return float(value['longitude']), float(value['latitude'])
+        longitude, latitude = value
+        return float(longitude), float(latitude)
+    except (KeyError, TypeError, ValueError):
+        raise BadRequest(f"Invalid point {value!r}.")
+
+def route_options(body):
+    """
+    The find_route options of a /route request: engine, profile and the numeric vehicle parameters.
+    """
+    options = {}
+    for name in NUMERIC_OPTIONS:
+        if body.get(name) is not None:
+            try:
+                options[name] = float(body[name])
+            except (TypeError, ValueError):
+                raise BadRequest(f"Invalid {name} {body[name]!r}.")
+    if body.get('engine') is not None:
+        options['engine'] = str(body['engine'])
+    if body.get('profile') is not None:
+        if not isinstance(body['profile'], (str, list, dict)):
+            raise BadRequest(f"Invalid profile {body['profile']!r}.")
+        options['profile'] = body['profile']
+    return options
+
+def finite(array):
+    """
+    Matrix values as nested lists, with None for unreachable (inf) cells.
+    """
+    return [[value if math.isfinite(value) else None for value in row] for row in np.asarray(array).tolist()]
+
+#-----------------------------+
+#       WORKERS               |
+#-----------------------------+
+worker_route = None
+
+def init_worker(route: Route):
+    """
+    Keep the Route inherited from the parent process (fork) for the searches of this worker.
+    """
+    global worker_route
+    worker_route = route
+
+def warm_up(_):
+    return os.getpid()
+
+def route_batch(requests):
+    """
+    Answer a batch of /route requests: all points are snapped in one call and identical requests are computed once.
+    Returns a list of (status, body) in the same order; a request that fails gets its own 422 or 500 answer.
+    """
+    worker_route.reload_delta()
+    worker_route.refresh_traffic()
+    nodes = worker_route.snap_many([p for request in requests for p in (request['origin'], request['destination'])])
+    answers, results = {}, []
+    for i, request in enumerate(requests):
+        key = json.dumps(request, sort_keys=True)
+        if key not in answers:
+            (long_origin, lat_origin), (long_dest, lat_dest) = request['origin'], request['destination']
+            try:
+                answers[key] = (200, worker_route.route_between(nodes[2 * i], nodes[2 * i + 1], lat_origin, long_origin,
+                                                                lat_dest, long_dest, **request['options']))
+            except ValueError as error:
+                answers[key] = (422, {'detail': str(error)})
+            except Exception as error:
+                # Only this request fails: the rest of the batch still gets its answers.
+                answers[key] = (500, {'detail': f'{type(error).__name__}: {error}'})
+        results.append(answers[key])
+    return results
+
+def matrix_task(origins, destinations, profile):
+    worker_route.reload_delta()
+    worker_route.refresh_traffic()
+    try:
+        matrix = worker_route.distance_matrix(origins, destinations, profile=profile)
+    except ValueError as error:
+        return 422, {'detail': str(error)}
+    return 200, {name: finite(values) for name, values in matrix.items()}
+
+#-----------------------------+
+#       BATCHING              |
+#-----------------------------+
+class RouteBatcher():
+    """
+    Collects /route requests for up to BATCH_WINDOW seconds (or BATCH_SIZE requests) and hands each batch,
+    split across the workers, to the process pool. Each request gets a Future with its (status, body).
+    """
+    def __init__(self, executor: ProcessPoolExecutor, workers: int, window=BATCH_WINDOW, size=BATCH_SIZE):
+        self.executor = executor
+        self.workers  = workers
+        self.window   = window
+        self.size     = size
+        self.pending  = queue.Queue()
+        self.batches  = Counter()
+        self.thread   = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, request) -> Future:
+        future = Future()
+        self.pending.put((request, future))
+        return future
+
+    def collect(self):
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            self.batches[len(batch)] += 1
+            chunks = max(1, min(self.workers, len(batch)))
+            for k in range(chunks):
+                part = batch[k::chunks]
+                try:
+                    task = self.executor.submit(route_batch, [request for request, _ in part])
+                except RuntimeError as error:
+                    for _, future in part:
+                        future.set_exception(error)
+                    continue
+                task.add_done_callback(lambda task, part=part: self.deliver(task, part))
+
+    def deliver(self, task, part):
+        try:
+            results = task.result()
+        except Exception as error:
+            for _, future in part:
+                future.set_exception(error)
+            return
+        for (_, future), result in zip(part, results):
+            future.set_result(result)
+
+    def mean_batch(self):
+        total = sum(self.batches.values())
+        return round(sum(size * count for size, count in self.batches.items()) / total, 2) if total else 0.0
+
+class LatencyStats():
+    """
+    Recent request latencies per endpoint (the last LATENCY_WINDOW), with counts by status code.
+    """
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window    = window
+        self.latencies = {}
+        self.statuses  = Counter()
+        self.lock      = threading.Lock()
+
+    def record(self, endpoint: str, status: int, seconds: float):
+        with self.lock:
+            self.latencies.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+            self.statuses[(endpoint, status)] += 1
+
+    def summary(self):
+        with self.lock:
+            latencies = {endpoint: np.array(values) for endpoint, values in self.latencies.items()}
+            statuses = dict(self.statuses)
+        return {endpoint: {
+            'count': sum(count for (name, _), count in statuses.items() if name == endpoint),
+            'status': {str(status): count for (name, status), count in statuses.items() if name == endpoint},
+            'p50_ms': round(float(np.percentile(values, 50)) * 1e3, 3),
+            'p99_ms': round(float(np.percentile(values, 99)) * 1e3, 3),
+            'mean_ms': round(float(values.mean()) * 1e3, 3),
+        } for endpoint, values in latencies.items()}
+
+#-----------------------------+
+#       HTTP                  |
+#-----------------------------+
+class RouteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise BadRequest('Invalid JSON body.')
+
+    def answer(self, endpoint: str, handler, *args):
+        start = time.perf_counter()
+        try:
+            status, body = handler(*args)
+        except BadRequest as error:
+            status, body = 400, {'detail': str(error)}
+        except TimeoutError:
+            status, body = 504, {'detail': 'The route workers did not answer in time.'}
+        except Exception as error:
+            status, body = 500, {'detail': f'{type(error).__name__}: {error}'}
+        self.send_json(status, body)
+        self.server.stats.record(endpoint, status, time.perf_counter() - start)
+
+    def route(self, body):
+        if not isinstance(body, dict) or 'origin' not in body or 'destination' not in body:
+            raise BadRequest('A route needs an origin and a destination.')
+        request = {
+            'origin': point(body['origin']),
+            'destination': point(body['destination']),
+            'options': route_options(body),
+        }
+        return self.server.batcher.submit(request).result(REQUEST_TIMEOUT)
+
+    def matrix(self, body):
+        if not isinstance(body, dict) or not body.get('origins') or not body.get('destinations'):
+            raise BadRequest('A matrix needs origins and destinations.')
+        origins = [point(p) for p in body['origins']]
+        destinations = [point(p) for p in body['destinations']]
+        if len(origins) * len(destinations) > MAX_MATRIX_CELLS:
+            return 413, {'detail': f'The matrix is limited to {MAX_MATRIX_CELLS} cells.'}
+        task = self.server.executor.submit(matrix_task, origins, destinations, body.get('profile'))
+        return task.result(REQUEST_TIMEOUT)
+
+    def stats(self):
+        summary = self.server.stats.summary()
+        summary['batches'] = {'count': sum(self.server.batcher.batches.values()), 'mean_size': self.server.batcher.mean_batch()}
+        summary['workers'] = self.server.workers
+        summary['uptime'] = round(time.monotonic() - self.server.started, 3)
+        return 200, summary
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path == '/route':
+            self.answer('/route', lambda: self.route(self.read_json()))
+        elif path == '/matrix':
+            self.answer('/matrix', lambda: self.matrix(self.read_json()))
+        else:
+            self.read_json()
+            self.send_json(404, {'detail': 'Not Found'})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/route':
+            # GET /route?origin=lon,lat&destination=lon,lat&profile=fastest
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            body = {name: value.split(',') if name in ('origin', 'destination') else value for name, value in query.items()}
+            self.answer('/route', self.route, body)
+        elif url.path == '/stats':
+            self.send_json(*self.stats())
+        elif url.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'detail': 'Not Found'})
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(route: Route, host='127.0.0.1', port=8080, workers=None, window=BATCH_WINDOW, size=BATCH_SIZE):
+    """
+    Fork the workers from the loaded Route and build the HTTP server (call serve_forever to start it).
+    """
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'),
+                                   initializer=init_worker, initargs=(route,))
+    # Fork every worker now, before the server threads exist.
+    list(executor.map(warm_up, range(workers)))
+    server = ThreadingHTTPServer((host, port), RouteHandler)
+    server.daemon_threads = True
+    server.executor = executor
+    server.workers  = workers
+    server.batcher  = RouteBatcher(executor, workers, window, size).start()
+    server.stats    = LatencyStats()
+    server.started  = time.monotonic()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP route server with a warm in-memory graph.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None, help='route worker processes (default: CPU count)')
+    parser.add_argument('--batch-window', type=float, default=BATCH_WINDOW, help='seconds to gather a batch of /route requests')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    route = Route(route_cache_path=os.getenv('ROUTE_CACHE_PATH'))
+    server = make_server(route, args.host, args.port, args.workers, args.batch_window, args.batch_size)
+    print(f'Route server listening on http://{args.host}:{args.port} with {server.workers} workers')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(cancel_futures=True)
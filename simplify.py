@@ -0,0 +1,283 @@
+import hashlib
+import os
+import sys
+import numpy as np
+from graph import CSRGraph
+
+SIMPLIFY_FORMAT_VERSION = 1
+
+def graph_signature(graph: CSRGraph):
+    """
+    Calcula una signatura del graf (topologia i pesos) per lligar-hi el graf simplificat desat.
+
+    PRE: graf és un CSRGraph.
+    POST: retorna el hash SHA-256 en hexadecimal.
+    """
+    return hashlib.sha256(f"simplify-{SIMPLIFY_FORMAT_VERSION}:{graph.signature()}".encode()).hexdigest()
+
+def chain_nodes(graph: CSRGraph):
+    """
+    Marca els nodes intermedis d'una via: els que només enllacen dos veïns diferents, en un sentit
+    (una entrada des de a i una sortida cap a b) o en tots dos (entrades i sortides exactament cap a a i b).
+
+    PRE: graf és un CSRGraph.
+    POST: retorna un array booleà amb un valor per node.
+    """
+    sortides = np.diff(np.asarray(graph.offsets))
+    entrades = np.bincount(np.asarray(graph.targets), minlength=len(graph))
+    candidats = np.flatnonzero(((sortides == 1) & (entrades == 1)) | ((sortides == 2) & (entrades == 2)))
+    invers = graph.reverse()
+    intermedis = np.zeros(len(graph), dtype=bool)
+    for node in candidats.tolist():
+        cap_a = graph.targets[graph.offsets[node]:graph.offsets[node + 1]].tolist()
+        des_de = invers.targets[invers.offsets[node]:invers.offsets[node + 1]].tolist()
+        if node in cap_a or node in des_de or len(set(cap_a)) != len(cap_a) or len(set(des_de)) != len(des_de):
+            continue
+        if len(cap_a) == 1 and cap_a != des_de:
+            intermedis[node] = True
+        elif len(cap_a) == 2 and set(cap_a) == set(des_de):
+            intermedis[node] = True
+    return intermedis
+
+class SimplifiedGraph():
+    """
+    Graf simplificat: les cadenes de nodes intermedis (grau 2) es contrauen en arestes compostes entre cruïlles.
+
+    core és el CSRGraph de les cruïlles; cada aresta composta e representa les arestes originals
+    via_edges[via_offsets[e]:via_offsets[e + 1]] (la geometria completa es recupera a partir d'aquestes).
+    via_cost és el cost acumulat dins de cada aresta composta, i members indica, per a cada node intermedi,
+    les arestes compostes que el travessen i la posició: així una cerca pot començar o acabar a mitja cadena.
+    """
+    def __init__(self, graph: CSRGraph, core: CSRGraph, core_nodes, via_offsets, via_edges, via_cost,
+                 member_offsets, member_edges, member_positions, signature):
+        self.graph       = graph
+        self.core        = core
+        self.core_nodes  = core_nodes
+        self.core_index  = np.full(len(graph), -1, dtype=np.int64)
+        self.core_index[core_nodes] = np.arange(len(core_nodes))
+        self.via_offsets = via_offsets
+        self.via_edges   = via_edges
+        self.via_cost    = via_cost
+        self.member_offsets   = member_offsets
+        self.member_edges     = member_edges
+        self.member_positions = member_positions
+        self.signature   = signature
+        self.core_sources = core.sources()
+        core.set_coordinate_array(np.asarray(graph.coordinates)[core_nodes])
+        core.heuristic_factor = graph.heuristic_factor
+
+    @classmethod
+    def build(cls, graph: CSRGraph):
+        """
+        Contrau les cadenes de nodes intermedis del graf.
+
+        PRE: graf és un CSRGraph preparat (amb coordenades).
+        POST: retorna el SimplifiedGraph. Els cicles formats només per nodes intermedis conserven un node com a cruïlla.
+        """
+        intermedis = chain_nodes(graph)
+        offsets, targets, _ = graph.views()
+
+        def seguir(node, aresta):
+            # Recorre la cadena que comença amb l'aresta donada fins a la següent cruïlla.
+            cami = [aresta]
+            anterior, actual = node, int(targets[aresta])
+            while intermedis[actual]:
+                for seguent in range(offsets[actual], offsets[actual + 1]):
+                    if targets[seguent] != anterior:
+                        break
+                cami.append(seguent)
+                anterior, actual = actual, int(targets[seguent])
+            return actual, cami
+
+        coberts = ~intermedis
+        for node in np.flatnonzero(~intermedis).tolist():
+            for aresta in range(offsets[node], offsets[node + 1]):
+                for via in seguir(node, aresta)[1][:-1]:
+                    coberts[targets[via]] = True
+        for node in np.flatnonzero(~coberts).tolist():
+            if not coberts[node]:
+                intermedis[node] = False
+                coberts[node] = True
+                for aresta in range(offsets[node], offsets[node + 1]):
+                    for via in seguir(node, aresta)[1][:-1]:
+                        coberts[targets[via]] = True
+
+        core_nodes = np.flatnonzero(~intermedis)
+        core_index = np.full(len(graph), -1, dtype=np.int64)
+        core_index[core_nodes] = np.arange(len(core_nodes))
+        pesos = np.asarray(graph.weight).tolist()
+        sources, core_targets, via_edges, via_offsets, via_cost = [], [], [], [0], []
+        for i, node in enumerate(core_nodes.tolist()):
+            for aresta in range(offsets[node], offsets[node + 1]):
+                final, cami = seguir(node, aresta)
+                sources.append(i)
+                core_targets.append(core_index[final])
+                via_edges.extend(cami)
+                via_offsets.append(len(via_edges))
+                cost = 0.0
+                for via in cami:
+                    cost += pesos[via]
+                    via_cost.append(cost)
+
+        via_edges = np.array(via_edges, dtype=np.int64)
+        via_offsets = np.array(via_offsets, dtype=np.int64)
+        via_cost = np.array(via_cost, dtype=np.float64)
+        inicis = via_offsets[:-1]
+        weight = via_cost[via_offsets[1:] - 1]
+        distance = np.add.reduceat(np.asarray(graph.distance, dtype=np.float64)[via_edges], inicis) if len(via_edges) else np.zeros(0)
+        time = np.add.reduceat(np.asarray(graph.time, dtype=np.float64)[via_edges], inicis) if len(via_edges) else np.zeros(0)
+        core = CSRGraph.from_edges([graph.ids[node] for node in core_nodes.tolist()], sources, core_targets, weight, distance, time)
+
+        # Nodes intermedis: per a cada aresta composta, el node de la posició p és el destí de l'aresta original p.
+        compostes = np.repeat(np.arange(len(via_offsets) - 1), np.diff(via_offsets))
+        posicions = np.arange(len(via_edges)) - via_offsets[compostes]
+        nodes = np.asarray(graph.targets, dtype=np.int64)[via_edges]
+        interiors = intermedis[nodes]
+        ordre = np.argsort(nodes[interiors], kind='stable')
+        member_offsets = np.zeros(len(graph) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(nodes[interiors], minlength=len(graph)), out=member_offsets[1:])
+        return cls(graph, core, core_nodes, via_offsets, via_edges, via_cost, member_offsets,
+                   compostes[interiors][ordre], posicions[interiors][ordre], graph_signature(graph))
+
+    def reweighted(self, graph: CSRGraph):
+        """
+        Retorna el graf simplificat d'un graf amb la mateixa topologia i uns altres pesos (Route.reweight), sense
+        tornar a contraure les cadenes: els costos acumulats es recalculen amb una suma acumulada per segments.
+
+        PRE: graf és un CSRGraph amb la mateixa topologia que self.graph (p. ex. creat amb with_weights).
+        POST: retorna un SimplifiedGraph nou que comparteix l'estructura d'aquest.
+        """
+        if graph is self.graph:
+            return self
+        llargades = np.diff(self.via_offsets)
+        acumulat = np.cumsum(np.asarray(graph.weight, dtype=np.float64)[self.via_edges])
+        abans = np.concatenate([[0.0], acumulat])[self.via_offsets[:-1]]
+        via_cost = acumulat - np.repeat(abans, llargades)
+        if len(self.via_edges):
+            weight = via_cost[self.via_offsets[1:] - 1]
+            time = np.add.reduceat(np.asarray(graph.time, dtype=np.float64)[self.via_edges], self.via_offsets[:-1])
+        else:
+            weight, time = np.zeros(0), np.zeros(0)
+        simplified = SimplifiedGraph.__new__(SimplifiedGraph)
+        simplified.__dict__.update(self.__dict__)
+        simplified.graph     = graph
+        simplified.core      = self.core.with_weights(weight, time)
+        simplified.via_cost  = via_cost
+        simplified.signature = graph_signature(graph)
+        simplified.core.heuristic_factor = graph.heuristic_factor
+        return simplified
+
+    def save(self, path):
+        """
+        Desa el graf simplificat en un fitxer .npz de manera atòmica.
+        """
+        directori = os.path.dirname(path)
+        if directori:
+            os.makedirs(directori, exist_ok=True)
+        temporal = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(temporal, core_nodes=self.core_nodes, offsets=self.core.offsets, targets=self.core.targets,
+                 weight=self.core.weight, distance=self.core.distance, time=self.core.time,
+                 via_offsets=self.via_offsets, via_edges=self.via_edges, via_cost=self.via_cost,
+                 member_offsets=self.member_offsets, member_edges=self.member_edges,
+                 member_positions=self.member_positions, signature=np.array(self.signature))
+        os.replace(temporal, path)
+
+    @classmethod
+    def load(cls, path, graph: CSRGraph):
+        """
+        Carrega un graf simplificat desat si correspon al graf indicat.
+
+        PRE: path és el fitxer .npz desat per save; graf és el CSRGraph actual.
+        POST: retorna el SimplifiedGraph o None si el fitxer no existeix o és d'un altre graf.
+        """
+        try:
+            dades = np.load(path)
+        except (OSError, ValueError):
+            return None
+        with dades:
+            signatura = str(dades['signature'])
+            if signatura != graph_signature(graph):
+                return None
+            core_nodes = dades['core_nodes']
+            core = CSRGraph([graph.ids[node] for node in core_nodes.tolist()], dades['offsets'], dades['targets'],
+                            dades['weight'], dades['distance'], dades['time'])
+            return cls(graph, core, core_nodes, dades['via_offsets'], dades['via_edges'], dades['via_cost'],
+                       dades['member_offsets'], dades['member_edges'], dades['member_positions'], signatura)
+
+    def expand(self, core_edges):
+        """
+        Desplega una seqüència d'arestes compostes en les arestes originals.
+
+        PRE: arestes_compostes és una llista d'índexs d'aresta del graf simplificat.
+        POST: retorna la llista d'índexs d'aresta del graf original en ordre.
+        """
+        originals = []
+        for aresta in core_edges:
+            originals.extend(self.via_edges[self.via_offsets[aresta]:self.via_offsets[aresta + 1]].tolist())
+        return originals
+
+    def departures(self, node: int):
+        """
+        Punts d'entrada al graf simplificat des d'un node del graf original.
+
+        PRE: node és un índex del graf original.
+        POST: retorna una llista de (cruïlla, cost, arestes originals fins a la cruïlla).
+        """
+        if self.core_index[node] >= 0:
+            return [(int(self.core_index[node]), 0.0, [])]
+        sortides = []
+        for k in range(self.member_offsets[node], self.member_offsets[node + 1]):
+            aresta, posicio = int(self.member_edges[k]), int(self.member_positions[k])
+            inici, fi = self.via_offsets[aresta], self.via_offsets[aresta + 1]
+            sortides.append((int(self.core.targets[aresta]), float(self.via_cost[fi - 1] - self.via_cost[inici + posicio]),
+                             self.via_edges[inici + posicio + 1:fi].tolist()))
+        return sortides
+
+    def arrivals(self, node: int):
+        """
+        Punts de sortida del graf simplificat cap a un node del graf original.
+
+        PRE: node és un índex del graf original.
+        POST: retorna un diccionari cruïlla -> (cost, arestes originals des de la cruïlla), amb el millor cost per cruïlla.
+        """
+        if self.core_index[node] >= 0:
+            return {int(self.core_index[node]): (0.0, [])}
+        arribades = {}
+        for k in range(self.member_offsets[node], self.member_offsets[node + 1]):
+            aresta, posicio = int(self.member_edges[k]), int(self.member_positions[k])
+            inici = self.via_offsets[aresta]
+            origen, cost = int(self.core_sources[aresta]), float(self.via_cost[inici + posicio])
+            if origen not in arribades or cost < arribades[origen][0]:
+                arribades[origen] = (cost, self.via_edges[inici:inici + posicio + 1].tolist())
+        return arribades
+
+    def direct(self, origin: int, dest: int):
+        """
+        Camí entre dos nodes intermedis de la mateixa aresta composta, sense passar per cap cruïlla.
+
+        PRE: origen i desti són índexs del graf original.
+        POST: retorna (cost, arestes originals) del millor camí directe, o (inf, None) si no n'hi ha.
+        """
+        millor = (float('inf'), None)
+        if self.core_index[origin] >= 0 or self.core_index[dest] >= 0:
+            return millor
+        posicions = {}
+        for k in range(self.member_offsets[origin], self.member_offsets[origin + 1]):
+            posicions[int(self.member_edges[k])] = int(self.member_positions[k])
+        for k in range(self.member_offsets[dest], self.member_offsets[dest + 1]):
+            aresta, posicio = int(self.member_edges[k]), int(self.member_positions[k])
+            if aresta in posicions and posicions[aresta] < posicio:
+                inici = self.via_offsets[aresta]
+                cost = float(self.via_cost[inici + posicio] - self.via_cost[inici + posicions[aresta]])
+                if cost < millor[0]:
+                    millor = (cost, self.via_edges[inici + posicions[aresta] + 1:inici + posicio + 1].tolist())
+        return millor
+
+if __name__ == '__main__':
+    from find_route import Route, SIMPLIFIED_FILE
+    path = sys.argv[1] if len(sys.argv) > 1 else SIMPLIFIED_FILE
+    route = Route()
+    simplified = SimplifiedGraph.build(route.adjacent_list)
+    simplified.save(path)
+    print(f"Simplified graph saved to {path}: {len(simplified.core)} of {len(route.adjacent_list)} nodes, "
+          f"{simplified.core.num_edges} of {route.adjacent_list.num_edges} edges.")
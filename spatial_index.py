@@ -0,0 +1,222 @@
+import math
+import numpy as np
+
+RADI_TERRA = 6371008.8
+
+def haversine_array(lon, lat, lons, lats):
+    """
+    Calcula (vectoritzadament) la distància haversine en metres entre una o més coordenades i un conjunt de nodes.
+
+    PRE: lon i lat són escalars o vectors columna en graus; lons i lats són vectors en graus.
+    POST: retorna un array amb les distàncies en metres (amb broadcasting de numpy).
+    """
+    lon, lat, lons, lats = map(np.radians, (lon, lat, lons, lats))
+    h = np.sin((lats - lat) / 2)**2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2)**2
+    return 2 * RADI_TERRA * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+def unit_vectors(lons, lats):
+    """
+    Converteix coordenades en vectors unitaris 3D sobre l'esfera.
+
+    PRE: lons i lats són arrays en graus.
+    POST: retorna un array N x 3. La corda entre dos vectors creix amb la distància haversine, de manera que
+        el node més proper és el de producte escalar màxim.
+    """
+    lons, lats = np.radians(lons), np.radians(lats)
+    cos_lats = np.cos(lats)
+    return np.stack((cos_lats * np.cos(lons), cos_lats * np.sin(lons), np.sin(lats)), axis=-1)
+
+class SpatialIndex():
+    """
+    Índex espacial de cubetes en graella uniforme (en graus) per trobar el node més proper amb distància haversine.
+    """
+    MAX_ANELLS = 16
+
+    def __init__(self, coordinates_nodes: dict, cell_size=None):
+        self.ids = list(coordinates_nodes.keys())
+        coords = np.array([coordinates_nodes[_id] for _id in self.ids], dtype=np.float64).reshape(-1, 2)
+        self.lons, self.lats = np.ascontiguousarray(coords[:, 0]), np.ascontiguousarray(coords[:, 1])
+        self.unit = unit_vectors(self.lons, self.lats)
+        self.cell_size = cell_size or self.default_cell_size()
+        # Cota inferior de cos(latitud) de qualsevol node, per fitar la distància en longitud.
+        self.cos_min = math.cos(math.radians(float(np.abs(self.lats).max()))) if self.ids else 1.0
+        self.cells = self.build_cells()
+        # Taula de veïnats per a nearest_many, construïda a la primera consulta.
+        self.veinats = None
+
+    def default_cell_size(self):
+        """
+        Tria una mida de cel·la perquè cada cel·la tingui de l'ordre de quatre nodes.
+
+        PRE: self.lons i self.lats contenen les coordenades dels nodes.
+        POST: retorna la mida de la cel·la en graus.
+        """
+        if len(self.ids) < 2:
+            return 1.0
+        area = max(np.ptp(self.lons), 1e-6) * max(np.ptp(self.lats), 1e-6)
+        return max(math.sqrt(area / len(self.ids) * 4), 1e-5)
+
+    def build_cells(self) -> dict:
+        """
+        Agrupa els índexs dels nodes per cel·la de la graella.
+
+        PRE: self.cell_size és la mida de la cel·la en graus.
+        POST: retorna un diccionari (columna, fila) -> array d'índexs de nodes.
+        """
+        columnes = np.floor(self.lons / self.cell_size).astype(np.int64)
+        files = np.floor(self.lats / self.cell_size).astype(np.int64)
+        ordre = np.lexsort((files, columnes))
+        claus = np.stack((columnes[ordre], files[ordre]), axis=1)
+        if len(ordre) == 0:
+            return {}
+        inicis = np.flatnonzero(np.any(np.diff(claus, axis=0) != 0, axis=1)) + 1
+        return {(int(claus[grup[0], 0]), int(claus[grup[0], 1])): ordre[grup[0]:grup[-1] + 1]
+                for grup in np.split(np.arange(len(ordre)), inicis)}
+
+    def lower_bound(self, lat, dlon, dlat):
+        """
+        Fita inferior de la distància haversine a qualsevol punt separat almenys dlon o dlat graus.
+
+        PRE: lat és la latitud de la consulta; dlon i dlat són desplaçaments no negatius en graus
+            (escalars o arrays de la mateixa forma).
+        POST: retorna la distància mínima en metres.
+        """
+        cota_lat = RADI_TERRA * np.radians(dlat)
+        sin_lon = np.sqrt(np.cos(np.radians(lat)) * self.cos_min) * np.sin(np.minimum(np.radians(dlon), math.pi) / 2)
+        cota_lon = 2 * RADI_TERRA * np.arcsin(np.minimum(1.0, sin_lon))
+        return np.minimum(cota_lat, cota_lon)
+
+    def nearest(self, coordinates):
+        """
+        Troba el node més proper a unes coordenades recorrent anells de cel·les al voltant de la consulta.
+
+        PRE: coordenades és una tupla amb longitud i latitud.
+        POST: retorna l'ID del node més proper (None si l'índex és buit).
+        """
+        if not self.ids:
+            return None
+        lon, lat = coordinates
+        cell = self.cell_size
+        columna, fila = math.floor(lon / cell), math.floor(lat / cell)
+        millor, millor_dist = None, float('inf')
+        radi = 0
+        while radi <= self.MAX_ANELLS:
+            candidats = [self.cells[clau] for clau in self.ring(columna, fila, radi) if clau in self.cells]
+            if candidats:
+                indexs = np.concatenate(candidats)
+                dists = haversine_array(lon, lat, self.lons[indexs], self.lats[indexs])
+                k = int(np.argmin(dists))
+                if dists[k] < millor_dist:
+                    millor, millor_dist = int(indexs[k]), float(dists[k])
+            dlon = min(lon - (columna - radi) * cell, (columna + radi + 1) * cell - lon)
+            dlat = min(lat - (fila - radi) * cell, (fila + radi + 1) * cell - lat)
+            if millor is not None and millor_dist <= self.lower_bound(lat, dlon, dlat):
+                break
+            radi += 1
+        else:
+            # Consulta lluny de les dades: la cerca exhaustiva vectoritzada és més barata que seguir obrint anells.
+            millor = int(self.nearest_many([coordinates])[0])
+        return self.ids[millor]
+
+    def ring(self, columna, fila, radi):
+        """
+        Genera les claus de les cel·les a distància de Chebyshev exactament radi.
+
+        PRE: columna i fila identifiquen la cel·la central; radi >= 0.
+        POST: genera tuples (columna, fila).
+        """
+        if radi == 0:
+            yield (columna, fila)
+            return
+        for c in range(columna - radi, columna + radi + 1):
+            yield (c, fila - radi)
+            yield (c, fila + radi)
+        for f in range(fila - radi + 1, fila + radi):
+            yield (columna - radi, f)
+            yield (columna + radi, f)
+
+    def nearest_many(self, points, chunk_elements=4_000_000):
+        """
+        Troba el node més proper per a molts punts alhora. Cada punt es compara primer amb els nodes de les
+        cel·les veïnes (la seva i les vuit del voltant); només els punts on aquestes cel·les són buides o no
+        garanteixen el mínim passen al producte de matrius entre vectors unitaris amb tots els nodes.
+
+        PRE: punts és una seqüència (o array N x 2) de parelles longitud, latitud.
+            chunk_elements limita la mida de les matrius temporals.
+        POST: retorna un array d'índexs (posicions a self.ids) del node més proper a cada punt.
+        """
+        punts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        resultat = np.empty(len(punts), dtype=np.int64)
+        if not self.ids:
+            raise ValueError("The spatial index is empty.")
+        pendents = self.nearest_in_cells(punts, resultat, chunk_elements)
+        pas = max(1, chunk_elements // len(self.ids))
+        for inici in range(0, len(pendents), pas):
+            grup = pendents[inici:inici + pas]
+            bloc = unit_vectors(punts[grup, 0], punts[grup, 1])
+            resultat[grup] = np.argmax(bloc @ self.unit.T, axis=1)
+        return resultat
+
+    def build_neighbourhoods(self):
+        """
+        Prepara, per a cada cel·la amb algun node a distància de Chebyshev 1, la llista de nodes de les nou
+        cel·les del seu veïnat, en una taula rectangular perquè nearest_in_cells la pugui indexar de cop.
+
+        PRE: self.cells és la graella de nodes.
+        POST: retorna (origen, files, taula): origen és la (columna, fila) de la cantonada de la graella, files
+            un array 2D que dona la fila de la taula de cada cel·la (-1 si el veïnat és buit) i taula un array
+            d'índexs de nodes; les files curtes es completen repetint el primer node.
+        """
+        if not self.cells:
+            return (0, 0), np.full((0, 0), -1, dtype=np.int64), np.zeros((0, 1), dtype=np.int64)
+        claus = np.array(list(self.cells), dtype=np.int64)
+        origen = claus.min(axis=0) - 1
+        files = np.full(tuple(claus.max(axis=0) - origen + 2), -1, dtype=np.int64)
+        veinats = []
+        for columna in range(files.shape[0]):
+            for fila in range(files.shape[1]):
+                c, f = columna + int(origen[0]), fila + int(origen[1])
+                candidats = [self.cells[clau] for radi in (0, 1) for clau in self.ring(c, f, radi) if clau in self.cells]
+                if candidats:
+                    files[columna, fila] = len(veinats)
+                    veinats.append(np.concatenate(candidats))
+        taula = np.empty((len(veinats), max(map(len, veinats))), dtype=np.int64)
+        for fila, veinat in enumerate(veinats):
+            taula[fila, :len(veinat)] = veinat
+            taula[fila, len(veinat):] = veinat[0]
+        return (int(origen[0]), int(origen[1])), files, taula
+
+    def nearest_in_cells(self, punts, resultat, chunk_elements=4_000_000):
+        """
+        Resol amb la graella els punts el node més proper dels quals és segur dins de les cel·les veïnes.
+
+        PRE: punts és un array N x 2 de longituds i latituds; resultat és un array d'N enters.
+        POST: omple resultat per als punts resolts i retorna l'array de posicions dels punts pendents.
+        """
+        if self.veinats is None:
+            self.veinats = self.build_neighbourhoods()
+        (columna0, fila0), files, taula = self.veinats
+        cell = self.cell_size
+        columnes = np.floor(punts[:, 0] / cell).astype(np.int64)
+        fileres = np.floor(punts[:, 1] / cell).astype(np.int64)
+        c, f = columnes - columna0, fileres - fila0
+        dins = (c >= 0) & (c < files.shape[0]) & (f >= 0) & (f < files.shape[1])
+        fila_taula = np.full(len(punts), -1, dtype=np.int64)
+        fila_taula[dins] = files[c[dins], f[dins]]
+        candidats = np.flatnonzero(fila_taula >= 0)
+        resolts = np.zeros(len(punts), dtype=bool)
+        pas = max(1, chunk_elements // taula.shape[1])
+        for inici in range(0, len(candidats), pas):
+            grup = candidats[inici:inici + pas]
+            indexs = taula[fila_taula[grup]]
+            # Màxim producte escalar = mínima distància, com a nearest_many, però només amb els nodes del veïnat.
+            bloc = unit_vectors(punts[grup, 0], punts[grup, 1])
+            millors = indexs[np.arange(len(grup)), np.argmax(np.einsum('nk,nmk->nm', bloc, self.unit[indexs]), axis=1)]
+            lon, lat = punts[grup, 0], punts[grup, 1]
+            millor_dist = haversine_array(lon, lat, self.lons[millors], self.lats[millors])
+            dlon = np.minimum(lon - (columnes[grup] - 1) * cell, (columnes[grup] + 2) * cell - lon)
+            dlat = np.minimum(lat - (fileres[grup] - 1) * cell, (fileres[grup] + 2) * cell - lat)
+            segurs = millor_dist <= self.lower_bound(lat, dlon, dlat)
+            resultat[grup[segurs]] = millors[segurs]
+            resolts[grup[segurs]] = True
+        return np.flatnonzero(~resolts)
@@ -0,0 +1,115 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#----------------------------------------------------------------
+# STUB API SERVER                                               |
+#----------------------------------------------------------------
+# Minimal offline stand-in for the backend endpoints the simulators use
+# (login, car list, location and battery PATCHes), for local load tests:
+#
+#   python stub_server.py --cars 2000 &
+#   API_HOST=http://127.0.0.1:8000 python async_car.py 1
+
+CENTER_LAT, CENTER_LONG = 41.2237, 1.7253
+
+def make_cars(count: int, seed=0):
+    rng = random.Random(seed)
+    return [{
+        'car': {'licenseplate': f'SIM{i:05d}', 'battery': 100},
+        'edgedevice': {
+            'name': f'edge{i:05d}',
+            'latitude': CENTER_LAT + rng.uniform(-0.01, 0.01),
+            'longitude': CENTER_LONG + rng.uniform(-0.01, 0.01),
+        },
+    } for i in range(count)]
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def count(self, key: str):
+        with self.server.lock:
+            self.server.counters[key] += 1
+
+    def do_POST(self):
+        self.read_body()
+        if self.path == '/api/v1/login/access-token':
+            self.count('login')
+            self.send_json(200, {'access_token': 'stub-token', 'token_type': 'bearer'})
+        else:
+            self.send_json(404, {'detail': 'Not Found'})
+
+    def do_GET(self):
+        if self.path == '/api/v1/car':
+            self.count('cars')
+            self.send_json(200, {'data': self.server.cars, 'count': len(self.server.cars)})
+        elif self.path == '/stats':
+            with self.server.lock:
+                stats = dict(self.server.counters)
+            stats['uptime'] = round(time.monotonic() - self.server.started, 3)
+            self.send_json(200, stats)
+        else:
+            self.send_json(404, {'detail': 'Not Found'})
+
+    def do_PATCH(self):
+        body = self.read_body()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if random.random() < self.server.fail_rate:
+            self.count('failed')
+            self.send_json(503, {'detail': 'Injected failure'})
+            return
+        if self.path.startswith('/api/v1/edge/location/'):
+            self.count('location')
+            self.send_json(200, json.loads(body or b'{}'))
+        elif self.path.startswith('/api/v1/car/'):
+            self.count('battery')
+            self.send_json(200, json.loads(body or b'{}'))
+        else:
+            self.send_json(404, {'detail': 'Not Found'})
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(host='127.0.0.1', port=8000, cars=100, fail_rate=0.0, latency=0.0):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.cars = make_cars(cars)
+    server.counters = Counter()
+    server.lock = threading.Lock()
+    server.fail_rate = fail_rate
+    server.latency = latency
+    server.started = time.monotonic()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline stub of the car/edge API for simulator load tests.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cars', type=int, default=100)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of PATCH requests answered with 503')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of artificial latency per PATCH')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.cars, args.fail_rate, args.latency)
+    print(f'Stub API listening on http://{args.host}:{args.port} with {args.cars} cars')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,169 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from instrumentation import count, stage
+
+#----------------------------------------------------------------
+# TELEMETRY PIPELINE                                            |
+#----------------------------------------------------------------
+# Location and battery updates are queued instead of being PATCHed one
+# by one. Pending updates are coalesced per edge device / license plate
+# (the latest value wins) and flushed together every flush_interval
+# seconds or as soon as batch_size updates are pending. Each flushed
+# update is retried with bounded exponential backoff. Flushes run one at
+# a time (from the background thread or from a caller), so an older batch
+# still retrying can never land after a newer one for the same key.
+
+class TelemetryPipeline():
+    def __init__(self, api_host: str, token: str, flush_interval=1.0, batch_size=50, max_pending=1000,
+                 overflow='block', max_retries=5, backoff_base=0.5, backoff_max=8.0, workers=4):
+        self.api_host = api_host
+        self.flush_interval = flush_interval
+        self.batch_size  = batch_size
+        self.max_pending = max_pending
+        self.overflow    = overflow
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max  = backoff_max
+        self.session = requests.Session()
+        self.session.headers.update({
+            'accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {token}'
+        })
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending  = {}
+        self.lock     = threading.Condition()
+        self.flushing = threading.Lock()
+        self.stopping = False
+        self.thread   = None
+        self.counters = {'submitted': 0, 'coalesced': 0, 'dropped': 0, 'sent': 0, 'failed': 0, 'retries': 0, 'flushes': 0}
+        self.flush_latency = {'last': 0.0, 'max': 0.0, 'total': 0.0}
+
+    #-----------------------------+
+    #       PRODUCERS             |
+    #-----------------------------+
+    def submit_location(self, car: dict, point: dict):
+        edge = car['edgedevice']['name']
+        location = {"latitude": point['latitude'], "longitude": point['longitude']}
+        self.submit(('location', edge), f'/api/v1/edge/location/{edge}', location, car)
+
+    def submit_battery(self, car: dict, battery: int):
+        licenseplate = car['car']['licenseplate']
+        self.submit(('battery', licenseplate), f'/api/v1/car/{licenseplate}', {'battery': battery}, car)
+
+    def submit(self, key: tuple, url: str, body: dict, car: dict):
+        """
+        Queue an update, replacing any pending update with the same key.
+
+        When max_pending distinct updates are already waiting, 'block' waits for a flush to make room
+        (backpressure on the producer) and 'drop' discards the new update.
+        """
+        with self.lock:
+            self.counters['submitted'] += 1
+            if key in self.pending:
+                self.counters['coalesced'] += 1
+            else:
+                while len(self.pending) >= self.max_pending:
+                    if self.overflow == 'drop' or self.stopping:
+                        self.counters['dropped'] += 1
+                        return
+                    self.lock.notify_all()
+                    self.lock.wait()
+            self.pending[key] = (url, body, car)
+            if len(self.pending) >= self.batch_size:
+                self.lock.notify_all()
+
+    #-----------------------------+
+    #       FLUSHING              |
+    #-----------------------------+
+    def flush(self):
+        """
+        Send every pending update and wait for the batch to finish. A flush already in progress (e.g. the
+        background one, retrying) finishes first, so on return everything submitted before the call is sent.
+        """
+        with self.flushing:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                self.lock.notify_all()
+            if not batch:
+                return
+            start = time.perf_counter()
+            for success in self.executor.map(self.send, batch.items()):
+                with self.lock:
+                    self.counters['sent' if success else 'failed'] += 1
+            latency = time.perf_counter() - start
+            with self.lock:
+                self.counters['flushes'] += 1
+                self.flush_latency['last'] = latency
+                self.flush_latency['max'] = max(self.flush_latency['max'], latency)
+                self.flush_latency['total'] += latency
+
+    def send(self, item):
+        (kind, _), (url, body, car) = item
+        for attempt in range(self.max_retries + 1):
+            try:
+                with stage('api', call=kind):
+                    response = self.session.patch(self.api_host + url, json=body)
+                response.raise_for_status()
+                if response.status_code == 200:
+                    self.apply(kind, car, body)
+                    return True
+            except requests.RequestException as error:
+                count('api_errors', call=kind)
+                print(f"Error: {error}")
+            if attempt < self.max_retries:
+                with self.lock:
+                    self.counters['retries'] += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+        return False
+
+    def apply(self, kind: str, car: dict, body: dict):
+        if kind == 'location':
+            car['edgedevice']['latitude']  = body['latitude']
+            car['edgedevice']['longitude'] = body['longitude']
+        else:
+            car['car']['battery'] = body['battery']
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.stopping and len(self.pending) < self.batch_size:
+                    self.lock.wait(self.flush_interval)
+                stopping = self.stopping
+            self.flush()
+            if stopping:
+                return
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Flush what is still pending and stop the background flusher.
+        """
+        with self.lock:
+            self.stopping = True
+            self.lock.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        self.executor.shutdown()
+
+    #-----------------------------+
+    #       METRICS               |
+    #-----------------------------+
+    def metrics(self) -> dict:
+        with self.lock:
+            flushes = self.counters['flushes']
+            return {
+                'queue_depth': len(self.pending),
+                **self.counters,
+                'flush_latency_last': self.flush_latency['last'],
+                'flush_latency_max': self.flush_latency['max'],
+                'flush_latency_avg': self.flush_latency['total'] / flushes if flushes else 0.0,
+            }
@@ -0,0 +1,25 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.routing import write_grid
+
+GRID_SIZE = 12
+
+@pytest.fixture
+def grid_dir(tmp_path, monkeypatch):
+    """
+    Temporary working directory with a synthetic street grid in inputs/ (Route reads inputs/ of the
+    working directory and writes its caches under inputs/graph_cache/).
+    """
+    write_grid(str(tmp_path), GRID_SIZE, seed=1)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def route(grid_dir):
+    from find_route import Route
+    return Route(route_cache_size=0)
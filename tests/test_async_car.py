@@ -0,0 +1,56 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+async_car = pytest.importorskip('async_car')
+
+FAILURES = 4
+
+class FakeRoute():
+    """
+    Stands in for the Route of the parent and of the workers: the first searches find no route.
+    """
+    def __init__(self):
+        self.searches = 0
+        self.reload_threads = set()
+
+    def reload_delta(self):
+        self.reload_threads.add(threading.get_ident())
+
+    def refresh_traffic(self):
+        pass
+
+    def get_random_node(self):
+        return 2.0, 41.0
+
+    def find_route(self, *args, **kwargs):
+        self.searches += 1
+        if self.searches <= FAILURES:
+            raise ValueError("No route found.")
+        return {'route': []}
+
+def test_route_errors_back_off_and_deltas_load_off_the_loop(monkeypatch):
+    route = FakeRoute()
+    monkeypatch.setattr(async_car, 'worker_route', route)
+    delays = []
+    sleep = asyncio.sleep
+
+    async def recorded_sleep(delay):
+        delays.append(delay)
+        await sleep(0)
+    monkeypatch.setattr(async_car.asyncio, 'sleep', recorded_sleep)
+    car = {'car': {'battery': 80, 'licenseplate': 'X'}, 'edgedevice': {'latitude': 41.2, 'longitude': 1.7}}
+
+    async def main():
+        with ThreadPoolExecutor(1) as executor:
+            simulator = async_car.AsyncSimulator('http://127.0.0.1:1', 'token', route, executor,
+                                                 route_backoff=0.5, max_route_backoff=2)
+            try:
+                return await simulator.next_route(car), threading.get_ident()
+            finally:
+                await simulator.close()
+    result, loop_thread = asyncio.run(main())
+    assert result == {'route': []}
+    assert delays == [0.5, 1, 2, 2]
+    assert loop_thread not in route.reload_threads
@@ -0,0 +1,19 @@
+import math
+import numpy as np
+import pytest
+
+@pytest.mark.parametrize('processes', [None, 2])
+def test_matrix_matches_search(route, processes):
+    points = [route.coordinates_nodes[node] for node in route.nodes[::17]]
+    origins, destinations = points[:4], points[2:] + points[:1]
+    matrix = route.distance_matrix(origins, destinations, processes)
+    assert matrix['cost'].shape == (len(origins), len(destinations))
+    for i, origin in enumerate(route.snap_many(origins)):
+        for j, dest in enumerate(route.snap_many(destinations)):
+            _, cost, _, _ = route.uniform_cost_search(route.adjacent_list, origin, dest)
+            assert matrix['cost'][i, j] == pytest.approx(cost) if math.isfinite(cost) else np.isinf(matrix['cost'][i, j])
+
+def test_matrix_unknown_node(route, monkeypatch):
+    monkeypatch.setattr(route, 'snap_many', lambda points: ['missing'] * len(points))
+    with pytest.raises(ValueError, match='not found'):
+        route.distance_matrix([(0, 0)], [(0, 0)])
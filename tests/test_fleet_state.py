@@ -0,0 +1,28 @@
+import numpy as np
+import fleet_state
+from fleet_state import CHARGING, DRIVING, FleetState
+from stub_server import make_cars
+
+CARS = 20
+TICKS = 900
+
+def test_fleet_invariants_hold_across_buffer_compactions(route, monkeypatch):
+    # A buffer of a few edges forces reserve_buffer to compact (or grow) it every few trips.
+    monkeypatch.setattr(fleet_state, 'BUFFER_SIZE', 8)
+    # 0.02 kWh lasts about 150 m: cars charge often and many trips need more than a full battery.
+    fleet = FleetState(route, make_cars(CARS, seed=4), seed=4, capacity=0.02)
+    compactions = 0
+    for _ in range(TICKS):
+        battery, state, used = fleet.battery.copy(), fleet.state.copy(), fleet.used
+        fleet.step(1.0)
+        compactions += fleet.used < used
+        driving = np.flatnonzero(fleet.state == DRIVING)
+        edges = fleet.buffer[fleet.position[driving]]
+        assert (fleet.edge_source[edges] == fleet.node[driving]).all()
+        assert (fleet.position[driving] < fleet.route_end[driving]).all()
+        assert (state[fleet.battery < battery] == DRIVING).all()
+        assert (state[fleet.battery > battery] == CHARGING).all()
+        assert (fleet.battery <= fleet.capacity).all()
+        assert (fleet.battery >= fleet.reserve - 1e-12).all()
+    assert compactions > 0
+    assert fleet.trips.sum() > CARS
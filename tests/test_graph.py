@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+from graph import CSRGraph
+
+def triangle(ids=('a', 'b', 'c'), distance=(10.0, 20.0, 30.0), time=(1.0, 2.0, 3.0)):
+    return CSRGraph.from_edges(list(ids), np.array([0, 1, 2]), np.array([1, 2, 0]), np.array([5.0, 6.0, 7.0]),
+                               np.array(distance), np.array(time))
+
+@pytest.mark.parametrize('changed', [
+    triangle(ids=('a', 'b', 'd')),
+    triangle(distance=(10.0, 20.0, 31.0)),
+    triangle(time=(1.0, 2.0, 4.0)),
+])
+def test_signature_covers_ids_distance_and_time(changed):
+    assert triangle().signature() == triangle().signature()
+    assert changed.signature() != triangle().signature()
@@ -0,0 +1,43 @@
+import json
+import os
+import numpy as np
+from graph_cache import compile_graph, load_graph_cache
+
+CACHE_DIR = 'inputs/graph_cache'
+CONNECTIONS = 'inputs/connection_nodes.json'
+
+def sources(route):
+    return [route.connection_nodes, route.info_nodes], (route.w_distancia, route.w_temps)
+
+def test_reloaded_graph_has_the_same_signature(grid_dir):
+    from find_route import Route
+    compiled = Route(graph_cache=None, route_cache_size=0)
+    compile_graph(compiled, CACHE_DIR)
+    reloaded = Route(graph_cache=CACHE_DIR, route_cache_size=0)
+    assert isinstance(reloaded.adjacent_list.offsets, np.memmap)
+    assert reloaded.adjacent_list.signature() == compiled.adjacent_list.signature()
+    assert reloaded.coordinates_nodes == compiled.coordinates_nodes
+
+def test_touched_source_keeps_the_cache(grid_dir):
+    from find_route import Route
+    route = Route(graph_cache=None, route_cache_size=0)
+    compile_graph(route, CACHE_DIR)
+    stat = os.stat(CONNECTIONS)
+    os.utime(CONNECTIONS, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert load_graph_cache(CACHE_DIR, *sources(route)) is not None
+
+def test_changed_source_forces_a_rebuild(grid_dir):
+    from find_route import Route
+    route = Route(graph_cache=None, route_cache_size=0)
+    compile_graph(route, CACHE_DIR)
+    with open(CONNECTIONS) as f:
+        connections = json.load(f)
+    connections[0]['time'] *= 2
+    with open(CONNECTIONS, 'w') as f:
+        json.dump(connections, f)
+    assert load_graph_cache(CACHE_DIR, *sources(route)) is None
+    changed = Route(graph_cache=CACHE_DIR, route_cache_size=0)
+    assert not isinstance(changed.adjacent_list.offsets, np.memmap)
+    assert changed.adjacent_list.signature() != route.adjacent_list.signature()
+    compile_graph(changed, CACHE_DIR)
+    assert Route(graph_cache=CACHE_DIR, route_cache_size=0).adjacent_list.signature() == changed.adjacent_list.signature()
@@ -0,0 +1,65 @@
+import heapq
+import threading
+import pytest
+import instrumentation
+from instrumentation import REGISTRY, search_stats
+
+@pytest.fixture
+def enabled():
+    previous = instrumentation.enable()
+    yield
+    instrumentation.enable(previous)
+
+def counter(name, engine):
+    return REGISTRY.counters[(name, (('engine', engine),))]
+
+def test_search_counts_settled_nodes(route, enabled):
+    import find_route
+    before = counter('search_settled', 'ucs'), counter('search_heap_pops', 'ucs')
+    route.search(route.nodes[0], route.nodes[-1], 'ucs')
+    settled, pops = counter('search_settled', 'ucs') - before[0], counter('search_heap_pops', 'ucs') - before[1]
+    assert 0 < settled <= pops
+    assert find_route.heapq is heapq
+
+def test_concurrent_searches_are_not_mixed(route, enabled):
+    import find_route
+    inside, release = threading.Event(), threading.Event()
+    counters = []
+
+    def outer():
+        with search_stats('outer', *find_route.SEARCH_MODULES) as counting:
+            counters.append(counting)
+            inside.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=outer)
+    thread.start()
+    assert inside.wait(5)
+    unsampled = counter('search_unsampled', 'ucs')
+    with search_stats('ucs', *find_route.SEARCH_MODULES) as counting:
+        assert counting is None
+        route.uniform_cost_search(route.adjacent_list, route.nodes[0], route.nodes[-1])
+    assert counter('search_unsampled', 'ucs') == unsampled + 1
+    # The search of this thread went through the other thread's counter without being counted.
+    assert counters[0].pops == 0 and counters[0].pushes == 0
+    release.set()
+    thread.join()
+    assert find_route.heapq is heapq
+    assert not instrumentation.SWAP_LOCK.locked()
+
+def test_battery_search_counts_labels(enabled):
+    import find_route
+    before = counter('search_settled_labels', 'battery'), counter('search_settled', 'battery')
+    with search_stats('battery', *find_route.SEARCH_MODULES, unit='labels'):
+        queue = []
+        find_route.heapq.heappush(queue, (0.0, 0.0, 0))
+        find_route.heapq.heappop(queue)
+    assert counter('search_settled_labels', 'battery') == before[0] + 1
+    assert counter('search_settled', 'battery') == before[1]
+
+def test_disabled_is_a_no_op():
+    previous = instrumentation.enable(False)
+    try:
+        assert search_stats('ucs') is instrumentation.NOOP
+    finally:
+        instrumentation.enable(previous)
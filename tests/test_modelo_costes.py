@@ -0,0 +1,46 @@
+import json
+import os
+import sys
+import pytest
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'pre'))
+from modelo_costes import segmentos, sentidos
+
+@pytest.mark.parametrize('tags, esperado', [
+    ({}, (True, True)),
+    ({'oneway': 'yes'}, (True, False)),
+    ({'oneway': 'true'}, (True, False)),
+    ({'oneway': '1'}, (True, False)),
+    ({'oneway': '-1'}, (False, True)),
+    ({'oneway': 'no'}, (True, True)),
+    ({'junction': 'roundabout'}, (True, False)),
+    ({'junction': 'circular', 'highway': 'residential'}, (True, False)),
+    ({'highway': 'motorway'}, (True, False)),
+    ({'highway': 'motorway', 'oneway': 'no'}, (True, True)),
+    ({'highway': 'motorway_link'}, (True, True)),
+])
+def test_sentidos(tags, esperado):
+    assert sentidos(tags) == esperado
+
+VIAS = [
+    {'type': 'way', 'id': 1, 'nodes': [1, 2, 3], 'tags': {'highway': 'residential'}},
+    {'type': 'way', 'id': 2, 'nodes': [3, 4], 'tags': {'highway': 'residential', 'oneway': 'true'}},
+    {'type': 'way', 'id': 3, 'nodes': [4, 5, 6, 4], 'tags': {'highway': 'primary', 'junction': 'roundabout'}},
+    {'type': 'way', 'id': 4, 'nodes': [6, 7], 'tags': {'highway': 'service', 'oneway': '-1'}},
+]
+
+def test_segmentos_follow_sentidos():
+    nodo1, nodo2, _ = segmentos(VIAS)
+    assert sorted(zip(nodo1.tolist(), nodo2.tolist())) == [(1, 2), (2, 1), (2, 3), (3, 2), (3, 4), (4, 5), (5, 6), (6, 4), (7, 6)]
+
+def test_ingesta_uses_the_same_segments(tmp_path):
+    pytest.importorskip('ijson')
+    from ingesta_osm import TablaCoordenadas, iterar_conexiones
+    nodos = [{'type': 'node', 'id': i, 'lon': 1.7 + i * 1e-3, 'lat': 41.2} for i in range(1, 8)]
+    archivo = tmp_path / 'export.json'
+    archivo.write_text(json.dumps({'elements': nodos + VIAS}))
+    tabla = TablaCoordenadas.desde_archivo(str(archivo))
+    pares = [par for nodo1, nodo2, _, _ in iterar_conexiones(str(archivo), tabla) for par in zip(nodo1.tolist(), nodo2.tolist())]
+    nodo1, nodo2, _ = segmentos(VIAS)
+    assert sorted(pares) == sorted(zip(nodo1.tolist(), nodo2.tolist()))
@@ -0,0 +1,73 @@
+import time
+import pytest
+from pedestrian_state import PedestrianState
+
+mongomock = pytest.importorskip('mongomock')
+
+def street(lon, lat, vianants):
+    return {'coordenades': {'longitud': lon, 'latitud': lat}, 'vianants': vianants}
+
+def node(lon, lat):
+    return {'longitud': lon, 'latitud': lat}
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient()['cloud']['carrer']
+    collection.insert_many([street(1.0 + i / 1000, 41.0, i % 2 == 0) for i in range(10)])
+    return collection
+
+def test_initial_snapshot(collection):
+    state = PedestrianState(collection)
+    assert state.has_pedestrians(node(1.0, 41.0))
+    assert not state.has_pedestrians(node(1.001, 41.0))
+
+def test_apply_change(collection):
+    state = PedestrianState(collection)
+    document = collection.find_one({'coordenades.longitud': 1.001})
+    document['vianants'] = True
+    state.apply_change({'operationType': 'update', 'documentKey': {'_id': document['_id']}, 'fullDocument': document})
+    assert state.has_pedestrians(node(1.001, 41.0))
+    # A second street on the same node keeps it marked when the first one is deleted.
+    other = dict(street(1.001, 41.0, True), _id='other')
+    state.apply_change({'operationType': 'insert', 'documentKey': {'_id': 'other'}, 'fullDocument': other})
+    state.apply_change({'operationType': 'delete', 'documentKey': {'_id': document['_id']}})
+    assert state.has_pedestrians(node(1.001, 41.0))
+    state.apply_change({'operationType': 'delete', 'documentKey': {'_id': 'other'}})
+    assert not state.has_pedestrians(node(1.001, 41.0))
+
+def test_polling_fallback(collection):
+    state = PedestrianState(collection, poll_interval=0.02).start()
+    try:
+        collection.update_one({'coordenades.longitud': 1.001}, {'$set': {'vianants': True}})
+        collection.update_one({'coordenades.longitud': 1.0}, {'$set': {'vianants': False}})
+        deadline = time.monotonic() + 5
+        while not state.has_pedestrians(node(1.001, 41.0)) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert state.mode == 'polling'
+        assert state.has_pedestrians(node(1.001, 41.0))
+        assert not state.has_pedestrians(node(1.0, 41.0))
+    finally:
+        state.stop()
+
+def test_lookahead(collection):
+    state = PedestrianState(collection)
+    ruta = [node(1.0 + i / 1000, 41.0) for i in range(10)]
+    assert state.lookahead(ruta, ruta[0], 3) == [False, True, False]
+    assert state.lookahead(ruta, ruta[8], 3) == [False]
+    assert state.lookahead(ruta, ruta[9], 3) == []
+    with pytest.raises(ValueError):
+        state.lookahead(ruta, node(2.0, 41.0))
+
+def test_lookahead_after_route_changes_in_place(collection):
+    state = PedestrianState(collection)
+    ruta = [node(1.0 + i / 1000, 41.0) for i in range(10)]
+    assert state.position(ruta, ruta[5]) == 5
+    # Same length and endpoints, middle nodes swapped.
+    ruta[4], ruta[5] = ruta[5], ruta[4]
+    assert state.position(ruta, ruta[5]) == 5
+    ruta.insert(0, node(1.5, 41.0))
+    assert state.position(ruta, ruta[5]) == 5
+    assert state.lookahead(ruta, ruta[0], 2) == [True, False]
+    del ruta[3:]
+    with pytest.raises(ValueError):
+        state.position(ruta, node(1.005, 41.0))
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from find_route import MAX_CUSTOM_PROFILES, Route
+from test_search import PAIRS, random_pairs, same_cost
+
+@pytest.mark.parametrize('engine', ['ucs', 'astar', 'bidirectional', 'ch'])
+def test_shortest_minimises_distance(route, engine):
+    base = route.as_graph(route.adjacent_list)
+    by_distance = base.with_weights(np.asarray(base.distance, dtype=np.float64))
+    for origin, dest in random_pairs(route, PAIRS, seed=4):
+        _, expected, _, _ = route.uniform_cost_search(by_distance, origin, dest)
+        _, _, dist, _ = route.search(origin, dest, engine, profile='shortest')
+        assert same_cost(dist, expected), (origin, dest)
+
+def test_custom_profiles_do_not_share_cached_routes(grid_dir):
+    # (1, 1) and (2, 2) choose the same paths at different costs, so a shared entry would show in the cost.
+    profiles = [(1, 1), (2, 2), (0.2, 0.8), (0.8, 0.2)] + [(1, w) for w in range(3, 3 + MAX_CUSTOM_PROFILES)]
+    cached = Route(route_cache_size=4096)
+    fresh = Route(route_cache_size=0)
+    pairs = random_pairs(cached, PAIRS // 4, seed=5)
+    for _ in range(2):
+        # The second round comes back to profiles evicted from the custom profile graphs.
+        for profile in profiles:
+            for origin, dest in pairs:
+                assert cached.search(origin, dest, profile=profile) == fresh.search(origin, dest, profile=profile), (profile, origin, dest)
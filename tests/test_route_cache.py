@@ -0,0 +1,22 @@
+from find_route import Route
+
+def test_shared_store_does_not_mix_engines(grid_dir):
+    store = str(grid_dir / 'routes.sqlite')
+    ucs = Route(engine='ucs', route_cache_size=0, route_cache_path=store, simplify=False)
+    origin, dest = ucs.nodes[0], ucs.nodes[-1]
+    ucs.search(origin, dest)
+    astar = Route(engine='astar', route_cache_size=0, route_cache_path=store, simplify=False)
+    astar.search(origin, dest)
+    assert astar.route_cache.store_hits == 0
+    again = Route(engine='ucs', route_cache_size=0, route_cache_path=store, simplify=False)
+    again.search(origin, dest)
+    assert again.route_cache.store_hits == 1
+
+def test_memory_cache_hits_same_engine(route):
+    route.route_cache = type(route.route_cache)(16)
+    origin, dest = route.nodes[0], route.nodes[-1]
+    first = route.search(origin, dest, 'ucs')
+    assert route.search(origin, dest, 'ucs') == first
+    assert route.route_cache.hits == 1
+    route.search(origin, dest, 'astar')
+    assert route.route_cache.hits == 1
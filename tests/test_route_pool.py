@@ -0,0 +1,90 @@
+import json
+import multiprocessing
+import os
+import time
+import pytest
+from find_route import Route
+from route_pool import RoutePool
+from spatial_index import haversine_array
+
+REMOVED = '10000065'     # interior node of the grid
+NEW     = '20000000'     # new node next to the first corner of the grid
+
+def write_delta(route, directory='inputs/graph_deltas'):
+    """
+    Delta that removes REMOVED with its edges and adds NEW, joined both ways to the first corner of the grid.
+    """
+    with open('inputs/connection_nodes.json', 'r') as f:
+        pairs = [[c['node1'], c['node2']] for c in json.load(f) if REMOVED in (str(c['node1']), str(c['node2']))]
+    corner = route.nodes[0]
+    lon, lat = route.coordinates_nodes[corner]
+    new_lon, new_lat = lon - 0.001, lat - 0.001
+    distance = float(haversine_array(lon, lat, [new_lon], [new_lat])[0])
+    edges = [{'node1': int(u), 'node2': int(v), 'distance': distance, 'time': distance / 10} for u, v in ((corner, NEW), (NEW, corner))]
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '0001.json'), 'w') as f:
+        json.dump({'edges_removed': pairs, 'edges_added': edges, 'nodes_removed': [int(REMOVED)],
+                   'nodes_upserted': [{'node_id': int(NEW), 'coordinates': {'longitude': new_lon, 'latitude': new_lat}}]}, f)
+    return new_lon, new_lat
+
+def wait_released(pool, timeout=5):
+    deadline = time.monotonic() + timeout
+    while pool.stats()['blocks'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pool.stats()['blocks'] == 0
+
+@pytest.fixture
+def pool(route):
+    pool = RoutePool(route, 1)
+    ctx = multiprocessing.get_context('fork')
+    for car_id in range(2):
+        pool.connect(car_id, ctx.Queue())
+    pool.start()
+    yield pool
+    pool.close()
+
+def test_pooled_route_matches_route(route, pool):
+    client = pool.client(0, pool.replies[0])
+    lon, lat = route.coordinates_nodes[route.nodes[3]]
+    dest_lon, dest_lat = route.coordinates_nodes[route.nodes[-5]]
+    assert client.find_route(lat, lon, dest_lat, dest_lon) == route.find_route(lat, lon, dest_lat, dest_lon)
+    assert wait_released(pool)
+    with pytest.raises(ValueError):
+        client.find_route(lat, lon, dest_lat, dest_lon, engine='unknown')
+
+def test_identical_requests_are_computed_once(route, pool):
+    lon, lat = route.coordinates_nodes[route.nodes[3]]
+    dest_lon, dest_lat = route.coordinates_nodes[route.nodes[-5]]
+    # The second origin snaps to the same node.
+    pool.dispatch([(0, (lat, lon, dest_lat, dest_lon), {}), (1, (lat + 1e-6, lon, dest_lat, dest_lon), {})])
+    answers = [pool.replies[car_id].get(timeout=10) for car_id in range(2)]
+    assert answers[0] == answers[1] and answers[0][0] == 'ok'
+    stats = pool.stats()
+    assert stats['requests'] == 2 and stats['deduplicated'] == 1 and stats['computed'] == 1
+    for _ in answers:
+        pool.requests.put(('release', answers[0][1]))
+    assert wait_released(pool)
+
+def test_requests_follow_graph_deltas(route, pool):
+    client = pool.client(0, pool.replies[0])
+    reference = Route(route_cache_size=0)
+    removed_lon, removed_lat = route.coordinates_nodes[REMOVED]
+    dest_lon, dest_lat = route.coordinates_nodes[route.nodes[-1]]
+    new_lon, new_lat = write_delta(reference)
+    assert reference.reload_delta() == 1
+
+    # From the position of the removed node: snapped to a neighbour, as the plain Route does.
+    pooled = client.find_route(removed_lat, removed_lon, dest_lat, dest_lon)
+    assert pooled == reference.find_route(removed_lat, removed_lon, dest_lat, dest_lon)
+    assert {'longitude': removed_lon, 'latitude': removed_lat} not in pooled['route'][1:]
+    # To the new node.
+    origin_lon, origin_lat = route.coordinates_nodes[route.nodes[1]]
+    pooled = client.find_route(origin_lat, origin_lon, new_lat, new_lon)
+    assert pooled == reference.find_route(origin_lat, origin_lon, new_lat, new_lon)
+    assert pooled['route'][-2] == {'longitude': new_lon, 'latitude': new_lat}
+
+    # The random destinations come from the new graph.
+    assert pool.stats()['version'] == 1 and pool.stats()['deltas'] == 1
+    coordinates = {tuple(point) for point in client.coordinates().tolist()}
+    assert coordinates == set(reference.coordinates_nodes.values())
+    assert client.get_random_node() in coordinates
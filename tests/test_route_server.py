@@ -0,0 +1,43 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+from route_server import RouteBatcher, init_worker, warm_up
+from test_search import random_pairs
+
+WORKERS = 2
+
+@pytest.fixture
+def batcher(route):
+    executor = ProcessPoolExecutor(WORKERS, mp_context=multiprocessing.get_context('fork'),
+                                   initializer=init_worker, initargs=(route,))
+    list(executor.map(warm_up, range(WORKERS)))
+    # A long window, so that all the requests of a test go in one batch.
+    yield RouteBatcher(executor, WORKERS, window=0.5).start()
+    executor.shutdown(cancel_futures=True)
+
+def expected(route, request):
+    (long_o, lat_o), (long_d, lat_d) = request['origin'], request['destination']
+    node_o, node_d = route.snap_many([request['origin'], request['destination']])
+    try:
+        return 200, route.route_between(node_o, node_d, lat_o, long_o, lat_d, long_d, **request['options'])
+    except ValueError as error:
+        return 422, {'detail': str(error)}
+
+def test_batched_answers_match_route_in_order(route, batcher):
+    requests = [{'origin': route.coordinates_nodes[o], 'destination': route.coordinates_nodes[d], 'options': options}
+                for (o, d), options in zip(random_pairs(route, 24, seed=10), [{}, {'profile': 'shortest'}, {'price_km': 0.3}] * 8)]
+    requests.append(dict(requests[0]))
+    answers = [future.result(30) for future in [batcher.submit(request) for request in requests]]
+    assert answers == [expected(route, request) for request in requests]
+    assert sum(batcher.batches.values()) == 1
+
+def test_a_failing_request_does_not_fail_its_batch(route, batcher):
+    o, d = random_pairs(route, 1, seed=11)[0]
+    good = {'origin': route.coordinates_nodes[o], 'destination': route.coordinates_nodes[d], 'options': {}}
+    # An option route_between does not take: a TypeError in the worker, not a ValueError.
+    broken = dict(good, options={'unknown': 1})
+    invalid = dict(good, options={'engine': 'nope'})
+    answers = [future.result(30) for future in [batcher.submit(request) for request in (good, broken, invalid, good)]]
+    assert answers[0] == answers[3] == expected(route, good)
+    assert answers[1][0] == 500 and 'TypeError' in answers[1][1]['detail']
+    assert answers[2] == (422, {'detail': "Unknown search engine 'nope'."})
@@ -0,0 +1,121 @@
+import math
+import random
+import numpy as np
+import pytest
+from profiles import DEFAULT_CONSUMPTION, energy
+
+ENGINES = ('astar', 'bidirectional', 'ch')
+PAIRS = 60
+
+def random_pairs(route, count, seed=0):
+    rng = random.Random(seed)
+    return [(rng.choice(route.nodes), rng.choice(route.nodes)) for _ in range(count)]
+
+def same_cost(a, b):
+    return a == b or (math.isfinite(a) and math.isfinite(b) and abs(a - b) <= 1e-9 * max(1.0, abs(a)))
+
+@pytest.mark.parametrize('simplify', [False, True])
+@pytest.mark.parametrize('engine', ENGINES)
+def test_engine_matches_uniform_cost_search(route, engine, simplify):
+    route.simplify = simplify
+    for origin, dest in random_pairs(route, PAIRS):
+        _, expected, _, _ = route.uniform_cost_search(route.adjacent_list, origin, dest)
+        path, cost, _, _ = route.search(origin, dest, engine)
+        assert same_cost(cost, expected), (origin, dest)
+        if math.isfinite(cost):
+            assert path[0] == origin and path[-1] == dest
+
+def test_heuristic_is_a_lower_bound(route):
+    graph = route.adjacent_list
+    for origin, dest in random_pairs(route, PAIRS, seed=1):
+        _, cost, _, _ = route.uniform_cost_search(graph, origin, dest)
+        if math.isfinite(cost):
+            assert route.cost_estimator(graph, graph.index[dest])(graph.index[origin]) <= cost + 1e-12
+
+def test_default_engine_is_uniform_cost(route):
+    assert route.engine == 'ucs'
+
+def test_time_dependent_without_traffic_matches_search(route):
+    for origin, dest in random_pairs(route, PAIRS, seed=2):
+        _, expected, _, expected_time = route.search(origin, dest, 'ucs')
+        path, cost, _, time_ = route.search(origin, dest, 'td', departure=0)
+        assert same_cost(cost, expected), (origin, dest)
+        if math.isfinite(cost):
+            assert same_cost(time_, expected_time) and path[0] == origin and path[-1] == dest
+
+def test_uniform_traffic_scales_times(route):
+    from traffic import save_live
+    factor = 1.5
+    pairs = random_pairs(route, PAIRS, seed=3)
+    before = [route.search(origin, dest, 'ucs', profile='fastest') for origin, dest in pairs]
+    base = route.base()
+    save_live(base, np.full(base.num_edges, factor))
+    assert route.refresh_traffic()
+    assert np.allclose(route.adjacent_list.time, factor * np.asarray(base.time))
+    for (origin, dest), (_, cost, _, time_) in zip(pairs, before):
+        _, cost_traffic, _, time_traffic = route.search(origin, dest, 'ucs', profile='fastest')
+        if not math.isfinite(cost):
+            assert not math.isfinite(cost_traffic)
+            continue
+        # The live multipliers are stored as float32.
+        assert cost_traffic == pytest.approx(factor * cost, rel=1e-6), (origin, dest)
+        assert time_traffic == pytest.approx(factor * time_, rel=1e-6)
+        # With the same multiplier at every hour the time-dependent search is the static one on the reweighted graph.
+        _, expected, _, _ = route.search(origin, dest, 'ucs')
+        _, cost_td, _, _ = route.search(origin, dest, 'td', departure=0)
+        assert same_cost(cost_td, expected)
+
+def path_energy(route, path, consumption=DEFAULT_CONSUMPTION):
+    graph = route.as_graph(route.adjacent_list)
+    edges = graph.path_edges([graph.index[node] for node in path])
+    return float(energy(graph.distance[edges], graph.time[edges], consumption).sum())
+
+def long_pairs(route, count, seed=0):
+    """
+    Reachable pairs with a path of at least a few edges, with its cost and energy.
+    """
+    pairs = []
+    for origin, dest in random_pairs(route, 10 * count, seed):
+        path, cost, _, _ = route.search(origin, dest, 'ucs')
+        if len(path) > 4:
+            pairs.append((origin, dest, cost, path_energy(route, path)))
+    return pairs[:count]
+
+def test_battery_search_with_unlimited_battery_matches_search(route):
+    route.set_charging_stations([])
+    for origin, dest, cost, _ in long_pairs(route, PAIRS // 2, seed=6):
+        path, battery_cost, _, _, stops, charges = route.battery_search(route.adjacent_list, origin, dest, 1e9, 1e9)
+        assert same_cost(battery_cost, cost), (origin, dest)
+        assert path[0] == origin and path[-1] == dest and stops == [] and len(charges) == len(path)
+
+def test_battery_search_infeasible_start_charge(route):
+    route.set_charging_stations([{'node_id': node} for node in route.nodes])
+    origin, dest, _, needed = long_pairs(route, 1, seed=7)[0]
+    assert route.battery_search(route.adjacent_list, origin, dest, 1.0, 10.0, reserve=2.0)[:2] == ([], float('inf'))
+    # Without charging points, a charge that cannot cover the trip is infeasible too.
+    route.set_charging_stations([])
+    assert route.battery_search(route.adjacent_list, origin, dest, needed / 2, 10.0)[:2] == ([], float('inf'))
+
+def test_battery_search_stops_to_charge_above_the_reserve(route):
+    route.set_charging_stations([{'node_id': node} for node in route.nodes])
+    for origin, dest, cost, needed in long_pairs(route, PAIRS // 4, seed=8):
+        capacity, reserve = 4 * needed, 0.1 * needed
+        path, battery_cost, _, time_, stops, charges = route.battery_search(
+            route.adjacent_list, origin, dest, reserve + needed / 2, capacity, reserve=reserve)
+        assert path[0] == origin and path[-1] == dest
+        assert stops and battery_cost > cost
+        assert len(charges) == len(path) and min(charges) >= reserve - 1e-12
+        assert all(kwh > 0 and seconds > 0 for _, kwh, seconds in stops)
+
+def test_route_between_plans_charging_stops(route):
+    route.set_charging_stations([{'node_id': node} for node in route.nodes])
+    origin, dest, _, needed = long_pairs(route, 1, seed=9)[0]
+    (lon_o, lat_o), (lon_d, lat_d) = route.coordinates_nodes[origin], route.coordinates_nodes[dest]
+    capacity = 4 * needed
+    reserve = 10
+    battery = reserve + needed / 2 / capacity * 100
+    result = route.route_between(origin, dest, lat_o, lon_o, lat_d, lon_d, consumption=DEFAULT_CONSUMPTION,
+                                 capacity=capacity, battery=battery, reserve=reserve)
+    assert result['charging_stops']
+    assert min(result['battery']) >= reserve - 0.01
+    assert len(result['battery']) == len(result['route'])
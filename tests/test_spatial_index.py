@@ -0,0 +1,26 @@
+import random
+import numpy as np
+from benchmarks.routing import GRID_ORIGIN, GRID_SPACING
+from conftest import GRID_SIZE
+
+POINTS = 300
+
+def random_points(count, margin, seed=0):
+    rng = random.Random(seed)
+    width, height = GRID_SIZE * GRID_SPACING * 1.33, GRID_SIZE * GRID_SPACING
+    return [(GRID_ORIGIN[0] - margin * width + rng.random() * (1 + 2 * margin) * width,
+             GRID_ORIGIN[1] - margin * height + rng.random() * (1 + 2 * margin) * height) for _ in range(count)]
+
+def test_snap_many_matches_linear_search(route):
+    # Points inside the grid use the cells; the ones far outside it fall back to the product of matrices.
+    points = random_points(POINTS, 0.1) + random_points(POINTS // 10, 20, seed=1)
+    for point, node in zip(points, route.snap_many(points)):
+        # A copy of the coordinates, so find_closest_node checks every node instead of using the index.
+        closest = route.find_closest_node(point, dict(route.coordinates_nodes))
+        assert route.haversine_distance(point, route.coordinates_nodes[node]) \
+            <= route.haversine_distance(point, route.coordinates_nodes[closest]) + 1e-6
+
+def test_points_inside_the_grid_use_the_cells(route):
+    points = np.asarray(random_points(POINTS, 0.0, seed=2))
+    pending = route.spatial_index.nearest_in_cells(points, np.empty(len(points), dtype=np.int64))
+    assert len(pending) < len(points) // 10
@@ -0,0 +1,93 @@
+import threading
+import time
+import requests
+from telemetry import TelemetryPipeline
+
+class FakeResponse():
+    status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+class FakeSession():
+    """
+    Records the PATCHes it receives; `fail` is a set of (url, latitude) that fail once.
+    """
+    def __init__(self, fail=()):
+        self.received = []
+        self.fail     = set(fail)
+        self.failed   = threading.Event()
+        self.lock     = threading.Lock()
+
+    def patch(self, url, json):
+        key = (url, json.get('latitude'))
+        with self.lock:
+            if key in self.fail:
+                self.fail.discard(key)
+                self.failed.set()
+                raise requests.ConnectionError('unavailable')
+            self.received.append((url, dict(json)))
+        return FakeResponse()
+
+def make_car(name='edge0', plate='CAR0'):
+    return {'car': {'licenseplate': plate, 'battery': 100}, 'edgedevice': {'name': name, 'latitude': 0.0, 'longitude': 0.0}}
+
+def pipeline(session, **options):
+    telemetry = TelemetryPipeline('', 'token', **options)
+    telemetry.session = session
+    return telemetry
+
+def test_updates_are_coalesced_per_key():
+    session = FakeSession()
+    telemetry = pipeline(session)
+    car = make_car()
+    for i in range(3):
+        telemetry.submit_location(car, {'latitude': i, 'longitude': i})
+    telemetry.submit_battery(car, 90)
+    telemetry.submit_battery(car, 89)
+    telemetry.flush()
+    assert sorted(session.received, key=lambda r: r[0]) == [
+        ('/api/v1/car/CAR0', {'battery': 89}),
+        ('/api/v1/edge/location/edge0', {'latitude': 2, 'longitude': 2}),
+    ]
+    assert telemetry.metrics()['coalesced'] == 3
+    assert car['edgedevice']['latitude'] == 2 and car['car']['battery'] == 89
+
+def test_retried_batch_does_not_overwrite_newer_update():
+    session = FakeSession(fail={('/api/v1/edge/location/edge0', 1)})
+    telemetry = pipeline(session, backoff_base=0.2, backoff_max=0.2)
+    car = make_car()
+    telemetry.submit_location(car, {'latitude': 1, 'longitude': 1})
+    background = threading.Thread(target=telemetry.flush)
+    background.start()
+    assert session.failed.wait(5)
+    # The first batch is sleeping in backoff: a newer position is flushed from the caller.
+    telemetry.submit_location(car, {'latitude': 2, 'longitude': 2})
+    telemetry.flush()
+    assert [body['latitude'] for _, body in session.received] == [1, 2]
+    assert car['edgedevice']['latitude'] == 2
+    background.join()
+    assert telemetry.metrics()['retries'] == 1
+
+def test_block_overflow_waits_for_a_flush():
+    session = FakeSession()
+    telemetry = pipeline(session, max_pending=2, batch_size=100)
+    for i in range(2):
+        telemetry.submit_location(make_car(f'edge{i}'), {'latitude': i, 'longitude': i})
+    producer = threading.Thread(target=telemetry.submit_location, args=(make_car('edge2'), {'latitude': 2, 'longitude': 2}))
+    producer.start()
+    time.sleep(0.1)
+    assert producer.is_alive()
+    telemetry.flush()
+    producer.join(5)
+    assert not producer.is_alive()
+    assert telemetry.metrics()['queue_depth'] == 1
+
+def test_drop_overflow_discards_new_keys():
+    telemetry = pipeline(FakeSession(), max_pending=2, overflow='drop')
+    for i in range(3):
+        telemetry.submit_location(make_car(f'edge{i}'), {'latitude': i, 'longitude': i})
+    # Updates of an already pending key are still accepted.
+    telemetry.submit_location(make_car('edge0'), {'latitude': 5, 'longitude': 5})
+    metrics = telemetry.metrics()
+    assert metrics['dropped'] == 1 and metrics['queue_depth'] == 2 and metrics['coalesced'] == 1
@@ -0,0 +1,187 @@
+import argparse
+import os
+import time
+import numpy as np
+from graph import CSRGraph
+
+TRAFFIC_DIR = "inputs/traffic"
+SLOTS = 24
+
+def save_npz(path, **arrays):
+    """
+    Desa arrays en un fitxer .npz de manera atòmica (fitxer temporal + os.replace).
+    """
+    directori = os.path.dirname(path)
+    if directori:
+        os.makedirs(directori, exist_ok=True)
+    temporal = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez(temporal, **arrays)
+    os.replace(temporal, path)
+
+def load_npz(path, graph: CSRGraph):
+    """
+    Carrega un fitxer .npz de trànsit si està alineat amb les arestes del graf (mateixa signatura).
+
+    PRE: path és un fitxer desat per save_profiles o save_live; graf és el CSRGraph base.
+    POST: retorna un diccionari nom -> array, o None si no existeix o és d'un altre graf.
+    """
+    try:
+        with np.load(path) as dades:
+            if str(dades['signature']) != graph.signature():
+                return None
+            return {nom: dades[nom] for nom in dades.files}
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_profiles(graph: CSRGraph, table, edge_profile, directory=TRAFFIC_DIR):
+    """
+    Desa els perfils horaris: table[p, franja] és el multiplicador del temps del perfil p a cada franja
+    i edge_profile[aresta] és el perfil de cada aresta del graf.
+    """
+    save_npz(os.path.join(directory, "profiles.npz"), table=np.asarray(table, dtype=np.float32),
+             edge_profile=np.asarray(edge_profile, dtype=np.int16), signature=np.array(graph.signature()))
+
+def save_live(graph: CSRGraph, multipliers, directory=TRAFFIC_DIR):
+    """
+    Desa els multiplicadors del temps en directe (un per aresta del graf).
+    """
+    save_npz(os.path.join(directory, "live.npz"), multipliers=np.asarray(multipliers, dtype=np.float32),
+             signature=np.array(graph.signature()))
+
+class TrafficModel():
+    """
+    Multiplicadors del temps de cada aresta: perfils per franja horària (table i edge_profile) i trànsit en directe
+    (live), tots alineats amb les arestes del graf base.
+
+    El temps efectiu d'una aresta a la franja s és time * table[edge_profile, s] * live.
+    """
+    def __init__(self, num_edges, table=None, edge_profile=None, live=None):
+        self.table        = np.ones((1, SLOTS), dtype=np.float32) if table is None else np.asarray(table, dtype=np.float32)
+        self.edge_profile = np.zeros(num_edges, dtype=np.int16) if edge_profile is None else np.asarray(edge_profile)
+        self.live         = np.ones(num_edges, dtype=np.float32) if live is None else np.array(live, dtype=np.float32)
+        self.live_mtime   = None
+        self.version      = 0
+        self._factors     = {}
+
+    @classmethod
+    def load(cls, graph: CSRGraph, directory=TRAFFIC_DIR):
+        """
+        Carrega els perfils i el trànsit en directe del directori; el que falti o sigui d'un altre graf és neutre (1).
+        """
+        perfils = load_npz(os.path.join(directory, "profiles.npz"), graph) or {}
+        model = cls(graph.num_edges, perfils.get('table'), perfils.get('edge_profile'))
+        model.refresh(graph, directory)
+        return model
+
+    @property
+    def slots(self):
+        return self.table.shape[1]
+
+    @property
+    def neutral(self):
+        return bool((self.table == 1).all() and (self.live == 1).all())
+
+    def slot(self, when=None):
+        """
+        Retorna la franja horària (hora local) d'un instant en segons des de l'època (per defecte, ara).
+        """
+        hora = time.localtime(time.time() if when is None else when)
+        return (hora.tm_hour * 3600 + hora.tm_min * 60 + hora.tm_sec) * self.slots // 86400
+
+    def factors(self, slot: int):
+        """
+        Retorna (i desa) els multiplicadors de totes les arestes a una franja, en una sola operació vectorial.
+        """
+        if slot not in self._factors:
+            self._factors[slot] = self.table[self.edge_profile, slot].astype(np.float64) * self.live
+        return self._factors[slot]
+
+    def lower_bound(self):
+        """
+        Retorna el multiplicador mínim de cada aresta en qualsevol franja (per a una heurística admissible).
+        """
+        return self.table.min(axis=1)[self.edge_profile].astype(np.float64) * self.live
+
+    def set_live(self, multipliers):
+        self.live = np.array(multipliers, dtype=np.float32)
+        self.changed()
+
+    def update_live(self, edges, multipliers):
+        """
+        Actualitza el trànsit en directe d'unes arestes concretes.
+        """
+        self.live[np.asarray(edges, dtype=np.int64)] = multipliers
+        self.changed()
+
+    def changed(self):
+        self._factors = {}
+        self.version += 1
+
+    def refresh(self, graph: CSRGraph, directory=TRAFFIC_DIR):
+        """
+        Torna a llegir el trànsit en directe si el fitxer ha canviat des de l'última lectura.
+
+        PRE: graf és el CSRGraph base; directori com a load.
+        POST: retorna True si els multiplicadors han canviat.
+        """
+        path = os.path.join(directory, "live.npz")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime == self.live_mtime:
+            return False
+        self.live_mtime = mtime
+        dades = load_npz(path, graph) if mtime is not None else None
+        live = dades['multipliers'] if dades is not None else np.ones(graph.num_edges, dtype=np.float32)
+        if np.array_equal(live, self.live):
+            return False
+        self.set_live(live)
+        return True
+
+def default_profiles(graph: CSRGraph):
+    """
+    Perfils per defecte: les vies ràpides (> 40 km/h) s'alenteixen a les hores punta i la resta poc.
+
+    PRE: graf és el CSRGraph base.
+    POST: retorna (table, edge_profile) per a save_profiles.
+    """
+    hores = np.arange(SLOTS)
+    punta = np.exp(-0.5 * ((hores - 8) / 1.0) ** 2) + np.exp(-0.5 * ((hores - 18.5) / 1.2) ** 2)
+    table = np.vstack([1 + 0.2 * punta, 1 + 0.8 * punta]).astype(np.float32)
+    velocitat = np.asarray(graph.distance, dtype=np.float64) / np.maximum(np.asarray(graph.time, dtype=np.float64), 1e-9) * 3.6
+    return table, (velocitat > 40).astype(np.int16)
+
+def congestion(graph: CSRGraph, lon, lat, radius, factor):
+    """
+    Multiplicadors en directe amb una congestió (factor) a les arestes que surten de nodes a menys de radius metres.
+    """
+    from spatial_index import haversine_array
+    coordenades = np.asarray(graph.coordinates)
+    propers = haversine_array(lon, lat, coordenades[:, 0], coordenades[:, 1]) <= radius
+    multiplicadors = np.ones(graph.num_edges, dtype=np.float32)
+    multiplicadors[propers[graph.sources()]] = factor
+    return multiplicadors
+
+if __name__ == '__main__':
+    from find_route import Route
+    parser = argparse.ArgumentParser(description='Perfils horaris i trànsit en directe del graf.')
+    parser.add_argument('--directory', default=TRAFFIC_DIR)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('profiles', help='desa els perfils horaris per defecte')
+    congest = subparsers.add_parser('congest', help='simula una congestió al voltant d\'un punt')
+    congest.add_argument('longitude', type=float)
+    congest.add_argument('latitude', type=float)
+    congest.add_argument('--radius', type=float, default=300)
+    congest.add_argument('--factor', type=float, default=3.0)
+    subparsers.add_parser('clear', help='elimina el trànsit en directe')
+    args = parser.parse_args()
+
+    graph = Route(simplify=False).adjacent_list
+    if args.command == 'profiles':
+        save_profiles(graph, *default_profiles(graph), directory=args.directory)
+    elif args.command == 'congest':
+        save_live(graph, congestion(graph, args.longitude, args.latitude, args.radius, args.factor), args.directory)
+    else:
+        save_live(graph, np.ones(graph.num_edges), args.directory)
+    print(f"Traffic data written to {args.directory}.")
@@ -6,7 +6,12 @@ import select
 import requests
 import multiprocessing
 from dotenv import load_dotenv
+from battery import RESERVE_BATTERY
 from find_route import Route
+from instrumentation import count, stage
+from profiles import DEFAULT_CONSUMPTION
+from route_pool import RoutePool
+from telemetry import TelemetryPipeline
 
 #----------------------------------------------------------------
 # FUNCIONES                                                     |
@@ -38,19 +43,37 @@ def obtain_token(url, username, password):
 #       ROUTE EXECUTION       |
 #-----------------------------+
 
-def execute_route(car: dict, route: dict, token: str):
+def execute_route(car: dict, route: dict, token: str, telemetry: TelemetryPipeline = None):
     battery = car['car']['battery']
     desc_battery = 0
+    # Battery level at each point of the route (with the charging stops), when it was planned with the battery.
+    levels = route.get('battery')
 
-    for point in route['route']:
+    for i, point in enumerate(route['route']):
         time.sleep(0.5)
         desc_battery += 1
         print(point)
-        update_location(car, point, token)
-        if (desc_battery == 20):
+        if telemetry is None:
+            update_location(car, point, token)
+        else:
+            telemetry.submit_location(car, point)
+        if levels is not None:
+            if round(levels[i]) == battery:
+                continue
+            battery = round(levels[i])
+        elif (desc_battery == 20):
             battery -= 1
             desc_battery = 0
+        else:
+            continue
+        if telemetry is None:
             update_battery(car, battery, token)
+        else:
+            telemetry.submit_battery(car, battery)
+    if telemetry is not None:
+        # The next route starts from the last acknowledged location.
+        telemetry.flush()
+        print(telemetry.metrics())
 
 
 #-----------------------------+
@@ -74,13 +97,15 @@ def update_location(car: dict, point: tuple, token: str):
     success = False
     while success is False:
         try:
-            response = requests.patch(url, headers=headers, json=location)
+            with stage('api', call='location'):
+                response = requests.patch(url, headers=headers, json=location)
             response.raise_for_status()
             if response.status_code == 200:
                 car['edgedevice']['latitude']  = latitude
                 car['edgedevice']['longitude'] = longitude
                 success = True
         except requests.RequestException as error:
+            count('api_errors', call='location')
             print(f"Error: {error}")
 
         time.sleep(2)
@@ -101,12 +126,14 @@ def update_battery(car: dict, battery: int, token: str):
     success = False
     while success is False:
         try:
-            response = requests.patch(url, headers=headers, json=body)
+            with stage('api', call='battery'):
+                response = requests.patch(url, headers=headers, json=body)
             response.raise_for_status()
             if response.status_code == 200:
                 car['car']['battery'] = battery
                 success = True
         except requests.RequestException as error:
+            count('api_errors', call='battery')
             print(f"Error: {error}")
         time.sleep(2)
 
@@ -115,9 +142,26 @@ def update_battery(car: dict, battery: int, token: str):
 #-----------------------------+
 def run_car(car: dict, q: multiprocessing.Queue, route: Route, token: str):
     """
-    Run the car autonomously around the city.
+    Run the car autonomously around the city. `route` is the Route or a RouteClient of the shared route pool.
     """
+    telemetry = None
+    if float(os.getenv('TELEMETRY_FLUSH_INTERVAL', 1.0)) > 0:
+        # One pipeline per car process: at most one pending location and one pending battery update,
+        # so only the flush interval matters (batch_size and max_pending never trigger).
+        telemetry = TelemetryPipeline(api_host, token, flush_interval=float(os.getenv('TELEMETRY_FLUSH_INTERVAL', 1.0)),
+                                      workers=2).start()
+    consumption = float(os.getenv('CAR_CONSUMPTION', DEFAULT_CONSUMPTION))
+    capacity    = float(os.getenv('CAR_CAPACITY', 50))
     while True:
+        route.reload_delta()
+        route.refresh_traffic()
+        if car['car']['battery'] <= RESERVE_BATTERY:
+            # Nowhere to go on the reserve: the car is recharged where it stands.
+            if telemetry is None:
+                update_battery(car, 100, token)
+            else:
+                telemetry.submit_battery(car, 100)
+                telemetry.flush()
         latitude  = float(car['edgedevice']['latitude'])
         longitude = float(car['edgedevice']['longitude'])
         dest_lat  = latitude
@@ -126,11 +170,14 @@ def run_car(car: dict, q: multiprocessing.Queue, route: Route, token: str):
         while dest_lat == latitude and dest_long == longitude or success is False:
             dest_long, dest_lat = route.get_random_node()
             try:
-                car_route = route.find_route(latitude, longitude, dest_lat, dest_long)
+                with stage('find_route'):
+                    car_route = route.find_route(latitude, longitude, dest_lat, dest_long, consumption=consumption,
+                                                 capacity=capacity, battery=car['car']['battery'])
                 success = True
             except Exception as e:
+                count('route_errors')
                 print(f"Error: {e}")
-        execute_route(car, car_route, token)
+        execute_route(car, car_route, token, telemetry)
         print(f"""Finished route for car {car['car']['licenseplate']}""")
 
 
@@ -142,7 +189,7 @@ if __name__ == '__main__':
     password = os.getenv('PASSWORD')
     token_url = '/api/v1/login/access-token'
 
-    route = Route()
+    route = Route(route_cache_path=os.getenv('ROUTE_CACHE_PATH'))
 
     token = obtain_token(api_host+token_url, username, password)
     headers = {
@@ -153,12 +200,26 @@ if __name__ == '__main__':
     result = requests.get(api_host+'/api/v1/car')
     cars = result.json()
 
+    # The routes of all cars are computed by one shared pool of workers (ROUTE_WORKERS=0: one Route per car).
+    workers = int(os.getenv('ROUTE_WORKERS', os.cpu_count() or 1))
+    pool = RoutePool(route, workers) if workers > 0 else None
+
     q = []
     p = []
     ctx = multiprocessing.get_context('fork')
-    for car in cars['data']:
+    for i, car in enumerate(cars['data']):
         q_aux = ctx.Queue()
-        p_aux = ctx.Process(target=run_car, args=(car, q_aux, route, token,))
+        car_route = route
+        if pool is not None:
+            # The queue of the car is the channel of its route replies.
+            pool.connect(i, q_aux)
+            car_route = pool.client(i, q_aux)
+        p_aux = ctx.Process(target=run_car, args=(car, q_aux, car_route, token,))
         p_aux.start()
         q.append(q_aux)
-        p.append(p_aux)
\ No newline at end of file
+        p.append(p_aux)
+    if pool is not None:
+        pool.start()
+        for p_aux in p:
+            p_aux.join()
+        pool.close()
\ No newline at end of file